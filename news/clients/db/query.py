@@ -1,15 +1,52 @@
+import hashlib
+import heapq
+import itertools
+import math
+from datetime import datetime, timedelta
+from typing import Optional
+
 from redis_lock import Lock
 from rq.decorators import job
 
-from news.lib.cache import cache
+from news.lib.cache import cache, DEFAULT_CACHE_TTL, REBUILD_LEASE_TTL
+from news.lib.cache_codecs import TuplesCodec
 from news.clients.db.sorts import sorts
-from news.lib.metrics import CACHE_MISSES, CACHE_HITS
 from news.lib.sorts import sort_tuples
 from news.lib.task_queue import redis_conn
 from news.lib.utils.time_utils import epoch_seconds
 from news.models.comment import CommentTree
 
+# depth of link queries which weren't sized yet
 PRECOMPUTE_LIMIT = 1000
+# queries are sized by news.scripts.size_link_queries within these depths
+MIN_QUERY_DEPTH = 100
+MAX_QUERY_DEPTH = 5000
+# memory all link queries may use together
+QUERY_MEMORY_BUDGET = 256 * 1024 * 1024
+# hash of depths of queries and hash of how deep were queries read since they were sized
+DEPTHS_KEY = "qdepth"
+READS_KEY = "qreads"
+MAX_MERGED_LINKS = 1000
+# merged listings are built at least this deep, deeper pages rebuild them deeper
+MIN_MERGED_DEPTH = 100
+# how many links are read from each feed query at once when merging
+MERGE_CHUNK = 25
+# how many more members than needed are read by seeks to skip links with the same score
+SEEK_MARGIN = 10
+# best links are also kept for these time windows, each window has its own query
+# holding best links created within the window
+TIME_WINDOWS = {
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+    "month": 30 * 24 * 60 * 60,
+    "year": 365 * 24 * 60 * 60,
+}
+# merged listings are shared by everyone with the same feeds, but they are rebuilt at least this often
+MERGED_QUERY_TTL = 30
+# link scores are kept in hashes of this many links, small hashes are stored compactly by Redis
+SCORE_BUCKET = 100
+
+cache.register_codec("cquery:", TuplesCodec())
 
 
 def tuple_maker(sort):
@@ -27,14 +64,54 @@ def tuple_maker(sort):
     return lambda x: [x.id, x.hot]  # default to trending
 
 
+class LinkQueryBackend:
+    """
+    Selects storage engine of link queries
+
+    'pickle' stores whole query as single pickled list, 'zset' stores every query as sorted set
+    """
+
+    def __init__(self, app=None):
+        self.name = "pickle"
+        self.merged_ttl = MERGED_QUERY_TTL
+        self.memory_budget = QUERY_MEMORY_BUDGET
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get("LINK_QUERY_BACKEND", "pickle")
+        if name not in LINK_QUERY_BACKENDS:
+            raise RuntimeError('Unknown "LINK_QUERY_BACKEND" {}'.format(name))
+        self.name = name
+        self.merged_ttl = app.config.get("MERGED_QUERY_TTL", MERGED_QUERY_TTL)
+        self.memory_budget = app.config.get(
+            "LINK_QUERY_MEMORY_BUDGET", QUERY_MEMORY_BUDGET
+        )
+
+
+link_query_backend = LinkQueryBackend()
+
+
 class LinkQuery:
     """
     Access object for sorted links
 
-    Should be handled as source of truth, uses redis as store
+    Should be handled as source of truth, uses redis as store.
+    Creating LinkQuery creates query of the configured storage engine
     """
 
+    # every range read loads whole query, so reading it in chunks doesn't save anything
+    _reads_whole_query = False
+
+    def __new__(cls, *args, **kwargs):
+        if cls is LinkQuery:
+            cls = LINK_QUERY_BACKENDS[link_query_backend.name]
+        return super().__new__(cls)
+
     def __init__(self, feed_id, sort, time="all", filters=()):
+        if time != "all" and (time not in TIME_WINDOWS or sort == "trending"):
+            raise ValueError("Unknown time window {} of {}".format(time, sort))
         self.feed_id = feed_id
         self.sort = sort
         self.time = time
@@ -50,40 +127,258 @@ class LinkQuery:
             yield x[0]
 
     def __repr__(self):
-        return "<CachedQuery %s %s>" % (self.feed_id, self.sort)
+        return "<CachedQuery %s %s %s>" % (self.feed_id, self.sort, self.time)
 
     @property
-    def _cache_key(self):
-        return "cquery:{}.{}.{}".format(self.feed_id, self.sort, self.time)
+    def _cutoff(self) -> Optional[float]:
+        """
+        Epoch seconds of the oldest link within time window of the query
+        :return: cutoff or None for all time queries
+        """
+        return window_cutoff(self.time)
+
+    def _within_window(self, rows: list) -> list:
+        """
+        Drop tuples of links created before the time window, creation time is the last sort value
+        :param rows: [id, sort values...] tuples
+        :return: tuples within time window
+        """
+        cutoff = self._cutoff
+        if cutoff is None:
+            return rows
+        return [row for row in rows if row[-1] >= cutoff]
 
     @property
-    def _lock_key(self):
-        return "lock:cquery:{}.{}.{}".format(self.feed_id, self.sort, self.time)
+    def _depth_field(self) -> str:
+        return "{}.{}.{}".format(self.feed_id, self.sort, self.time)
 
-    def _save(self):
+    @property
+    def depth(self) -> int:
         """
-        Save data to cache
+        How many links the query keeps
+        :return: depth
         """
-        assert self._fetched
-        cache.set(self._cache_key, self._data)
+        return parse_depth(cache.hget(DEPTHS_KEY, self._depth_field))
 
-    def _rebuild(self):
+    def _observe_read(self, depth: int):
+        """
+        Remember how deep the query was read so it's sized by how far users page
+        :param depth: number of links the reader needed
+        """
+        if depth > MIN_QUERY_DEPTH:
+            _hash_max_script()(keys=[READS_KEY], args=[self._depth_field, depth, 0])
+
+    def _deepen(self, needed: int, depth: int):
+        """
+        Rebuild the query from DB deeper because it was read beyond the links it keeps
+        :param needed: number of links the reader needs
+        :param depth: depth of the query when it was read
+        """
+        deeper = min(max(needed, 2 * depth), MAX_QUERY_DEPTH)
+        with Lock(cache.conn, "rebuild:" + self._cache_key, expire=REBUILD_LEASE_TTL):
+            if self.depth > depth:
+                # someone else deepened it already
+                return
+            _hash_max_script()(
+                keys=[DEPTHS_KEY], args=[self._depth_field, deeper, PRECOMPUTE_LIMIT]
+            )
+            self.replace(self._rebuild(deeper))
+
+    def _stored_depth(self) -> (int, int):
+        """
+        :return: number of stored links and depth of the query
+        """
+        raise NotImplementedError
+
+    def _rebuild(self, limit: int = None) -> list:
         """
         Rebuild link query from database
+        :param limit: number of links, depth of the query by default
+        :return: sorted list of [id, sort values...] tuples
         """
         from news.models.link import Link
 
         q = (
             Link.where("feed_id", self.feed_id)
             .order_by_raw(sorts[self.sort])
-            .limit(1000)
+            .limit(self.depth if limit is None else limit)
         )
+        if self.time != "all":
+            since = datetime.utcnow() - timedelta(seconds=TIME_WINDOWS[self.time])
+            q = q.where("created_at", ">=", since)
 
         # cache needs array of objects, not a orator collection
-        res = [self._tupler(l) for l in q.get()]
-        self._data = sort_tuples(res)
+        links = q.get()
+        LinkScores.store(links)
+        res = [self._tupler(l) for l in links]
+        return sort_tuples(res)
+
+    def _filtered(self, rows: list) -> list:
+        # links which left the time window but weren't swept yet
+        rows = self._within_window(rows)
+        for fnc in self._filters:
+            rows = [row for row in rows if fnc(row)]
+        return rows
+
+    def _apply_filters(self):
+        self._data = self._filtered(self._data)
+
+    def delete(self, links):
+        """
+        Delete given links from query
+        :param links: links
+        """
+        raise NotImplementedError
+
+    def insert(self, links):
+        """
+        Insert links into the query
+        :param links: links to insert
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def bulk_insert(cls, links, sorts=("trending", "best", "new")):
+        """
+        Insert links of many feeds into queries of their feeds
+        Links are grouped by feed so every query is updated once for all its links
+        :param links: links to insert
+        :param sorts: sorts to update, best includes all time windows
+        """
+        if cls is LinkQuery:
+            cls = LINK_QUERY_BACKENDS[link_query_backend.name]
+
+        by_feed = {}
+        for link in links:
+            by_feed.setdefault(link.feed_id, []).append(link)
+        cls._insert_groups(
+            [
+                (query, feed_links)
+                for feed_id, feed_links in by_feed.items()
+                for query in feed_queries(feed_id, sorts)
+            ]
+        )
+
+    @classmethod
+    def _insert_groups(cls, groups: list):
+        """
+        Insert groups of links into queries
+        :param groups: (query, links) pairs, queries of this storage engine
+        """
+        for query, links in groups:
+            query.insert(links)
+
+    def sweep(self) -> int:
+        """
+        Remove links which left the time window of the query
+        :return: number of removed links
+        """
+        raise NotImplementedError
+
+    def replace(self, data: list):
+        """
+        Replace whole query
+        :param data: sorted list of [id, sort values...] tuples
+        """
+        raise NotImplementedError
+
+    def _fetch_range(self, offset: int, limit: Optional[int]) -> list:
+        """
+        Read range of stored tuples, filters aren't applied
+        :param offset: number of tuples to skip
+        :param limit: maximal number of tuples to return, None for all
+        :return: sorted list of [id, sort values...] tuples
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def _fetch_ranges(cls, queries: list, offset: int, limit: Optional[int]) -> list:
+        """
+        Read the same range of multiple queries, filters aren't applied
+        :param queries: queries of this storage engine
+        :param offset: number of tuples to skip
+        :param limit: maximal number of tuples to return, None for all
+        :return: sorted lists of [id, sort values...] tuples, one for each query
+        """
+        return [query._fetch_range(offset, limit) for query in queries]
+
+    def fetch(self, offset: int = 0, limit: int = None):
+        """
+        Fetch data from cache and return them
+        Data are tuples in from [id, [sort value 1, [sort value 2, ...]]]
+        :param offset: number of tuples to skip, offset is applied before filters
+        :param limit: maximal number of tuples to return, filtered out tuples are replaced by following ones
+        :return: sorted and filtered list of [id, sort values...] tuples
+        """
+        rows = self._fetch_range(offset, limit)
+        self._data = self._filtered(rows)
+        while (
+            self._filters
+            and limit is not None
+            and len(self._data) < limit
+            and len(rows) == limit
+        ):
+            offset += limit
+            rows = self._fetch_range(offset, limit)
+            self._data += self._filtered(rows)
+        if limit is not None:
+            self._data = self._data[:limit]
         self._fetched = True
-        self._save()
+        return self._data
+
+    def fetch_ids(self, offset: int = 0, limit: int = None) -> [str]:
+        """
+        Fetch data from cache but return only ids of things
+        :param offset: number of ids to skip
+        :param limit: maximal number of ids to return
+        :return: sorted and filtered list of ids
+        """
+        return [r[0] for r in self.fetch(offset, limit)]
+
+    def seek(self, cursor, limit: int, before: bool = False) -> list:
+        """
+        Fetch tuples following (or preceding) the cursor
+        :param cursor: news.lib.pagination.Cursor
+        :param limit: maximal number of tuples to return
+        :param before: return tuples preceding the cursor
+        :return: tuples in listing order
+        """
+        from news.lib.pagination import check_cursor, seek_rows
+
+        check_cursor(cursor, sort_key_length(self.sort))
+        rows = seek_rows(self.fetch(), cursor, limit, before)
+        if not before and len(rows) < limit:
+            stored, depth = self._stored_depth()
+            if depth <= stored < MAX_QUERY_DEPTH:
+                self._deepen(stored + limit, depth)
+                rows = seek_rows(self.fetch(), cursor, limit, before)
+        self._observe_read(cursor.position + limit)
+        return rows
+
+
+class PickledLinkQuery(LinkQuery):
+    """
+    Link query stored as single value
+
+    Every change reads, modifies and writes whole query under lock
+    """
+
+    _reads_whole_query = True
+
+    @property
+    def _cache_key(self):
+        return "cquery:{}.{}.{}".format(self.feed_id, self.sort, self.time)
+
+    @property
+    def _lock_key(self):
+        return "lock:cquery:{}.{}.{}".format(self.feed_id, self.sort, self.time)
+
+    def _save(self):
+        """
+        Save data to cache
+        """
+        assert self._fetched
+        cache.set(self._cache_key, self._data)
 
     def delete(self, links):
         """
@@ -99,6 +394,7 @@ class LinkQuery:
             self._data = data
             self._fetched = True
             self._save()
+        MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
 
     def insert(self, links):
         """
@@ -110,13 +406,14 @@ class LinkQuery:
         with Lock(cache.conn, self._lock_key):
             self.fetch()
             data = self._data
-            item_tuples = [self._tupler(link) for link in links] or []
+            depth = self.depth
+            item_tuples = self._within_window([self._tupler(link) for link in links])
 
             existing_fnames = {item[0] for item in data}
             new_fnames = {item[0] for item in item_tuples}
 
             mutated_length = len(existing_fnames.union(new_fnames))
-            would_truncate = mutated_length >= PRECOMPUTE_LIMIT
+            would_truncate = mutated_length >= depth
             if would_truncate and data:
                 # only insert items that are already stored or new items
                 # that are large enough that they won't be immediately truncated
@@ -139,40 +436,910 @@ class LinkQuery:
             data = [x for x in data if x[0] not in new_fnames]
             data.extend(item_tuples)
             data.sort(reverse=True, key=lambda x: x[1:])
-            if len(data) > PRECOMPUTE_LIMIT:
-                data = data[:PRECOMPUTE_LIMIT]
+            if len(data) > depth:
+                data = data[:depth]
             self._data = data
             self._fetched = True
             self._save()
+        MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
         return True
 
-    def fetch(self):
+    def sweep(self) -> int:
         """
-        Fetch data from cache and return them
-        Data are tuples in from [id, [sort value 1, [sort value 2, ...]]]
-        :return: sorted and filtered list of [id, sort values...] tuples
+        Remove links which left the time window of the query
+        :return: number of removed links
         """
-        self._data = cache.get(self._cache_key)
+        if self.time == "all":
+            return 0
 
-        if self._data is None:
-            CACHE_MISSES.inc(1)
-            self._rebuild()
-        else:
-            CACHE_HITS.inc(1)
+        with Lock(cache.conn, self._lock_key):
+            data = cache.get(self._cache_key)
+            if not data:
+                return 0
+            kept = self._within_window(data)
+            if len(kept) == len(data):
+                return 0
+            self._data = kept
+            self._fetched = True
+            self._save()
+        MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
+        return len(data) - len(kept)
 
-        self._fetched = True
+    def replace(self, data: list):
+        """
+        Replace whole query
+        :param data: sorted list of [id, sort values...] tuples
+        """
+        with Lock(cache.conn, self._lock_key):
+            self._data = data[: self.depth]
+            self._fetched = True
+            self._save()
+        MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
 
-        for fnc in self._filters:
-            self._data = filter(fnc, self._data)
+    def _fetch_range(self, offset: int, limit: Optional[int]) -> list:
+        """
+        Read range of stored tuples
+        Whole query is read and sliced, missing query is rebuilt from DB by single process
+        and popular queries are refreshed before they expire
+        :param offset: number of tuples to skip
+        :param limit: maximal number of tuples to return, None for all
+        :return: sorted list of [id, sort values...] tuples
+        """
+        data = cache.get_or_rebuild(self._cache_key, self._rebuild)
+        if limit is None:
+            return data[offset:]
+
+        if offset + limit > len(data):
+            depth = self.depth
+            if depth <= len(data) < MAX_QUERY_DEPTH:
+                self._deepen(offset + limit, depth)
+                data = cache.get_or_rebuild(self._cache_key, self._rebuild)
+        self._observe_read(offset + limit)
+        return data[offset : offset + limit]
+
+    def _stored_depth(self) -> (int, int):
+        return len(cache.get_or_rebuild(self._cache_key, self._rebuild)), self.depth
 
+
+class ZSetLinkQuery(LinkQuery):
+    """
+    Link query stored as sorted set of link ids scored by the sort value
+
+    Inserts and updates are single ZADD trimmed to depth of the query, deletes are ZREM
+    and reads are ZREVRANGE of requested range, nothing needs to be locked.
+    Sorted set always contains ZSET_PLACEHOLDER member so empty queries can be told apart from missing ones
+    """
+
+    @property
+    def _cache_key(self):
+        return "zq:{}.{}.{}".format(self.feed_id, self.sort, self.time)
+
+    def _score(self, row: list) -> float:
+        return zset_score(self.sort, row)
+
+    def _row(self, member: bytes, score: float) -> list:
+        return zset_row(self.sort, member, score)
+
+    def _rows(self, members: [(bytes, float)]) -> list:
+        return zset_rows(self.sort, members)
+
+    def _store(self, data: list, pipe=None):
+        """
+        Replace stored query with given tuples
+        :param data: [id, sort values...] tuples
+        :param pipe: transaction to add the commands to, executed immediately if None
+        """
+        p = pipe or cache.pipeline(transaction=True)
+        zset_store(p, self._cache_key, self.sort, data, DEFAULT_CACHE_TTL)
+        if pipe is None:
+            p.execute()
+
+    def _rebuild_stored(self) -> list:
+        """
+        Rebuild the query from DB unless someone else rebuilt it already
+        :return: sorted list of [id, sort values...] tuples
+        """
+        key = self._cache_key
+        with Lock(cache.conn, "rebuild:" + key, expire=REBUILD_LEASE_TTL):
+            members = cache.zrevrange(key, 0, -1, withscores=True)
+            if members:
+                return self._rows(members)
+
+            data = self._rebuild()
+            self._store(data)
+            return data
+
+    def delete(self, links):
+        """
+        Delete given links from query
+        :param links: links
+        """
+        if links:
+            cache.zrem(self._cache_key, *[str(link.id) for link in links])
+            MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
+
+    def insert(self, links):
+        """
+        Insert or update links in the query
+        Query that isn't stored is rebuilt from DB, which already contains the links
+        :param links: links to insert
+        """
+        args = self._insert_args(links)
+        if args is None:
+            return True
+
+        changed = _zset_insert_script()(keys=[self._cache_key, DEPTHS_KEY], args=args)
+        if changed is None:
+            self._rebuild_stored()
+        if changed != 0:
+            MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
+        return True
+
+    def _insert_args(self, links) -> Optional[list]:
+        """
+        Arguments of ZSET_INSERT script inserting the links
+        :param links: links to insert
+        :return: arguments or None if no link belongs to the query
+        """
+        rows = self._within_window([self._tupler(link) for link in links])
+        if not rows:
+            return None
+
+        args = [
+            self._depth_field,
+            PRECOMPUTE_LIMIT,
+            DEFAULT_CACHE_TTL,
+            ZSET_PLACEHOLDER,
+        ]
+        for row in rows:
+            args.extend((self._score(row), str(row[0])))
+        return args
+
+    @classmethod
+    def _insert_groups(cls, groups: list):
+        """
+        Insert groups of links into all queries in single pipeline
+        Queries which aren't stored are rebuilt afterwards, merged listings are invalidated only
+        for queries which the links changed
+        :param groups: (query, links) pairs
+        """
+        script = _zset_insert_script()
+        pipe = cache.pipeline(transaction=False)
+        inserted = []
+        for query, links in groups:
+            args = query._insert_args(links)
+            if args is None:
+                continue
+            script(keys=[query._cache_key, DEPTHS_KEY], args=args, client=pipe)
+            inserted.append(query)
+        if not inserted:
+            return
+
+        changed = []
+        for query, result in zip(inserted, pipe.execute()):
+            if result is None:
+                query._rebuild_stored()
+            if result != 0:
+                changed.append((query.feed_id, query.sort, query.time))
+        MergedLinkQuery.invalidate_many(changed)
+
+    def sweep(self) -> int:
+        """
+        Remove links which left the time window of the query
+        Creation time is part of the score only for some sorts so whole query is read
+        :return: number of removed links
+        """
+        if self.time == "all":
+            return 0
+
+        members = cache.zrevrange(self._cache_key, 0, -1, withscores=True)
+        stored = self._rows(members)
+        kept = {row[0] for row in self._within_window(stored)}
+        expired = [str(row[0]) for row in stored if row[0] not in kept]
+        if expired:
+            cache.zrem(self._cache_key, *expired)
+            MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
+        return len(expired)
+
+    def replace(self, data: list):
+        """
+        Replace whole query in single transaction
+        :param data: sorted list of [id, sort values...] tuples
+        """
+        self._store(data[: self.depth])
+        MergedLinkQuery.invalidate(self.feed_id, self.sort, self.time)
+
+    def seek(self, cursor, limit: int, before: bool = False) -> list:
+        """
+        Fetch tuples following (or preceding) the cursor by score range read
+        :param cursor: news.lib.pagination.Cursor
+        :param limit: maximal number of tuples to return
+        :param before: return tuples preceding the cursor
+        :return: tuples in listing order
+        """
+        from news.lib.pagination import check_cursor
+
+        check_cursor(cursor, sort_key_length(self.sort))
+        if not cache.exists(self._cache_key):
+            self._rebuild_stored()
+        rows = zset_seek(self._cache_key, self.sort, cursor, limit, before)
+        if not before and len(rows) < limit:
+            stored, depth = self._stored_depth()
+            if depth <= stored < MAX_QUERY_DEPTH:
+                self._deepen(stored + limit, depth)
+                rows = zset_seek(self._cache_key, self.sort, cursor, limit, before)
+        self._observe_read(cursor.position + limit)
+
+        self._data = self._filtered(rows)
+        while self._filters and len(self._data) < limit and len(rows) == limit:
+            # filtered out tuples are replaced by the ones beyond them
+            edge = rows[0] if before else rows[-1]
+            cursor = cursor._replace(key=list(edge[1:]), last_id=edge[0])
+            rows = zset_seek(self._cache_key, self.sort, cursor, limit, before)
+            more = self._filtered(rows)
+            self._data = more + self._data if before else self._data + more
+        self._data = self._data[-limit:] if before else self._data[:limit]
+        self._fetched = True
         return self._data
 
-    def fetch_ids(self) -> [str]:
+    def _stored_depth(self) -> (int, int):
+        pipe = cache.pipeline(transaction=False)
+        pipe.zcard(self._cache_key)
+        pipe.hget(DEPTHS_KEY, self._depth_field)
+        size, depth = pipe.execute()
+        # without the placeholder
+        return max(size - 1, 0), parse_depth(depth)
+
+    def _fetch_range(self, offset: int, limit: Optional[int]) -> list:
+        return self._fetch_ranges([self], offset, limit)[0]
+
+    @classmethod
+    def _fetch_ranges(cls, queries: list, offset: int, limit: Optional[int]) -> list:
         """
-        Fetch data from cache but return only ids of things
-        :return: sorted and filtered list of ids
+        Read the same range of multiple queries in single round trip
+        Missing queries are rebuilt from DB by single process,
+        queries read beyond the links they keep are rebuilt deeper
+        :param queries: sorted set queries
+        :param offset: number of tuples to skip
+        :param limit: maximal number of tuples to return, None for all
+        :return: sorted lists of [id, sort values...] tuples, one for each query
+        """
+        stop = -1 if limit is None else offset + limit - 1
+        pipe = cache.pipeline(transaction=False)
+        for query in queries:
+            pipe.zcard(query._cache_key)
+            pipe.zrevrange(query._cache_key, offset, stop, withscores=True)
+            pipe.hget(DEPTHS_KEY, query._depth_field)
+        results = pipe.execute()
+
+        ranges = []
+        for idx, query in enumerate(queries):
+            size, members, depth = results[3 * idx : 3 * idx + 3]
+            if size:
+                rows = query._rows(members)
+                stored = size - 1
+            else:
+                data = query._rebuild_stored()
+                rows = data[offset : None if limit is None else offset + limit]
+                stored = len(data)
+
+            if limit is not None:
+                depth = parse_depth(depth)
+                if offset + limit > stored and depth <= stored < MAX_QUERY_DEPTH:
+                    query._deepen(offset + limit, depth)
+                    rows = query._fetch_range(offset, limit)
+                query._observe_read(offset + limit)
+            ranges.append(rows)
+        return ranges
+
+
+def lazy_merge(queries: list, stop: int, chunk_size: int = MERGE_CHUNK) -> list:
+    """
+    Merge sorted queries reading each of them only as deep as the merge needs
+    Queries are read in chunks by range reads, first chunks of all queries are read together
+    and next chunk of a query is read only when the merge consumes its previous chunk.
+    Queries which can't be read by ranges are read once as deep as the merge can need
+    :param queries: link queries of the same sort and storage engine
+    :param stop: number of merged tuples to return
+    :param chunk_size: how many tuples are read from a query at once
+    :return: stop largest [id, sort values...] tuples of all queries
+    """
+    if not queries or stop <= 0:
+        return []
+    if type(queries[0])._reads_whole_query:
+        # every query is loaded once and its needed depth is merged in memory
+        ranges = [query._fetch_range(0, stop) for query in queries]
+        return list(itertools.islice(heapq.merge(*ranges, key=_merge_key), stop))
+
+    chunk_size = min(chunk_size, stop)
+    chunks = type(queries[0])._fetch_ranges(queries, 0, chunk_size)
+    # cursor of every query is (chunk, position in chunk, offset of chunk in query)
+    cursors = [[chunk, 0, 0] for chunk in chunks]
+    heap = [(_merge_key(chunk[0]), idx) for idx, chunk in enumerate(chunks) if chunk]
+    heapq.heapify(heap)
+
+    merged = []
+    while heap and len(merged) < stop:
+        _, idx = heapq.heappop(heap)
+        chunk, position, offset = cursors[idx]
+        merged.append(chunk[position])
+
+        position += 1
+        if position == len(chunk):
+            if len(chunk) < chunk_size:
+                # query is exhausted
+                continue
+            offset += chunk_size
+            chunk, position = queries[idx]._fetch_range(offset, chunk_size), 0
+            if not chunk:
+                continue
+        cursors[idx] = [chunk, position, offset]
+        heapq.heappush(heap, (_merge_key(chunk[position]), idx))
+
+    return merged
+
+
+def _merge_key(row: list) -> tuple:
+    # heap is min heap and tuples are sorted by their sort values descending
+    return tuple(-value for value in row[1:])
+
+
+class MergedLinkQuery:
+    """
+    Links of multiple feeds merged into single listing
+
+    Listing is stored as sorted set under hash of the feed ids so all users subscribed to the same feeds share it.
+    It's built only as deep as requested pages need (at least MIN_MERGED_DEPTH) by lazy merge of feed queries,
+    deeper pages rebuild it deeper. Full listing is built by ZUNIONSTORE inside Redis with 'zset' backend.
+    Listings live for MERGED_QUERY_TTL and are deleted whenever any of the feed queries changes
+    """
+
+    def __init__(self, feed_ids, sort, time="all"):
+        self.feed_ids = sorted(set(feed_ids))
+        self.sort = sort
+        self.time = time
+
+    def __repr__(self):
+        return "<MergedQuery %s %s %s>" % (self.sort, self.time, len(self.feed_ids))
+
+    @property
+    def _key_suffix(self):
+        feeds = ",".join(str(fid) for fid in self.feed_ids)
+        digest = hashlib.sha1(feeds.encode()).hexdigest()[:20]
+        return "{}.{}.{}".format(self.sort, self.time, digest)
+
+    @property
+    def _cache_key(self):
+        return "mq:" + self._key_suffix
+
+    @property
+    def _depth_key(self):
+        return "mqd:" + self._key_suffix
+
+    @staticmethod
+    def _feed_key(feed_id, sort, time):
+        return "mqf:{}.{}.{}".format(feed_id, sort, time)
+
+    @classmethod
+    def invalidate(cls, feed_id, sort, time="all"):
+        """
+        Delete all merged listings containing the feed query
+        :param feed_id: feed id
+        :param sort: sort of changed query
+        :param time: time window of changed query
+        """
+        cls.invalidate_many([(feed_id, sort, time)])
+
+    @classmethod
+    def invalidate_many(cls, queries: list):
+        """
+        Delete all merged listings containing any of the feed queries by two round trips
+        Listings are looked up first and then deleted by their keys, a listing built in between
+        already contains the changes
+        :param queries: (feed id, sort, time window) of changed queries
+        """
+        if not queries:
+            return
+        feed_keys = [cls._feed_key(*query) for query in set(queries)]
+        pipe = cache.pipeline(transaction=False)
+        for key in feed_keys:
+            pipe.smembers(key)
+        listings = set().union(*pipe.execute())
+        cache.delete(*listings, *feed_keys)
+
+    def _build(self, needed: int):
+        """
+        Build the listing at least as deep as needed unless someone else built it already
+        :param needed: number of tuples the listing has to have
+        """
+        key, depth_key = self._cache_key, self._depth_key
+        ttl = link_query_backend.merged_ttl
+        with Lock(cache.conn, "rebuild:" + key, expire=REBUILD_LEASE_TTL):
+            stored_depth = int(cache.get(depth_key, raw=True) or 0)
+            if stored_depth >= needed:
+                return
+
+            # grow geometrically so paging deeper doesn't rebuild the listing on every page
+            depth = min(
+                max(needed, 2 * stored_depth, MIN_MERGED_DEPTH), MAX_MERGED_LINKS
+            )
+            queries = [LinkQuery(fid, self.sort, self.time) for fid in self.feed_ids]
+            union = (
+                link_query_backend.name == "zset"
+                and depth == MAX_MERGED_LINKS
+                and self._unionable(queries)
+            )
+            if not union:
+                data = lazy_merge(queries, depth)
+                if len(data) < depth:
+                    # all links of the feeds are merged
+                    depth = MAX_MERGED_LINKS
+
+            pipe = cache.pipeline(transaction=True)
+            if union:
+                pipe.zunionstore(key, [q._cache_key for q in queries], aggregate="MAX")
+                pipe.zremrangebyrank(key, 0, -MAX_MERGED_LINKS - 1)
+                pipe.zadd(key, {ZSET_PLACEHOLDER: float("-inf")})
+                pipe.expire(key, ttl)
+            else:
+                zset_store(pipe, key, self.sort, data, ttl)
+            pipe.set(depth_key, depth, ex=ttl)
+            for fid in self.feed_ids:
+                feed_key = self._feed_key(fid, self.sort, self.time)
+                pipe.sadd(feed_key, key, depth_key)
+                pipe.expire(feed_key, ttl)
+            pipe.execute()
+
+    @staticmethod
+    def _unionable(queries: list) -> bool:
+        """
+        Check whether stored sorted set queries hold all links full listing can have
+        Missing queries are rebuilt, truncated queries shallower than the listing have to be merged lazily
+        so they're rebuilt deeper when they're read beyond their depth
+        :param queries: sorted set queries
+        :return: True if the queries can be merged by ZUNIONSTORE
+        """
+        pipe = cache.pipeline(transaction=False)
+        for query in queries:
+            pipe.zcard(query._cache_key)
+            pipe.hget(DEPTHS_KEY, query._depth_field)
+        results = pipe.execute()
+
+        unionable = True
+        for query, size, depth in zip(queries, results[::2], results[1::2]):
+            stored = size - 1 if size else len(query._rebuild_stored())
+            if parse_depth(depth) <= stored < MAX_MERGED_LINKS:
+                unionable = False
+        return unionable
+
+    def fetch(self, offset: int = 0, limit: int = None) -> list:
+        """
+        Fetch merged tuples
+        :param offset: number of tuples to skip
+        :param limit: maximal number of tuples to return, None for all (up to MAX_MERGED_LINKS)
+        :return: sorted list of [id, sort values...] tuples
+        """
+        if not self.feed_ids:
+            return []
+
+        key = self._cache_key
+        needed = (
+            MAX_MERGED_LINKS if limit is None else min(offset + limit, MAX_MERGED_LINKS)
+        )
+        stop = -1 if limit is None else offset + limit - 1
+        pipe = cache.pipeline(transaction=False)
+        pipe.get(self._depth_key)
+        pipe.zrevrange(key, offset, stop, withscores=True)
+        depth, members = pipe.execute()
+        if int(depth or 0) < needed:
+            self._build(needed)
+            members = cache.zrevrange(key, offset, stop, withscores=True)
+        rows = zset_rows(self.sort, members)
+
+        cutoff = window_cutoff(self.time)
+        if cutoff is not None:
+            # links which left the time window but weren't swept yet
+            rows = [row for row in rows if row[-1] >= cutoff]
+        return rows
+
+    def fetch_ids(self, offset: int = 0, limit: int = None) -> list:
+        """
+        Fetch merged link ids
+        :param offset: number of ids to skip
+        :param limit: maximal number of ids to return, None for all (up to MAX_MERGED_LINKS)
+        :return: sorted list of ids
+        """
+        return [r[0] for r in self.fetch(offset, limit)]
+
+    def seek(self, cursor, limit: int, before: bool = False) -> list:
+        """
+        Fetch merged tuples following (or preceding) the cursor
+        Listing is rebuilt deeper when the cursor reaches its end
+        :param cursor: news.lib.pagination.Cursor
+        :param limit: maximal number of tuples to return
+        :param before: return tuples preceding the cursor
+        :return: tuples in listing order
+        """
+        from news.lib.pagination import check_cursor
+
+        check_cursor(cursor, sort_key_length(self.sort))
+        if not self.feed_ids:
+            return []
+
+        score = zset_score(self.sort, [cursor.last_id] + list(cursor.key))
+        while True:
+            depth = int(cache.get(self._depth_key, raw=True) or 0)
+            rows = zset_seek(self._cache_key, self.sort, cursor, limit, before)
+            # only seeks running out of the stored listing need it deeper
+            if before:
+                # preceding links are all stored once the listing reaches past the cursor
+                deep_enough = (
+                    cache.zcount(self._cache_key, "(-inf", "({}".format(score)) > 0
+                )
+            else:
+                deep_enough = len(rows) == limit
+            if depth >= MAX_MERGED_LINKS or (depth and deep_enough):
+                break
+            self._build(max(depth, 1) + limit)
+
+        cutoff = window_cutoff(self.time)
+        if cutoff is not None:
+            rows = [row for row in rows if row[-1] >= cutoff]
+        return rows
+
+
+class LinkScores:
+    """
+    Scores of links in listings
+
+    Every link has its score in hash 'lscore:{id // SCORE_BUCKET}' so listings can be filtered by score
+    without loading the links, scores missing in cache are loaded from DB.
+    Hashes expire after DEFAULT_CACHE_TTL without new scores, scores of archived links are removed
+    """
+
+    @staticmethod
+    def _key(link_id: int) -> str:
+        return "lscore:{}".format(int(link_id) // SCORE_BUCKET)
+
+    @classmethod
+    def store(cls, links: list):
+        """
+        Save current scores of links
+        :param links: links
+        """
+        buckets = {}
+        for link in links:
+            buckets.setdefault(cls._key(link.id), {})[link.id] = link.score
+        if not buckets:
+            return
+        pipe = cache.pipeline(transaction=False)
+        for key, scores in buckets.items():
+            pipe.hmset(key, scores)
+            pipe.expire(key, DEFAULT_CACHE_TTL)
+        pipe.execute()
+
+    @classmethod
+    def remove(cls, links: list):
+        """
+        Forget scores of deleted or archived links
+        :param links: links
+        """
+        pipe = cache.pipeline(transaction=False)
+        for link in links:
+            pipe.hdel(cls._key(link.id), link.id)
+        pipe.execute()
+
+    @classmethod
+    def get(cls, ids: list) -> dict:
+        """
+        Get scores of links in single round trip
+        :param ids: link ids
+        :return: scores by link id, links which don't exist are left out
+        """
+        pipe = cache.pipeline(transaction=False)
+        for id in ids:
+            pipe.hget(cls._key(id), id)
+        scores = {
+            id: int(score)
+            for id, score in zip(ids, pipe.execute())
+            if score is not None
+        }
+
+        missing = [id for id in ids if id not in scores]
+        if missing:
+            from news.models.link import Link
+
+            links = Link.select("id", "ups", "downs").where_in("id", missing).get()
+            cls.store(links)
+            scores.update((link.id, link.score) for link in links)
+        return scores
+
+
+class MinScoreListing:
+    """
+    Listing of links scored above minimum
+
+    Links with lower scores are skipped while the listing is read so every page is full,
+    more links are read only when some of them were skipped
+    """
+
+    def __init__(self, listing, min_score: int):
+        """
+        :param listing: listing with fetch(offset, limit) and seek(cursor, limit, before)
+        :param min_score: links must have higher score than this
         """
-        return [r[0] for r in self.fetch()]
+        self.listing = listing
+        self.min_score = min_score
+        self.generation = getattr(listing, "generation", 0)
+
+    def _qualifying(self, rows: list) -> list:
+        scores = LinkScores.get([row[0] for row in rows])
+        return [
+            row for row in rows if scores.get(row[0], self.min_score) > self.min_score
+        ]
+
+    def _read(
+        self, rows: list, limit: int, chunk: int, before: bool, start: int
+    ) -> list:
+        """
+        Filter rows and keep reading beyond them until there's enough links
+        :param rows: first rows read from the listing
+        :param limit: how many links are needed
+        :param chunk: how many rows were read
+        :param before: rows precede the position the listing is read from
+        :param start: position of the first row in the listing
+        :return: qualifying tuples in listing order
+        """
+        from news.lib.pagination import Cursor
+
+        found = self._qualifying(rows)
+        while len(found) < limit and len(rows) == chunk:
+            edge = rows[0] if before else rows[-1]
+            position = start if before else start + len(rows) - 1
+            chunk *= 2
+            rows = self.listing.seek(
+                Cursor(list(edge[1:]), edge[0], self.generation, position),
+                chunk,
+                before,
+            )
+            start = max(position - len(rows), 0) if before else position + 1
+            more = self._qualifying(rows)
+            found = more + found if before else found + more
+        return found[-limit:] if before else found[:limit]
+
+    def fetch(self, offset: int = 0, limit: int = None) -> list:
+        """
+        Fetch qualifying tuples
+        :param offset: number of qualifying tuples to skip
+        :param limit: maximal number of tuples to return
+        :return: sorted list of [id, sort values...] tuples
+        """
+        if limit is None:
+            return self._qualifying(self.listing.fetch())[offset:]
+        chunk = offset + limit + SEEK_MARGIN
+        rows = self.listing.fetch(0, chunk)
+        return self._read(rows, offset + limit, chunk, False, 0)[offset:]
+
+    def seek(self, cursor, limit: int, before: bool = False) -> list:
+        """
+        Fetch qualifying tuples following (or preceding) the cursor
+        :param cursor: news.lib.pagination.Cursor
+        :param limit: maximal number of tuples to return
+        :param before: return tuples preceding the cursor
+        :return: tuples in listing order
+        """
+        chunk = limit + SEEK_MARGIN
+        rows = self.listing.seek(cursor, chunk, before)
+        start = cursor.position - len(rows) if before else cursor.position + 1
+        return self._read(rows, limit, chunk, before, max(start, 0))
+
+
+LINK_QUERY_BACKENDS = {"pickle": PickledLinkQuery, "zset": ZSetLinkQuery}
+
+# member of every stored sorted set so empty queries are distinguishable from missing ones
+ZSET_PLACEHOLDER = b"-"
+# best links are scored by score * BEST_TIME_RANGE + created_at epoch seconds
+# which sorts them by score and then by time, exact for scores up to 2^22 until 2038
+BEST_TIME_RANGE = 2 ** 31
+
+# ZADD only to existing query so expired queries don't get replaced by partial ones
+# and trim it to depth of the query (ARGV default depth if it wasn't sized)
+# KEYS[1] query key, KEYS[2] hash of depths
+# ARGV: depth field, default depth, ttl, placeholder, score, member, score, member...
+# returns false when the query isn't stored, 1 when any of the links was or is in the query, 0 otherwise
+ZSET_INSERT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local changed = 0
+for i = 5, #ARGV, 2 do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i + 1]) then
+        changed = 1
+    end
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local depth = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[2])
+if redis.call('ZCARD', KEYS[1]) > depth + 1 then
+    -- placeholder has the lowest score, it's trimmed with the links and added back
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -depth - 1)
+    redis.call('ZADD', KEYS[1], '-inf', ARGV[4])
+end
+if changed == 0 then
+    for i = 6, #ARGV, 2 do
+        if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+            changed = 1
+            break
+        end
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return changed
+"""
+
+# KEYS[1] hash
+# ARGV field, value, value of missing field
+HASH_MAX = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or ARGV[3])
+if tonumber(ARGV[2]) > current then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def parse_depth(value) -> int:
+    """
+    Depth of query stored in DEPTHS_KEY hash
+    :param value: stored value or None if the query wasn't sized yet
+    :return: depth
+    """
+    return PRECOMPUTE_LIMIT if value is None else int(value)
+
+
+def window_cutoff(time: str) -> Optional[float]:
+    """
+    Epoch seconds of the oldest link within time window
+    :param time: time window
+    :return: cutoff or None for all time
+    """
+    if time == "all":
+        return None
+    return epoch_seconds(datetime.utcnow()) - TIME_WINDOWS[time]
+
+
+def feed_queries(feed_id, sorts=("trending", "best", "new")) -> list:
+    """
+    All queries of the feed which have to be updated when its links change
+    :param feed_id: feed id
+    :param sorts: sorts to update, best includes all time windows
+    :return: link queries
+    """
+    queries = [LinkQuery(feed_id=feed_id, sort=sort) for sort in sorts]
+    if "best" in sorts:
+        queries.extend(
+            LinkQuery(feed_id=feed_id, sort="best", time=time) for time in TIME_WINDOWS
+        )
+    return queries
+
+
+def sort_key_length(sort: str) -> int:
+    """
+    Number of sort values in [id, sort values...] tuples of the sort
+    """
+    return 2 if sort == "best" else 1
+
+
+def zset_score(sort: str, row: list) -> float:
+    """
+    Sorted set score of [id, sort values...] tuple
+    :param sort: sort of the tuple
+    :param row: [id, sort values...] tuple
+    :return: score
+    """
+    if sort == "best":
+        return row[1] * BEST_TIME_RANGE + int(row[2])
+    return row[1]
+
+
+def zset_row(sort: str, member: bytes, score: float) -> list:
+    """
+    [id, sort values...] tuple from sorted set member and its score
+    :param sort: sort of the sorted set
+    :param member: link id
+    :param score: score of the member
+    :return: [id, sort values...] tuple
+    """
+    if sort == "best":
+        link_score = math.floor(score / BEST_TIME_RANGE)
+        return [int(member), link_score, score - link_score * BEST_TIME_RANGE]
+    return [int(member), score]
+
+
+def zset_rows(sort: str, members: [(bytes, float)]) -> list:
+    """
+    [id, sort values...] tuples from ZREVRANGE WITHSCORES result, placeholder is skipped
+    """
+    return [
+        zset_row(sort, member, score)
+        for member, score in members
+        if member != ZSET_PLACEHOLDER
+    ]
+
+
+def zset_seek(key: str, sort: str, cursor, limit: int, before: bool = False) -> list:
+    """
+    Read tuples following (or preceding) the cursor from sorted set
+    Members with equal scores are ordered by member descending so the seek is exact
+    even when the cursor's link moved or was removed
+    :param key: key of the sorted set
+    :param sort: sort of the sorted set
+    :param cursor: news.lib.pagination.Cursor
+    :param limit: maximal number of tuples to return
+    :param before: return tuples preceding the cursor
+    :return: tuples in listing order
+    """
+    score = zset_score(sort, [cursor.last_id] + list(cursor.key))
+    member = str(cursor.last_id).encode()
+    num = limit + SEEK_MARGIN
+    while True:
+        if before:
+            members = cache.zrangebyscore(
+                key, score, "+inf", start=0, num=num, withscores=True
+            )
+            found = [
+                (m, s)
+                for m, s in members
+                if m != ZSET_PLACEHOLDER and (s != score or m > member)
+            ]
+        else:
+            members = cache.zrevrangebyscore(
+                key, score, "-inf", start=0, num=num, withscores=True
+            )
+            found = [
+                (m, s)
+                for m, s in members
+                if m != ZSET_PLACEHOLDER and (s != score or m < member)
+            ]
+        # many links with the same score might have been skipped
+        if len(found) >= limit or len(members) < num:
+            break
+        num *= 2
+
+    found = found[:limit]
+    if before:
+        found.reverse()
+    return zset_rows(sort, found)
+
+
+def zset_store(pipe, key: str, sort: str, data: list, ttl: int):
+    """
+    Add commands replacing sorted set under key with given tuples to pipeline
+    :param pipe: pipeline
+    :param key: key of the sorted set
+    :param sort: sort of the tuples
+    :param data: [id, sort values...] tuples
+    :param ttl: ttl of the sorted set
+    """
+    mapping = {str(row[0]): zset_score(sort, row) for row in data}
+    mapping[ZSET_PLACEHOLDER] = float("-inf")
+    pipe.delete(key)
+    pipe.zadd(key, mapping)
+    pipe.expire(key, ttl)
+
+
+def _zset_insert_script():
+    if "insert" not in _scripts:
+        _scripts["insert"] = cache.register_script(ZSET_INSERT)
+    return _scripts["insert"]
+
+
+def _hash_max_script():
+    if "hash_max" not in _scripts:
+        _scripts["hash_max"] = cache.register_script(HASH_MAX)
+    return _scripts["hash_max"]
 
 
 @job("medium", connection=redis_conn)
@@ -182,8 +1349,23 @@ def JOB_add_to_queries(link):
     :param link: link to add/update
     :return: nothing
     """
-    for sort in ["trending", "best", "new"]:
-        q = LinkQuery(feed_id=link.feed_id, sort=sort)
+    LinkScores.store([link])
+    for q in feed_queries(link.feed_id):
         q.insert([link])
     CommentTree(link.id).create()
     return None
+
+
+@job("medium", connection=redis_conn)
+def JOB_add_links_to_queries(links):
+    """
+    Consumes add_to_queries queue for many links at once, e.g. newly imported links
+    :param links: links to add
+    :return: nothing
+    """
+    LinkScores.store(links)
+    LinkQuery.bulk_insert(links)
+    with cache.batch():
+        for link in links:
+            CommentTree(link.id).create()
+    return None
@@ -7,7 +7,10 @@ from news.config.routes import register_routes
 from news.clients.amazons3 import S3
 from news.lib.cache import cache
 from news.lib.csrf import csrf
+from news.lib.global_listings import global_listings
+from news.lib.identity_map import identity_map
 from news.clients.db.db import db
+from news.clients.db.query import link_query_backend
 from news.lib.login import login_manager
 from news.clients.sentry import sentry
 
@@ -31,6 +34,12 @@ def real_make_app():
 
     cache.init_app(app)
 
+    identity_map.init_app(app)
+
+    link_query_backend.init_app(app)
+
+    global_listings.init_app(app)
+
     login_manager.init_app(app)
 
     S3.init_app(app)
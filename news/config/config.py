@@ -90,6 +90,40 @@ def load_config(app):
     # REDIS CONFIG
     app.config["REDIS_URL"] = get_string("REDIS_URL")
 
+    # in-process cache in front of redis, enabled per key prefix, e.g. "f:,u:,fslug:"
+    app.config["CACHE_L1_PREFIXES"] = [
+        prefix for prefix in get_string("CACHE_L1_PREFIXES", "").split(",") if prefix
+    ]
+    app.config["CACHE_L1_MAX_BYTES"] = get_int("CACHE_L1_MAX_BYTES", 32 * 1024 * 1024)
+    app.config["CACHE_L1_TTL"] = get_int("CACHE_L1_TTL", 60)
+    # key prefixes written with compact codecs, pickled values are readable either way
+    app.config["CACHE_COMPACT_CODECS"] = [
+        prefix
+        for prefix in get_string("CACHE_COMPACT_CODECS", "cquery:,scm:").split(",")
+        if prefix
+    ]
+    # for how long are misses of ids, slugs and usernames remembered
+    app.config["CACHE_TOMBSTONE_TTL"] = get_int("CACHE_TOMBSTONE_TTL", 60)
+    # values larger than this many bytes are compressed (lz4 if installed, zlib otherwise), 0 turns it off
+    app.config["CACHE_COMPRESS_MIN_BYTES"] = get_int("CACHE_COMPRESS_MIN_BYTES", 1024)
+    # storage of link queries, 'pickle' (single value per query) or 'zset' (sorted set per query)
+    app.config["LINK_QUERY_BACKEND"] = get_string("LINK_QUERY_BACKEND", "pickle")
+    # for how long are front pages merged from multiple feeds shared before they are rebuilt
+    app.config["MERGED_QUERY_TTL"] = get_int("MERGED_QUERY_TTL", 30)
+    # bytes all link queries may use together, news.scripts.size_link_queries sizes queries to fit
+    app.config["LINK_QUERY_MEMORY_BUDGET"] = get_int(
+        "LINK_QUERY_MEMORY_BUDGET", 256 * 1024 * 1024
+    )
+    # anonymous listings are rebuilt every GLOBAL_LISTINGS_INTERVAL seconds, or after at least
+    # GLOBAL_LISTINGS_MIN_INTERVAL seconds when links change, and not served when older than MAX_STALENESS
+    app.config["GLOBAL_LISTINGS_INTERVAL"] = get_int("GLOBAL_LISTINGS_INTERVAL", 5)
+    app.config["GLOBAL_LISTINGS_MIN_INTERVAL"] = get_int(
+        "GLOBAL_LISTINGS_MIN_INTERVAL", 1
+    )
+    app.config["GLOBAL_LISTINGS_MAX_STALENESS"] = get_int(
+        "GLOBAL_LISTINGS_MAX_STALENESS", 60
+    )
+
     app.config["DEFAULT_FEEDS"] = (
         json.loads(os.getenv("DEFAULT_FEEDS"))
         if os.getenv("DEFAULT_FEEDS")
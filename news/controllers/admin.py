@@ -4,7 +4,7 @@ from werkzeug.utils import redirect
 
 from news.lib.cache import cache
 from news.lib.task_queue import q
-from news.lib.tasks.tasks import JOB_import_feed_fqs
+from news.lib.tasks.tasks import JOB_import_feed_fqs, JOB_warm_cache
 from news.models.feed import Feed
 
 
@@ -44,7 +44,12 @@ def trigget_update_fqs():
 
 
 def clear_cache():
-    cache.clear()
+    from news.models.vote import VOTE_STATE_PREFIXES
+    from news.scripts.flush_votes import FLUSHER_LOCK
+
+    # unflushed votes and the lock of running flusher are kept
+    cache.clear(keep=VOTE_STATE_PREFIXES + ("lock:" + FLUSHER_LOCK,))
+    q.enqueue(JOB_warm_cache, result_ttl=0)
     return redirect("/admin")
 
 
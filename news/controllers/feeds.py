@@ -7,9 +7,8 @@ from werkzeug.utils import secure_filename
 
 from news.lib.access import feed_admin_required, not_banned
 from news.clients.amazons3 import S3
-from news.clients.db.query import LinkQuery
-from news.lib.filters import min_score_filter
-from news.lib.pagination import paginate
+from news.clients.db.query import LinkQuery, MinScoreListing
+from news.lib.pagination import paginate, page_depth, paginate_listing
 from news.lib.ratelimit import rate_limit
 from news.lib.rss import rss_page
 from news.lib.utils.file_type import imagefile
@@ -52,14 +51,12 @@ def get_feed(feed, sort=None):
     if sort is None:
         sort = feed.default_sort
 
-    ids, has_less, has_more = paginate(
-        LinkQuery(feed_id=feed.id, sort=sort).fetch_ids(), 20
-    )
+    listing = LinkQuery(feed_id=feed.id, sort=sort)
+    if current_user.is_authenticated:
+        listing = MinScoreListing(listing, current_user.p_min_link_score)
+    ids, has_less, has_more = paginate_listing(listing, 20)
     links = Link.by_ids(ids) if len(ids) > 0 else []
 
-    if sort == "new" and current_user.is_authenticated:
-        links = filter(min_score_filter(current_user.p_min_link_score), links)
-
     feed.links = links
     return render_template(
         "feed.html", feed=feed, less_links=has_less, more_links=has_more, sort=sort
@@ -73,7 +70,9 @@ def get_feed_rss(feed):
     :param feed: feed
     :return:
     """
-    ids, _, _ = paginate(LinkQuery(feed_id=feed.id, sort="trending").fetch_ids(), 30)
+    ids, _, _ = paginate(
+        LinkQuery(feed_id=feed.id, sort="trending").fetch_ids(limit=page_depth(30)), 30
+    )
     links = Link.by_ids(ids)
     return rss_page(feed, links)
 
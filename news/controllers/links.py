@@ -8,7 +8,20 @@ from news.models.ban import Ban
 from news.models.comment import SortedComments, CommentForm
 from news.models.link import SavedLink
 from news.models.report import ReportForm, Report
-from news.models.vote import vote_type_from_string, LinkVote
+from news.models.vote import vote_type_from_string, LinkVote, UNVOTE
+
+
+def _tree_comments(tree: list) -> list:
+    """
+    All comments of sorted comments tree
+    :param tree: [comment, subtrees] pairs
+    :return: comments
+    """
+    return [
+        comment
+        for root, subtrees in tree
+        for comment in [root] + _tree_comments(subtrees)
+    ]
 
 
 def get_link(link, link_slug=""):
@@ -25,6 +38,11 @@ def get_link(link, link_slug=""):
 
     # Currently supports only one type of sorting for comments
     sorted_comments = SortedComments(link.id).get_full_tree()
+    link_vote, comment_votes = UNVOTE, {}
+    if current_user.is_authenticated:
+        # votes on the whole page are loaded at once
+        link_vote = current_user.link_votes([link])[link.id]
+        comment_votes = current_user.comment_votes(_tree_comments(sorted_comments))
 
     return render_template(
         "link.html",
@@ -32,6 +50,8 @@ def get_link(link, link_slug=""):
         feed=link.feed,
         comment_form=CommentForm(),
         comments=sorted_comments,
+        link_vote=link_vote,
+        comment_votes=comment_votes,
     )
 
 
@@ -1,7 +1,7 @@
 from flask import abort, render_template
 from flask_login import login_required, current_user
 
-from news.lib.pagination import paginate
+from news.lib.pagination import paginate, paginate_listing, NewestListing
 from news.models.comment import Comment
 from news.models.feed_admin import FeedAdmin
 from news.models.link import Link, SavedLink
@@ -40,7 +40,8 @@ def users_comments(username):
     user = User.by_username(username)
     if user is None:
         abort(404)
-    comments, less, more = paginate(user.comments, 20)
+    ids, less, more = paginate_listing(NewestListing(Comment, user_id=user.id), 20)
+    comments = Comment.by_ids(ids) if ids else []
     return render_template(
         "profile_comments.html",
         user=user,
@@ -55,7 +56,8 @@ def users_posts(username):
     user = User.by_username(username)
     if user is None:
         abort(404)
-    links, less, more = paginate(user.links, 20)
+    ids, less, more = paginate_listing(NewestListing(Link, user_id=user.id), 20)
+    links = Link.by_ids(ids) if ids else []
     return render_template(
         "profile_posts.html",
         user=user,
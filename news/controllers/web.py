@@ -5,8 +5,10 @@ from flask_login import current_user
 from prometheus_client import core
 from prometheus_client.exposition import generate_latest
 
-from news.lib.normalized_listing import trending_links, best_links, new_links
-from news.lib.pagination import paginate
+from news.clients.db.query import MergedLinkQuery, MinScoreListing
+from news.lib.global_listings import global_listings
+from news.lib.normalized_listing import trending_links
+from news.lib.pagination import paginate, page_depth, paginate_listing
 from news.lib.rss import rss_entries
 from news.models.link import Link
 
@@ -35,19 +37,17 @@ def index():
     sort = None
     if current_user.is_authenticated:
         s = request.args.get("sort", "trending")
-        if s == "trending":
-            links = trending_links(current_user.subscribed_feed_ids)
-            sort = "Trending"
-        elif s == "new":
-            links = new_links(current_user.subscribed_feed_ids)
-            sort = "New"
-        else:
-            links = best_links(current_user.subscribed_feed_ids, "all")
-            sort = "Best"
+        if s not in ("trending", "new"):
+            s = "best"
+        listing = MinScoreListing(
+            MergedLinkQuery(current_user.subscribed_feed_ids, s),
+            current_user.p_min_link_score,
+        )
+        sort = s.capitalize()
     else:
-        links = trending_links(current_app.config["DEFAULT_FEEDS"])
+        listing = global_listings.listing("trending")
     count = request.args.get("count", default=None, type=int)
-    paginated_ids, has_less, has_more = paginate(links, 20)
+    paginated_ids, has_less, has_more = paginate_listing(listing, 20)
     links = Link.by_ids(paginated_ids) if paginated_ids else []
     return render_template(
         "index.html",
@@ -63,9 +63,9 @@ def index():
 
 def index_rss():
     if current_user.is_authenticated:
-        links = trending_links(current_user.subscribed_feed_ids)
+        links = trending_links(current_user.subscribed_feed_ids, page_depth(30))
     else:
-        links = trending_links(current_app.config["DEFAULT_FEEDS"])
+        links = global_listings.links("trending")
     paginated_ids, _, _ = paginate(links, 30)
     links = Link.by_ids(paginated_ids)
 
@@ -84,8 +84,8 @@ def index_rss():
 
 
 def new():
-    links = new_links(current_app.config["DEFAULT_FEEDS"])
-    paginated_ids, has_less, has_more = paginate(links, 20)
+    listing = global_listings.listing("new")
+    paginated_ids, has_less, has_more = paginate_listing(listing, 20)
     links = Link.by_ids(paginated_ids)
 
     return render_template(
@@ -99,10 +99,8 @@ def new():
 
 def best():
     time = request.args.get("time")
-    links = best_links(
-        current_app.config["DEFAULT_FEEDS"], time_limit=time if time else "all"
-    )
-    paginated_ids, has_less, has_more = paginate(links, 20)
+    listing = global_listings.listing("best." + (time if time else "all"))
+    paginated_ids, has_less, has_more = paginate_listing(listing, 20)
     links = Link.by_ids(paginated_ids)
 
     return render_template(
@@ -111,12 +109,13 @@ def best():
         less_links=has_less,
         more_links=has_more,
         title="eSource News - Best",
+        time=time,
     )
 
 
 def trending():
-    links = trending_links(current_app.config["DEFAULT_FEEDS"])
-    paginated_ids, has_less, has_more = paginate(links, 20)
+    listing = global_listings.listing("trending")
+    paginated_ids, has_less, has_more = paginate_listing(listing, 20)
     links = Link.by_ids(paginated_ids)
 
     return render_template(
@@ -0,0 +1,81 @@
+"""
+Batch versions of hot and confidence
+
+Scores whole arrays at once with NumPy and return exactly the same floats as news.lib.sorts.hot
+and news.lib.utils.confidence.confidence, so batch and scalar scores can be mixed in one index
+"""
+from math import log
+
+import numpy as np
+
+EPOCH = np.datetime64("1970-01-01T00:00:00", "us")
+HOT_EPOCH = 1134028003
+HOT_DIGITS = 7
+# values closer than this to a tie after scaling to HOT_DIGITS are rounded by round()
+# numpy rounds x * 10^digits which may land on the other side of a tie than exact decimal rounding
+TIE_TOLERANCE = 1e-3
+Z = 1.96
+
+
+def epoch_seconds(created_at) -> np.ndarray:
+    """
+    Epoch seconds of dates, same as news.lib.utils.time_utils.epoch_seconds
+    :param created_at: datetimes, datetime64 values or already computed epoch seconds
+    :return: float array of epoch seconds
+    """
+    created_at = np.asarray(created_at)
+    if created_at.dtype.kind in "fiu":
+        return created_at.astype(np.float64)
+    micros = (created_at.astype("datetime64[us]") - EPOCH).astype(np.int64)
+    # timedelta.total_seconds divides integer microseconds the same way
+    return micros / 10 ** 6
+
+
+def _round(values: np.ndarray, digits: int) -> np.ndarray:
+    """
+    Round values the same way as built-in round(value, digits)
+    """
+    scaled = values * 10 ** digits
+    rounded = np.round(scaled) / 10 ** digits
+    fraction = np.abs(scaled - np.floor(scaled) - 0.5)
+    for idx in np.flatnonzero(fraction < TIE_TOLERANCE):
+        rounded[idx] = round(float(values[idx]), digits)
+    return rounded
+
+
+def hot(ups, downs, created_at) -> np.ndarray:
+    """
+    Hot scores of links
+    :param ups: upvotes of links
+    :param downs: downvotes of links
+    :param created_at: creation dates of links (see epoch_seconds)
+    :return: float array of hot scores
+    """
+    score = np.asarray(ups, dtype=np.int64) - np.asarray(downs, dtype=np.int64)
+
+    # there are only few distinct scores, log of each is computed by math.log like the scalar hot does
+    distinct, inverse = np.unique(np.abs(score), return_inverse=True)
+    order = np.array([log(max(int(s), 1), 10) for s in distinct], dtype=np.float64)
+    order = order[inverse]
+
+    seconds = epoch_seconds(created_at) - HOT_EPOCH
+    return _round(np.sign(score) * order + seconds / 45000, HOT_DIGITS)
+
+
+def confidence(ups, downs) -> np.ndarray:
+    """
+    Lower Wilson bounds of confidence
+    :param ups: upvotes
+    :param downs: downvotes
+    :return: float array of lower Wilson bounds, 0 where there are no votes
+    """
+    ups = np.asarray(ups, dtype=np.int64)
+    n = ups + np.asarray(downs, dtype=np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        phat = ups / n
+        bound = (
+            phat
+            + Z * Z / (2 * n)
+            - Z * np.sqrt((phat * (1 - phat) + Z * Z / (4 * n)) / n)
+        ) / (1 + Z * Z / n)
+    return np.where(n == 0, 0.0, bound)
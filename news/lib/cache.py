@@ -1,18 +1,167 @@
-from pickle import loads, dumps
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from math import log
+from random import random
 
-from redis import StrictRedis
+from redis_lock import Lock, NotAcquired
+
+from news.lib.cache_codecs import (
+    PICKLE,
+    CodecError,
+    compress,
+    decompress,
+    is_compressed,
+)
+from news.lib.cache_metrics import (
+    InstrumentedRedis,
+    key_prefix,
+    observe_round_trips,
+)
+from news.lib.local_cache import LocalCache
+from news.lib.metrics import (
+    CACHE_HITS,
+    CACHE_L1_HITS,
+    CACHE_L1_MISSES,
+    CACHE_L1_INVALIDATIONS,
+    CACHE_EARLY_REFRESHES,
+    CACHE_REBUILD_WAITS,
+    CACHE_TOMBSTONE_HITS,
+)
 
 DEFAULT_CACHE_TTL = 12 * 60 * 60  # 12 hours
 
+# early refresh aggressiveness, values > 1 favour earlier rebuilds
+EARLY_REFRESH_BETA = 1.0
+# for how long can single process rebuild value before others start rebuilding it too
+REBUILD_LEASE_TTL = 10
+# for how long other processes wait for the rebuilt value
+REBUILD_WAIT = 1.0
+REBUILD_POLL_INTERVAL = 0.05
+# estimate of rebuild time in seconds used until the actual time is measured
+REBUILD_TIME_ESTIMATE = 0.1
+
+# value stored in place of things confirmed to be missing in DB, it's neither valid pickle nor compact codec
+TOMBSTONE = b"\x00"
+TOMBSTONE_TTL = 60
+
+# values larger than this are compressed, 0 turns compression off
+COMPRESS_MIN_BYTES = 1024
+
+# channel on which writes to locally cached keys are announced to all processes
+INVALIDATION_CHANNEL = "cache:invalidate"
+# invalidation message which drops the whole local cache
+INVALIDATE_ALL = "*"
+
+# commands which are queued when called on cache inside batch, everything else is executed immediately
+BATCHED_COMMANDS = frozenset(
+    [
+        "sadd",
+        "srem",
+        "expire",
+        "pexpire",
+        "persist",
+        "incr",
+        "incrby",
+        "decr",
+        "decrby",
+        "hset",
+        "hmset",
+        "hdel",
+        "hincrby",
+        "zadd",
+        "zrem",
+        "zincrby",
+        "zremrangebyrank",
+        "zremrangebyscore",
+        "lpush",
+        "rpush",
+        "ltrim",
+        "publish",
+    ]
+)
+
+
+class Deferred:
+    """
+    Result of command queued in batch, available once the batch is executed
+    """
+
+    _UNSET = object()
+
+    def __init__(self):
+        self._value = self._UNSET
+
+    @property
+    def value(self) -> object:
+        if self._value is self._UNSET:
+            raise RuntimeError("batch wasn't executed yet")
+        return self._value
+
+    def __repr__(self):
+        return "<Deferred {}>".format(
+            "pending" if self._value is self._UNSET else repr(self._value)
+        )
+
+
+class Batch:
+    """
+    Commands queued in single pipeline
+    """
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self._pending = []
+
+    def queue(self, command) -> Deferred:
+        """
+        Queue command
+        :param command: function which issues the command(s) on given pipeline
+        :return: deferred result of the first issued command
+        """
+        idx = len(self._pipe.command_stack)
+        command(self._pipe)
+        deferred = Deferred()
+        self._pending.append((idx, deferred))
+        return deferred
+
+    def execute(self):
+        """
+        Send all queued commands in single round trip and resolve their results
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        results = self._pipe.execute()
+        for idx, deferred in pending:
+            deferred._value = results[idx]
+
 
 class Cache:
     """
     Cache serves as universal object for access to Redis
+
+    Values under selected prefixes can be also cached in bounded in-process cache (L1),
+    all writes to such keys are announced on INVALIDATION_CHANNEL so every process
+    drops the stale value
     """
 
     def __init__(self, app=None):
         self.conn = None
         self._url = None
+        self.local = None
+        self._local_prefixes = frozenset()
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._codecs = {}
+        self._compact_prefixes = frozenset()
+        self._rebuild_times = {}
+        self.tombstone_ttl = TOMBSTONE_TTL
+        self.compress_min_bytes = COMPRESS_MIN_BYTES
+        self._batch_state = threading.local()
 
         if app is not None:
             self.init_app(app)
@@ -26,34 +175,216 @@ class Cache:
             raise RuntimeError('Missing "REDIS_URL" configuration')
 
         self._url = app.config["REDIS_URL"]
-        self.conn = StrictRedis.from_url(self._url)
+        self.conn = InstrumentedRedis.from_url(self._url)
+        app.teardown_request(observe_round_trips)
+
+        prefixes = app.config.get("CACHE_L1_PREFIXES")
+        if prefixes:
+            self.local = LocalCache(
+                app.config["CACHE_L1_MAX_BYTES"], app.config["CACHE_L1_TTL"]
+            )
+            self._local_prefixes = frozenset(prefixes)
+
+        self._compact_prefixes = frozenset(app.config.get("CACHE_COMPACT_CODECS", ()))
+        self.tombstone_ttl = app.config.get("CACHE_TOMBSTONE_TTL", TOMBSTONE_TTL)
+        self.compress_min_bytes = app.config.get(
+            "CACHE_COMPRESS_MIN_BYTES", COMPRESS_MIN_BYTES
+        )
+
+    def register_codec(self, prefix: str, codec):
+        """
+        Register codec which can be used to serialize values stored under given key prefix
+        Codec is used for writes only if the prefix is listed in CACHE_COMPACT_CODECS,
+        values written by the codec are readable even if it's turned off
+        :param prefix: key prefix, e.g. 'l:'
+        :param codec: codec
+        """
+        self._codecs[prefix] = codec
+
+    def _codec(self, key):
+        return self._codecs.get(key_prefix(key), PICKLE)
+
+    def _encode(self, key: str, val: object) -> bytes:
+        """
+        Serialize value with codec registered for the key prefix, fallback to pickle
+        Large values are compressed if it makes them smaller
+        :param key: key
+        :param val: value
+        :return: serialized value
+        """
+        data = None
+        if key_prefix(key) in self._compact_prefixes:
+            try:
+                data = self._codec(key).encode(val)
+            except CodecError:
+                pass
+        if data is None:
+            data = PICKLE.encode(val)
+
+        if self.compress_min_bytes and len(data) >= self.compress_min_bytes:
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                return compressed
+        return data
+
+    def _decode(self, key: str, data: bytes) -> object:
+        """
+        Deserialize value, values which can't be decoded are treated as missing
+        :param key: key
+        :param data: serialized value
+        :return: value
+        """
+        if not data:
+            return None
+        if is_compressed(data):
+            try:
+                data = decompress(data)
+            except CodecError:
+                return None
+        if data[0] == PICKLE.header:
+            return PICKLE.decode(data)
+        codec = self._codec(key)
+        if data[0] != codec.header:
+            return None
+        try:
+            return codec.decode(data)
+        except CodecError:
+            return None
+
+    def _is_local(self, key) -> bool:
+        """
+        Check whether given key should be cached in-process
+        :param key: key
+        """
+        return self.local is not None and key_prefix(key) in self._local_prefixes
+
+    def _ensure_listener(self):
+        """
+        Make sure this process listens for invalidations of locally cached keys
+        Listener is (re)started lazily so it runs in every forked worker
+        """
+        if (
+            self._listener_pid == os.getpid()
+            and self._listener is not None
+            and self._listener.is_alive()
+        ):
+            return
+
+        with self._listener_lock:
+            if (
+                self._listener_pid == os.getpid()
+                and self._listener is not None
+                and self._listener.is_alive()
+            ):
+                return
+
+            # values inherited from parent process or cached while not listening may be stale
+            self.local.clear()
+            pubsub = self.conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidate})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._listener_pid = os.getpid()
+
+    def _on_invalidate(self, message):
+        """
+        Drop invalidated keys from local cache
+        :param message: pubsub message with new line separated keys
+        """
+        for key in message["data"].decode().split("\n"):
+            CACHE_L1_INVALIDATIONS.inc(1)
+            if key == INVALIDATE_ALL:
+                self.local.clear()
+            else:
+                self.local.delete(key)
+
+    def _invalidate(self, keys: [str], pipe=None):
+        """
+        Drop keys from local cache and announce it to other processes
+        :param keys: keys to invalidate
+        :param pipe: pipeline to publish the invalidation with, published immediately if None
+        """
+        keys = [k.decode() if isinstance(k, bytes) else k for k in keys]
+        keys = [k for k in keys if k == INVALIDATE_ALL or self._is_local(k)]
+        if not keys:
+            return
+
+        for key in keys:
+            if key == INVALIDATE_ALL:
+                self.local.clear()
+            else:
+                self.local.delete(key)
+        (pipe or self.conn).publish(INVALIDATION_CHANNEL, "\n".join(keys))
+
+    def _get_raw(self, key: str) -> bytes:
+        """
+        Get raw value, from local cache if possible
+        :param key: key
+        :return: raw value
+        """
+        if not self._is_local(key):
+            return self.conn.get(key)
+
+        self._ensure_listener()
+        prefix = key_prefix(key)
+        data = self.local.get(key)
+        if data is not None:
+            CACHE_L1_HITS.labels(prefix).inc(1)
+            CACHE_HITS.labels(prefix).inc(1)
+            return data
+
+        CACHE_L1_MISSES.labels(prefix).inc(1)
+        data = self.conn.get(key)
+        if data is not None:
+            self.local.set(key, data)
+        return data
 
     def get(self, key: str, raw: bool = False) -> object:
         """
         Get object from cache
         :rtype: object
         """
-        data = self.conn.get(key)
+        data = self._get_raw(key)
         if raw:
             return data
-        return loads(data) if data else None
+        return self._decode(key, data)
 
     def mget(self, ids: [str], raw: bool = False) -> [object]:
         """
         Get multiple objects
         :param ids: ids to get
-        :param raw: get objects raw or pickle-load them
+        :param raw: get objects raw or deserialize them
         :return: objects
         """
         if not ids:
             return []
 
-        data = self.conn.mget(ids)
+        if self.local is None:
+            data = self.conn.mget(ids)
+        else:
+            data = [None] * len(ids)
+            missing = []
+            for idx, key in enumerate(ids):
+                if self._is_local(key):
+                    self._ensure_listener()
+                    data[idx] = self.local.get(key)
+                    if data[idx] is not None:
+                        CACHE_L1_HITS.labels(key_prefix(key)).inc(1)
+                        CACHE_HITS.labels(key_prefix(key)).inc(1)
+                        continue
+                    CACHE_L1_MISSES.labels(key_prefix(key)).inc(1)
+                missing.append(idx)
+
+            if missing:
+                fetched = self.conn.mget([ids[idx] for idx in missing])
+                for idx, value in zip(missing, fetched):
+                    data[idx] = value
+                    if value is not None and self._is_local(ids[idx]):
+                        self.local.set(ids[idx], value)
 
         if raw:
             return data
         if data:
-            return [loads(x) if x else None for x in data]
+            return [self._decode(key, x) for key, x in zip(ids, data)]
         return None
 
     def set(
@@ -64,18 +395,305 @@ class Cache:
         :param key: key
         :param val: value
         :param ttl: time to live in seconds
-        :param raw: raw object or use pickle
+        :param raw: raw object or serialize it
         :return:
         """
+        data = val if raw else self._encode(key, val)
+        batch = self._current_batch()
+        if batch is not None:
+            return batch.queue(lambda pipe: self._set(pipe, key, data, ttl))
+        if not self._is_local(key):
+            return self._set(self.conn, key, data, ttl)
+
+        # write and announce the write in single round trip
+        pipe = self.conn.pipeline(transaction=False)
+        self._set(pipe, key, data, ttl)
+        return pipe.execute()[0]
+
+    def _set(self, target, key: str, data: bytes, ttl: int):
+        """
+        Issue write of serialized value and announce it if the key is cached in-process
+        :param target: connection or pipeline
+        """
         if ttl == 0:
-            return self.conn.set(key, val if raw else dumps(val))
+            res = target.set(key, data)
         else:
-            return self.conn.setex(key, ttl, val if raw else dumps(val))
+            res = target.setex(key, ttl, data)
+        self._invalidate([key], target)
+        return res
+
+    def set_tombstone(self, key: str):
+        """
+        Remember that the thing stored under given key doesn't exist
+        Tombstones are short lived and should be deleted when the thing gets created
+        :param key: key
+        """
+        self.set(key, TOMBSTONE, ttl=self.tombstone_ttl, raw=True)
+
+    def is_tombstone(self, key: str, data: bytes) -> bool:
+        """
+        Check whether raw value is a tombstone, counts the prevented DB query if so
+        :param key: key
+        :param data: raw value
+        """
+        if data != TOMBSTONE:
+            return False
+        CACHE_TOMBSTONE_HITS.labels(key_prefix(key)).inc(1)
+        return True
+
+    def _get_with_ttl(self, key: str) -> (bytes, float):
+        """
+        Get raw value and its remaining time to live in single round trip
+        :param key: key
+        :return: raw value and remaining ttl in seconds, ttl is None if unknown
+        """
+        if self._is_local(key):
+            self._ensure_listener()
+            data = self.local.get(key)
+            if data is not None:
+                CACHE_L1_HITS.labels(key_prefix(key)).inc(1)
+                CACHE_HITS.labels(key_prefix(key)).inc(1)
+                return data, None
+            CACHE_L1_MISSES.labels(key_prefix(key)).inc(1)
+
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        data, pttl = pipe.execute()
+        if data is not None and self._is_local(key):
+            self.local.set(key, data)
+        return data, pttl / 1000 if pttl > 0 else None
+
+    def _rebuild(
+        self, key: str, rebuild, ttl: int, cache_missing: bool = False
+    ) -> object:
+        """
+        Rebuild the value, store it and remember how long the rebuild took
+        """
+        start = time.monotonic()
+        value = rebuild()
+        if value is not None:
+            self.set(key, value, ttl=ttl)
+        elif cache_missing:
+            self.set_tombstone(key)
+
+        prefix = key_prefix(key)
+        elapsed = time.monotonic() - start
+        self._rebuild_times[prefix] = (
+            0.8 * self._rebuild_times.get(prefix, elapsed) + 0.2 * elapsed
+        )
+        return value
+
+    def _rebuild_leased(
+        self, lease: Lock, key: str, rebuild, ttl: int, cache_missing: bool = False
+    ) -> object:
+        """
+        Rebuild the value under acquired lease
+        """
+        try:
+            return self._rebuild(key, rebuild, ttl, cache_missing)
+        finally:
+            try:
+                lease.release()
+            except NotAcquired:
+                # rebuild took longer than the lease
+                pass
+
+    def get_or_rebuild(
+        self,
+        key: str,
+        rebuild,
+        ttl: int = DEFAULT_CACHE_TTL,
+        beta: float = EARLY_REFRESH_BETA,
+        cache_missing: bool = False,
+    ) -> object:
+        """
+        Get value from cache and rebuild it if it's missing
+
+        Missing values are rebuilt by single process at a time which holds short lease,
+        others wait for the rebuilt value or rebuild it on their own if it doesn't appear in time.
+        Values are also rebuilt before they expire with probability growing as the expiration
+        approaches and with the time it takes to rebuild the value (XFetch),
+        processes which don't win the lease keep using the current value
+        :param key: key
+        :param rebuild: function returning fresh value, None values are not stored
+        :param ttl: time to live of rebuilt value
+        :param beta: early refresh aggressiveness, 0 turns early refresh off
+        :param cache_missing: store tombstone if rebuild doesn't find anything
+        :return: value
+        """
+        data, remaining = self._get_with_ttl(key)
+        if self.is_tombstone(key, data):
+            return None
 
-    def clear(self):
-        return self.conn.flushdb()
+        value = self._decode(key, data)
+        if value is not None:
+            delta = self._rebuild_times.get(key_prefix(key), REBUILD_TIME_ESTIMATE)
+            if (
+                remaining is not None
+                and beta > 0
+                and -delta * beta * log(1 - random()) >= remaining
+            ):
+                lease = Lock(self.conn, "rebuild:" + key, expire=REBUILD_LEASE_TTL)
+                if lease.acquire(blocking=False):
+                    CACHE_EARLY_REFRESHES.labels(key_prefix(key)).inc(1)
+                    return self._rebuild_leased(lease, key, rebuild, ttl, cache_missing)
+            return value
+
+        lease = Lock(self.conn, "rebuild:" + key, expire=REBUILD_LEASE_TTL)
+        if lease.acquire(blocking=False):
+            return self._rebuild_leased(lease, key, rebuild, ttl, cache_missing)
+
+        # somebody else is rebuilding the value, wait for it
+        CACHE_REBUILD_WAITS.labels(key_prefix(key)).inc(1)
+        deadline = time.monotonic() + REBUILD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REBUILD_POLL_INTERVAL)
+            data = self.get(key, raw=True)
+            if self.is_tombstone(key, data):
+                return None
+            if data is not None:
+                return self._decode(key, data)
+
+        return self._rebuild(key, rebuild, ttl, cache_missing)
+
+    def mget_or_rebuild(
+        self,
+        keys: [str],
+        rebuild,
+        ttl: int = DEFAULT_CACHE_TTL,
+        cache_missing: bool = False,
+    ) -> [object]:
+        """
+        Get multiple values and rebuild the missing ones in single batch
+
+        Values are read with single MGET, all missing keys are passed to rebuild at once
+        and rebuilt values are written back in single pipeline
+        :param keys: keys
+        :param rebuild: function which takes list of missing keys and returns list of values in the same order,
+                        None values are not stored
+        :param ttl: time to live of rebuilt values
+        :param cache_missing: store tombstones for keys which rebuild didn't find
+        :return: values in order of keys, None for things that don't exist
+        """
+        if not keys:
+            return []
+
+        values = [None] * len(keys)
+        missing = []
+        for idx, (key, data) in enumerate(zip(keys, self.mget(keys, raw=True))):
+            if self.is_tombstone(key, data):
+                continue
+            values[idx] = self._decode(key, data)
+            if values[idx] is None:
+                missing.append(idx)
+
+        if not missing:
+            return values
+
+        missing_keys = list(OrderedDict.fromkeys(keys[idx] for idx in missing))
+        rebuilt = dict(zip(missing_keys, rebuild(missing_keys)))
+
+        pipe = self.conn.pipeline(transaction=False)
+        for key, value in rebuilt.items():
+            if value is None:
+                if cache_missing:
+                    pipe.setex(key, self.tombstone_ttl, TOMBSTONE)
+            elif ttl == 0:
+                pipe.set(key, self._encode(key, value))
+            else:
+                pipe.setex(key, ttl, self._encode(key, value))
+        self._invalidate(missing_keys, pipe)
+        pipe.execute()
+
+        for idx in missing:
+            values[idx] = rebuilt.get(keys[idx])
+        return values
+
+    def delete(self, *names):
+        """
+        Delete keys from cache
+        :param names: keys
+        :return: number of deleted keys
+        """
+        batch = self._current_batch()
+        if batch is not None:
+
+            def queue_delete(pipe):
+                pipe.delete(*names)
+                self._invalidate(names, pipe)
+
+            return batch.queue(queue_delete)
+        if self.local is None:
+            return self.conn.delete(*names)
+
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.delete(*names)
+        self._invalidate(names, pipe)
+        return pipe.execute()[0]
+
+    def clear(self, keep: tuple = ()):
+        """
+        Delete all keys from cache
+        :param keep: keys starting with any of these prefixes are kept, they're looked up by SCAN
+        """
+        if keep:
+            keep = tuple(prefix.encode() for prefix in keep)
+            batch = []
+            for key in self.conn.scan_iter(count=1000):
+                if not key.startswith(keep):
+                    batch.append(key)
+                if len(batch) >= 1000:
+                    self.conn.delete(*batch)
+                    batch = []
+            res = self.conn.delete(*batch) if batch else 0
+        else:
+            res = self.conn.flushdb()
+        if self.local is not None:
+            self._invalidate([INVALIDATE_ALL])
+        return res
+
+    def _current_batch(self) -> Batch:
+        return getattr(self._batch_state, "batch", None)
+
+    @contextmanager
+    def batch(self):
+        """
+        Queue writes issued inside the block and send them in single pipeline when the block ends
+
+        Cache.set, Cache.delete and BATCHED_COMMANDS return Deferred results inside the block,
+        reads are executed immediately and don't see writes queued in the batch,
+        so batch only blocks in which no read depends on an earlier write.
+        Nested blocks join the outer batch
+        """
+        outer = self._current_batch()
+        if outer is not None:
+            yield outer
+            return
+
+        batch = Batch(self.conn.pipeline(transaction=False))
+        self._batch_state.batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch_state.batch = None
+            batch.execute()
+
+    def flush(self):
+        """
+        Send writes queued in current batch right away, e.g. before releasing a lock they were made under
+        """
+        batch = self._current_batch()
+        if batch is not None:
+            batch.execute()
 
     def __getattr__(self, name):
+        if name in BATCHED_COMMANDS:
+            batch = self._current_batch()
+            if batch is not None:
+                return lambda *args, **kwargs: batch.queue(
+                    lambda pipe: getattr(pipe, name)(*args, **kwargs)
+                )
         return getattr(self.conn, name)
 
     def __getitem__(self, name):
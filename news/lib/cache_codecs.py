@@ -0,0 +1,329 @@
+"""
+Compact serializers for values stored in cache
+
+Every encoded value starts with a header byte so different encodings can coexist under the same keys,
+pickled values always start with the pickle PROTO opcode (0x80) which makes them readable alongside
+values written by the compact codecs
+
+Large values can be also compressed, compressed values start with header of the compression
+followed by the compressed encoded value
+"""
+import struct
+import zlib
+from itertools import chain
+from datetime import datetime, timedelta
+from pickle import dumps, loads
+
+try:
+    import lz4.block as lz4_block
+except ImportError:  # lz4 is optional, zlib is used instead
+    lz4_block = None
+
+PICKLE_HEADER = 0x80
+MODEL_HEADER = 0x01
+TUPLES_HEADER = 0x02
+ZLIB_HEADER = 0x03
+LZ4_HEADER = 0x04
+
+# zlib level, values above 1 cost a lot of CPU for little gain on cached values
+ZLIB_LEVEL = 1
+
+# format version of compact codecs, bump when the encoding changes
+CODEC_VERSION = 1
+
+# value tags used by ModelCodec
+_MISSING, _NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _DATETIME, _PICKLE = range(
+    10
+)
+
+_EPOCH = datetime(1970, 1, 1)
+_DOUBLE = struct.Struct("<d")
+_TUPLES_HEAD = struct.Struct("<BBBI")
+
+
+class CodecError(Exception):
+    """
+    Raised when value can't be encoded or decoded by given codec
+    """
+
+    pass
+
+
+def _write_varint(buf: bytearray, value: int):
+    """
+    Write unsigned integer as LEB128 varint
+    """
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> (int, int):
+    """
+    Read unsigned LEB128 varint
+    :return: value and position after the varint
+    """
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+class PickleCodec:
+    """
+    Default codec, pickles everything
+    """
+
+    header = PICKLE_HEADER
+
+    def encode(self, value: object) -> bytes:
+        return dumps(value)
+
+    def decode(self, data: bytes) -> object:
+        return loads(data)
+
+
+class ModelCodec:
+    """
+    Struct-packed codec for serialized models
+
+    Attributes listed in the schema (usually __fillable__ and timestamps of the model) are written
+    without their names in schema order, attributes outside of the schema are written with their names.
+    Schema id is written with the data so entries written with different schema are treated as cache misses
+    """
+
+    header = MODEL_HEADER
+
+    def __init__(self, fields: [str]):
+        self.fields = list(fields)
+        self._positions = {field: idx for idx, field in enumerate(self.fields)}
+        self.schema_id = zlib.crc32(",".join(self.fields).encode())
+
+    @classmethod
+    def for_model(cls, model) -> "ModelCodec":
+        """
+        Create codec for given model, schema is derived from __fillable__
+        :param model: model class
+        :return: codec
+        """
+        fields = list(model.__fillable__)
+        for field in ["created_at", "updated_at"]:
+            if field not in fields:
+                fields.append(field)
+        return cls(fields)
+
+    def encode(self, value: dict) -> bytes:
+        if not isinstance(value, dict):
+            raise CodecError("ModelCodec can only encode dicts")
+
+        buf = bytearray((MODEL_HEADER, CODEC_VERSION))
+        buf += struct.pack("<I", self.schema_id)
+        for field in self.fields:
+            if field in value:
+                self._write_value(buf, value[field])
+            else:
+                buf.append(_MISSING)
+
+        extra = [key for key in value if key not in self._positions]
+        _write_varint(buf, len(extra))
+        for key in extra:
+            self._write_str(buf, key)
+            self._write_value(buf, value[key])
+        return bytes(buf)
+
+    def decode(self, data: bytes) -> dict:
+        if data[0] != MODEL_HEADER or data[1] != CODEC_VERSION:
+            raise CodecError("unknown encoding")
+        (schema_id,) = struct.unpack_from("<I", data, 2)
+        if schema_id != self.schema_id:
+            raise CodecError("schema changed")
+
+        res = {}
+        pos = 6
+        for field in self.fields:
+            if data[pos] == _MISSING:
+                pos += 1
+                continue
+            res[field], pos = self._read_value(data, pos)
+
+        extra, pos = _read_varint(data, pos)
+        for _ in range(extra):
+            key, pos = self._read_str(data, pos)
+            res[key], pos = self._read_value(data, pos)
+        return res
+
+    @staticmethod
+    def _write_str(buf: bytearray, value: str):
+        raw = value.encode()
+        _write_varint(buf, len(raw))
+        buf += raw
+
+    @staticmethod
+    def _read_str(data: bytes, pos: int) -> (str, int):
+        length, pos = _read_varint(data, pos)
+        return data[pos : pos + length].decode(), pos + length
+
+    def _write_value(self, buf: bytearray, value: object):
+        t = type(value)
+        if value is None:
+            buf.append(_NONE)
+        elif t is bool:
+            buf.append(_TRUE if value else _FALSE)
+        elif t is int:
+            buf.append(_INT)
+            _write_varint(buf, _zigzag(value))
+        elif t is float:
+            buf.append(_FLOAT)
+            buf += _DOUBLE.pack(value)
+        elif t is str:
+            buf.append(_STR)
+            self._write_str(buf, value)
+        elif t is bytes:
+            buf.append(_BYTES)
+            _write_varint(buf, len(value))
+            buf += value
+        elif t is datetime and value.tzinfo is None:
+            delta = value - _EPOCH
+            buf.append(_DATETIME)
+            _write_varint(
+                buf,
+                _zigzag(
+                    (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+                ),
+            )
+        else:
+            raw = dumps(value)
+            buf.append(_PICKLE)
+            _write_varint(buf, len(raw))
+            buf += raw
+
+    def _read_value(self, data: bytes, pos: int) -> (object, int):
+        tag = data[pos]
+        pos += 1
+        if tag == _NONE:
+            return None, pos
+        if tag == _FALSE:
+            return False, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _INT:
+            value, pos = _read_varint(data, pos)
+            return _unzigzag(value), pos
+        if tag == _FLOAT:
+            return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+        if tag == _STR:
+            return self._read_str(data, pos)
+        if tag == _BYTES:
+            length, pos = _read_varint(data, pos)
+            return data[pos : pos + length], pos + length
+        if tag == _DATETIME:
+            value, pos = _read_varint(data, pos)
+            return _EPOCH + timedelta(microseconds=_unzigzag(value)), pos
+        if tag == _PICKLE:
+            length, pos = _read_varint(data, pos)
+            return loads(data[pos : pos + length]), pos + length
+        raise CodecError("unknown tag {}".format(tag))
+
+
+class TuplesCodec:
+    """
+    Struct-packed codec for lists of equally long numeric rows, e.g. [[id, sort value, ...], ...]
+    as used by LinkQuery and SortedComments
+
+    Integer columns are packed as int32 or int64, all other numeric columns as doubles
+    """
+
+    header = TUPLES_HEADER
+
+    def encode(self, value: list) -> bytes:
+        if not isinstance(value, list):
+            raise CodecError("TuplesCodec can only encode lists of rows")
+        try:
+            widths = set(map(len, value))
+        except TypeError:
+            raise CodecError("TuplesCodec can only encode lists of rows")
+        if len(widths) > 1:
+            raise CodecError("rows must have the same length")
+        width = widths.pop() if widths else 0
+
+        fmt = ""
+        for column in zip(*value):
+            types = set(map(type, column))
+            if types == {int}:
+                fmt += (
+                    "i" if -(2 ** 31) <= min(column) and max(column) < 2 ** 31 else "q"
+                )
+            elif types <= {int, float}:
+                fmt += "d"
+            else:
+                raise CodecError("only numeric rows are supported")
+
+        head = _TUPLES_HEAD.pack(TUPLES_HEADER, CODEC_VERSION, width, len(value))
+        try:
+            body = struct.pack("<" + fmt * len(value), *chain.from_iterable(value))
+        except struct.error as e:
+            raise CodecError(str(e))
+        return head + fmt.encode() + body
+
+    def decode(self, data: bytes) -> list:
+        header, version, width, count = _TUPLES_HEAD.unpack_from(data, 0)
+        if header != TUPLES_HEADER or version != CODEC_VERSION:
+            raise CodecError("unknown encoding")
+        if not width:
+            return [[] for _ in range(count)]
+
+        pos = _TUPLES_HEAD.size
+        fmt = data[pos : pos + width].decode()
+        rows = struct.iter_unpack("<" + fmt, memoryview(data)[pos + width :])
+        return list(map(list, rows))
+
+
+PICKLE = PickleCodec()
+
+
+def compress(data: bytes) -> bytes:
+    """
+    Compress encoded value with lz4 if available, zlib otherwise
+    :param data: encoded value
+    :return: compressed value with compression header
+    """
+    if lz4_block is not None:
+        return bytes((LZ4_HEADER,)) + lz4_block.compress(data)
+    return bytes((ZLIB_HEADER,)) + zlib.compress(data, ZLIB_LEVEL)
+
+
+def is_compressed(data: bytes) -> bool:
+    return data[0] in (ZLIB_HEADER, LZ4_HEADER)
+
+
+def decompress(data: bytes) -> bytes:
+    """
+    Decompress value compressed by compress
+    :param data: compressed value with compression header
+    :return: encoded value
+    """
+    body = memoryview(data)[1:]
+    if data[0] == ZLIB_HEADER:
+        try:
+            return zlib.decompress(body)
+        except zlib.error as e:
+            raise CodecError(str(e))
+    if data[0] == LZ4_HEADER and lz4_block is not None:
+        try:
+            return lz4_block.decompress(body)
+        except lz4_block.LZ4BlockError as e:
+            raise CodecError(str(e))
+    raise CodecError("unsupported compression")
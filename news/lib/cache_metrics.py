@@ -0,0 +1,120 @@
+import re
+import time
+
+from flask import g, has_request_context
+from redis import StrictRedis
+from redis.client import Pipeline
+
+from news.lib.metrics import (
+    CACHE_HITS,
+    CACHE_MISSES,
+    CACHE_COMMAND_TIME,
+    CACHE_VALUE_BYTES,
+    CACHE_ROUND_TRIPS,
+)
+
+# prefix is the leading word of the key, its length is limited so labels stay bounded
+# no matter what ends up in the keys
+_PREFIX_RE = re.compile(r"^([A-Za-z]{1,24}[:_])")
+
+# commands which read values, used to count hits and misses
+_READS = {"GET", "MGET", "SMEMBERS", "HGETALL", "LRANGE", "ZRANGE", "ZREVRANGE"}
+# commands which write values and position of the value in their arguments
+_WRITES = {"SET": 2, "SETEX": 3, "SETNX": 2, "PSETEX": 3, "GETSET": 2}
+
+
+def key_prefix(key) -> str:
+    """
+    Derive key prefix from the shape of the key, e.g. 'f:' for 'f:12' or 'fslug:' for 'fslug:python'
+    :param key: cache key
+    :return: prefix or empty string if key doesn't have any
+    """
+    if isinstance(key, bytes):
+        key = key.decode(errors="replace")
+    elif not isinstance(key, str):
+        return ""
+    match = _PREFIX_RE.match(key)
+    return match.group(1) if match else ""
+
+
+def _count_round_trip():
+    if has_request_context():
+        g.cache_round_trips = g.get("cache_round_trips", 0) + 1
+
+
+def observe_round_trips(exc=None):
+    """
+    Observe number of Redis round trips made by the request, registered as request teardown
+    """
+    if has_request_context():
+        CACHE_ROUND_TRIPS.observe(g.pop("cache_round_trips", 0))
+
+
+def _record(args: tuple, result: object):
+    """
+    Record hits, misses and value sizes of single command
+    :param args: command name and its arguments
+    :param result: command result
+    """
+    command = args[0]
+    if command in _READS:
+        if command == "MGET":
+            keys, values = args[1:], result
+        else:
+            keys, values = args[1:2], [result]
+        for key, value in zip(keys, values):
+            prefix = key_prefix(key)
+            if value:
+                CACHE_HITS.labels(prefix).inc(1)
+                if isinstance(value, bytes):
+                    CACHE_VALUE_BYTES.labels(prefix, "read").observe(len(value))
+            else:
+                CACHE_MISSES.labels(prefix).inc(1)
+    elif command in _WRITES and len(args) > _WRITES[command]:
+        value = args[_WRITES[command]]
+        if isinstance(value, (bytes, str)):
+            CACHE_VALUE_BYTES.labels(key_prefix(args[1]), "write").observe(len(value))
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Pipeline which records metrics of all buffered commands
+    """
+
+    def execute(self, raise_on_error=True):
+        stack = [args for args, _ in self.command_stack]
+        if not stack:
+            return super().execute(raise_on_error)
+
+        _count_round_trip()
+        start = time.perf_counter()
+        results = super().execute(raise_on_error)
+        CACHE_COMMAND_TIME.labels(
+            key_prefix(stack[0][1]) if len(stack[0]) > 1 else "", "PIPELINE"
+        ).observe(time.perf_counter() - start)
+
+        for args, result in zip(stack, results):
+            if not isinstance(result, Exception):
+                _record(args, result)
+        return results
+
+
+class InstrumentedRedis(StrictRedis):
+    """
+    Redis client which records per key prefix command latency, hits, misses and value sizes
+    """
+
+    def execute_command(self, *args, **options):
+        _count_round_trip()
+        start = time.perf_counter()
+        result = super().execute_command(*args, **options)
+        CACHE_COMMAND_TIME.labels(
+            key_prefix(args[1]) if len(args) > 1 else "", args[0]
+        ).observe(time.perf_counter() - start)
+        _record(args, result)
+        return result
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
@@ -17,9 +17,9 @@ def add_new_comment(link_id, comment):
 
 def update_comment(comment):
     """
-    Updates comment and reorders comments if needed
-    :param comment:
+    Rank comment enqueued before comments were ranked from dirty sets, remove in the next release
+    :param comment: comment to rank
     """
-    from news.models.comment import SortedComments
+    from news.scripts.update_rankings import mark_dirty
 
-    SortedComments(comment.link_id).update([comment])
+    mark_dirty("comment", [comment.id])
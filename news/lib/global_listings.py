@@ -0,0 +1,157 @@
+import time
+
+from news.clients.db.query import MergedLinkQuery, TIME_WINDOWS
+from news.lib.cache import cache
+from news.lib.metrics import GLOBAL_LISTING_STALENESS, GLOBAL_LISTING_FALLBACKS
+from news.lib.pagination import check_cursor, seek_rows
+
+LISTINGS = ["trending", "new", "best.all"] + ["best." + time for time in TIME_WINDOWS]
+MERGED_SORTS = ["trending", "new", "best"]
+
+GENERATION_KEY = "gl:generation"
+
+# listings are rebuilt at least this often
+INTERVAL = 5
+# and at most this often when links change
+MIN_INTERVAL = 1
+# older listings aren't served, links are merged on request instead
+MAX_STALENESS = 60
+
+
+class GlobalListing:
+    """
+    Single precomputed listing which can be paginated by news.lib.pagination.paginate_listing
+    """
+
+    def __init__(self, rows: list, generation: int):
+        self.rows = rows
+        self.generation = generation
+
+    def fetch(self, offset: int = 0, limit: int = None) -> list:
+        return self.rows[offset : None if limit is None else offset + limit]
+
+    def seek(self, cursor, limit: int, before: bool = False) -> list:
+        if self.rows:
+            check_cursor(cursor, len(self.rows[0]) - 1)
+        if cursor.generation == self.generation:
+            # listing didn't change since the cursor was created, the link is where it was
+            cursor = cursor._replace(
+                key=next(
+                    (row[1:] for row in self.rows if row[0] == cursor.last_id),
+                    cursor.key,
+                )
+            )
+        return seek_rows(self.rows, cursor, limit, before)
+
+
+class GlobalListings:
+    """
+    Precomputed listings of default feeds shown to anonymous users
+
+    Background process rebuilds all listings every INTERVAL seconds or sooner when links of default feeds change.
+    Every listing is single cached value of (generation, built at, tuples) so serving anonymous page takes one read,
+    all listings of one build share the generation
+    """
+
+    def __init__(self, app=None):
+        self.feed_ids = []
+        self.interval = INTERVAL
+        self.min_interval = MIN_INTERVAL
+        self.max_staleness = MAX_STALENESS
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.feed_ids = list(app.config["DEFAULT_FEEDS"])
+        self.interval = app.config.get("GLOBAL_LISTINGS_INTERVAL", INTERVAL)
+        self.min_interval = app.config.get("GLOBAL_LISTINGS_MIN_INTERVAL", MIN_INTERVAL)
+        self.max_staleness = app.config.get(
+            "GLOBAL_LISTINGS_MAX_STALENESS", MAX_STALENESS
+        )
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return "gl:{}.rows".format(name)
+
+    def _compute(self, name: str) -> list:
+        """
+        Merge listing from feed queries
+        :param name: listing name, 'trending', 'new' or 'best.<time window>'
+        :return: sorted [id, sort values...] tuples
+        """
+        sort, _, window = name.partition(".")
+        return MergedLinkQuery(self.feed_ids, sort, window or "all").fetch()
+
+    def is_dirty(self) -> bool:
+        """
+        Check whether links of default feeds changed since last build
+        Merged queries of default feeds are deleted whenever any of the feeds changes (or when they expire)
+        :return: True if listings should be rebuilt
+        """
+        pipe = cache.pipeline(transaction=False)
+        for sort in MERGED_SORTS:
+            pipe.exists(MergedLinkQuery(self.feed_ids, sort)._cache_key)
+        return not all(pipe.execute())
+
+    def build(self) -> int:
+        """
+        Rebuild all listings
+        :return: generation of built listings
+        """
+        listings = {name: self._compute(name) for name in LISTINGS}
+        generation = cache.incr(GENERATION_KEY)
+        built_at = time.time()
+        with cache.batch():
+            for name, rows in listings.items():
+                cache.set(self._key(name), (generation, built_at, rows))
+        return generation
+
+    def run(self):
+        """
+        Rebuild listings forever
+        """
+        built_at = 0
+        while True:
+            elapsed = time.monotonic() - built_at
+            if elapsed >= self.interval or self.is_dirty():
+                built_at = time.monotonic()
+                generation = self.build()
+                print(
+                    "Built generation {} in {:.2f}s".format(
+                        generation, time.monotonic() - built_at
+                    )
+                )
+            time.sleep(self.min_interval)
+
+    def listing(self, name: str) -> GlobalListing:
+        """
+        Get precomputed listing
+        Listing is merged on request (with generation 0) if it's missing or older than max staleness
+        :param name: listing name, 'trending', 'new' or 'best.<time window>'
+        :return: listing
+        """
+        if name not in LISTINGS:
+            return GlobalListing(self._compute(name), 0)
+
+        stored = cache.get(self._key(name))
+        if stored is not None:
+            generation, built_at, rows = stored
+            staleness = time.time() - built_at
+            GLOBAL_LISTING_STALENESS.labels(name).observe(staleness)
+            if staleness <= self.max_staleness:
+                return GlobalListing(rows, generation)
+
+        GLOBAL_LISTING_FALLBACKS.labels(name).inc()
+        return GlobalListing(self._compute(name), 0)
+
+    def links(self, name: str) -> list:
+        """
+        Get ids of precomputed listing
+        :param name: listing name, 'trending', 'new' or 'best.<time window>'
+        :return: sorted link ids
+        """
+        return [row[0] for row in self.listing(name).rows]
+
+
+global_listings = GlobalListings()
@@ -0,0 +1,74 @@
+from flask import g, has_request_context
+
+from news.lib.metrics import IDENTITY_MAP_HITS
+
+# returned by lookups of keys which weren't loaded yet, None is remembered as "doesn't exist"
+MISSING = object()
+
+
+class IdentityMap:
+    """
+    Request scoped map of already loaded models
+
+    Models are stored under their cache keys (or other lookup keys like 'uname:<username>')
+    so the same feed or user is loaded only once per request no matter how many times it's looked up.
+    Outside of request (jobs, scripts) the map is disabled
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.teardown_request(self._teardown)
+
+    @staticmethod
+    def _map() -> dict:
+        if not has_request_context():
+            return None
+        if "identity_map" not in g:
+            g.identity_map = {}
+            g.identity_map_hits = 0
+        return g.identity_map
+
+    def get(self, key: str) -> object:
+        """
+        Get model loaded earlier in this request
+        :param key: lookup key
+        :return: model, None if it doesn't exist or MISSING if it wasn't loaded yet
+        """
+        identity_map = self._map()
+        if identity_map is None:
+            return MISSING
+        obj = identity_map.get(key, MISSING)
+        if obj is not MISSING:
+            g.identity_map_hits += 1
+        return obj
+
+    def add(self, key: str, obj: object):
+        """
+        Remember loaded model for the rest of the request
+        :param key: lookup key
+        :param obj: model or None if it doesn't exist
+        """
+        identity_map = self._map()
+        if identity_map is not None:
+            identity_map[key] = obj
+
+    def discard(self, *keys: str):
+        """
+        Forget models under given keys
+        :param keys: lookup keys
+        """
+        identity_map = self._map()
+        if identity_map is not None:
+            for key in keys:
+                identity_map.pop(key, None)
+
+    def _teardown(self, exc=None):
+        if "identity_map" in g:
+            IDENTITY_MAP_HITS.observe(g.pop("identity_map_hits"))
+            g.pop("identity_map")
+
+
+identity_map = IdentityMap()
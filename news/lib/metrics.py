@@ -1,8 +1,84 @@
 # Create a metric to track time spent and requests made.
 from prometheus_client import Summary, Counter, Gauge, Histogram
 
-CACHE_HITS = Counter("cache_hits_total", "Total cache hits")
-CACHE_MISSES = Counter("cache_miss_total", "Total cache misses")
+CACHE_HITS = Counter("cache_hits_total", "Total cache hits", ["prefix"])
+CACHE_MISSES = Counter("cache_miss_total", "Total cache misses", ["prefix"])
 RATELIMIT_HITS = Counter("ratelimit_hits", "Total hits of ratelimit")
 QUEUE_STATE = Gauge("tasks_in_queue", "Total tasks in queue")
 REQUEST_TIME = Histogram("request_processing_seconds", "Time spent processing request")
+CACHE_L1_HITS = Counter(
+    "cache_l1_hits_total", "Total in-process cache hits", ["prefix"]
+)
+CACHE_L1_MISSES = Counter(
+    "cache_l1_miss_total", "Total in-process cache misses", ["prefix"]
+)
+CACHE_L1_INVALIDATIONS = Counter(
+    "cache_l1_invalidations_total", "Total invalidations of in-process cache"
+)
+CACHE_EARLY_REFRESHES = Counter(
+    "cache_early_refreshes_total", "Total values rebuilt before expiration", ["prefix"]
+)
+CACHE_REBUILD_WAITS = Counter(
+    "cache_rebuild_waits_total",
+    "Total cache misses which waited for value rebuilt by other process",
+    ["prefix"],
+)
+CACHE_TOMBSTONE_HITS = Counter(
+    "cache_tombstone_hits_total",
+    "Total database queries prevented by cached misses",
+    ["prefix"],
+)
+IDENTITY_MAP_HITS = Histogram(
+    "identity_map_hits_per_request",
+    "Model lookups per request served by request identity map",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+CACHE_COMMAND_TIME = Histogram(
+    "cache_command_seconds",
+    "Time spent in Redis commands and pipelines",
+    ["prefix", "command"],
+    buckets=(
+        0.0001,
+        0.00025,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.5,
+    ),
+)
+CACHE_VALUE_BYTES = Summary(
+    "cache_value_bytes",
+    "Size of values read from and written to cache",
+    ["prefix", "op"],
+)
+CACHE_ROUND_TRIPS = Histogram(
+    "cache_round_trips_per_request",
+    "Redis round trips made by single request",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+GLOBAL_LISTING_STALENESS = Histogram(
+    "global_listing_staleness_seconds",
+    "Age of precomputed anonymous listings when they are read",
+    ["listing"],
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+GLOBAL_LISTING_FALLBACKS = Counter(
+    "global_listing_fallbacks_total",
+    "Anonymous listings merged on request because precomputed one was missing or too stale",
+    ["listing"],
+)
+VOTE_FLUSH_LAG = Histogram(
+    "vote_flush_lag_seconds",
+    "Time from applying vote in cache until it's written to database",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300),
+)
+VOTE_FLUSH_BATCH_SIZE = Histogram(
+    "vote_flush_batch_size",
+    "Votes written to database by single flush",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
@@ -1,5 +1,28 @@
+import binascii
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Optional
+
 from flask import request
 
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# position in sorted listing: sort values and id of the last shown item, generation of the listing
+# and approximate index of the item in the listing
+Cursor = namedtuple(
+    "Cursor", ["key", "last_id", "generation", "position"], defaults=(0,)
+)
+
+
+class InvalidCursor(ValueError):
+    """
+    Cursor which can't be seeked in the listing, e.g. cursor of other sort
+    """
+
 
 def paginate(items, page_size):
     count = request.args.get("count", default=0, type=int)
@@ -10,3 +33,236 @@ def paginate(items, page_size):
         max(0, start - page_size) if start > 0 else None,
         end if end < len(items) else None,
     )
+
+
+def page_depth(page_size):
+    """
+    How many items have to be loaded to paginate current page
+    One item more than the page is needed to know whether there are more pages
+    """
+    count = request.args.get("count", default=0, type=int)
+    return max(count, 0) + page_size + 1
+
+
+def encode_cursor(row: list, generation: int = 0, position: int = 0) -> str:
+    """
+    Encode position after the row to opaque cursor
+    :param row: [id, sort values...] tuple
+    :param generation: generation of the listing
+    :param position: index of the row in the listing
+    :return: cursor
+    """
+    payload = json.dumps(
+        [list(row[1:]), row[0], generation, position], separators=(",", ":")
+    )
+    return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(value: Optional[str]) -> Optional[Cursor]:
+    """
+    Decode cursor from request
+    :param value: cursor
+    :return: cursor or None if it's missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        payload = urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        fields = json.loads(payload.decode())
+        key, last_id, generation = fields[:3]
+        # cursors without position are still accepted
+        position = fields[3] if len(fields) > 3 else 0
+        if (
+            not isinstance(key, list)
+            or not key
+            or not all(
+                isinstance(x, (int, float))
+                and not isinstance(x, bool)
+                and math.isfinite(x)
+                for x in key
+            )
+        ):
+            return None
+        return Cursor(key, int(last_id), int(generation), max(int(position), 0))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, OverflowError):
+        return None
+
+
+def check_cursor(cursor: Cursor, key_length: int):
+    """
+    Check that cursor has as many sort values as tuples of the seeked listing
+    :param cursor: cursor
+    :param key_length: number of sort values in tuples of the listing
+    :raises InvalidCursor: when the cursor belongs to a listing of other sort
+    """
+    if len(cursor.key) != key_length:
+        raise InvalidCursor(
+            "cursor has {} sort values, listing has {}".format(
+                len(cursor.key), key_length
+            )
+        )
+
+
+def cursor_for_listing(cursor: Optional[Cursor], generation: int) -> Optional[Cursor]:
+    """
+    Check that cursor was created by the same generation of the listing
+    Cursor of other generation (or of other listing) is seeked by its sort values and id only,
+    its position isn't known in this listing so it's dropped
+    :param cursor: decoded cursor or None
+    :param generation: generation of the paginated listing
+    :return: cursor usable with the listing
+    """
+    if cursor is None or cursor.generation == generation:
+        return cursor
+    return cursor._replace(position=0)
+
+
+def seek_rows(rows: list, cursor: Cursor, limit: int, before: bool = False) -> list:
+    """
+    Seek in sorted list of tuples
+    Listing continues right after the cursor's item, if the item moved or disappeared
+    it continues after other items with the same sort values
+    :param rows: [id, sort values...] tuples sorted by sort values descending
+    :param cursor: cursor
+    :param limit: maximal number of tuples to return
+    :param before: return tuples preceding the cursor instead of following it
+    :return: tuples in listing order
+    """
+    key = list(cursor.key)
+    position = next(
+        (
+            idx
+            for idx, row in enumerate(rows)
+            if row[0] == cursor.last_id and list(row[1:]) == key
+        ),
+        None,
+    )
+    if before:
+        if position is None:
+            position = next(
+                (idx for idx, row in enumerate(rows) if list(row[1:]) <= key), len(rows)
+            )
+        return rows[max(0, position - limit) : position]
+
+    if position is None:
+        start = next(
+            (idx for idx, row in enumerate(rows) if list(row[1:]) < key), len(rows)
+        )
+    else:
+        start = position + 1
+    return rows[start : start + limit]
+
+
+def _seek(listing, cursor: Optional[Cursor], limit: int, before: bool = False):
+    """
+    Seek in listing
+    :return: tuples in listing order or None if there's no cursor or it doesn't fit the listing
+    """
+    if cursor is None:
+        return None
+    try:
+        return listing.seek(cursor, limit, before=before)
+    except InvalidCursor:
+        return None
+
+
+def paginate_listing(listing, page_size: int) -> (list, str, str):
+    """
+    Paginate sorted listing by cursors in request
+    Pages are seeked by 'after' and 'before' cursors, old 'count' offsets still work,
+    cursors which don't fit the listing are ignored
+    :param listing: listing with fetch(offset, limit) and seek(cursor, limit, before) returning
+    [id, sort values...] tuples, precomputed listings also have generation
+    :param page_size: page size
+    :return: ids on the page, cursor of previous page, cursor of next page
+    """
+    generation = getattr(listing, "generation", 0)
+    after = cursor_for_listing(decode_cursor(request.args.get("after")), generation)
+    before = cursor_for_listing(decode_cursor(request.args.get("before")), generation)
+
+    rows = _seek(listing, before, page_size + 1, before=True)
+    if rows is not None:
+        has_less, has_more = len(rows) > page_size, True
+        rows = rows[-page_size:]
+        start = max(before.position - len(rows), 0)
+    else:
+        rows = _seek(listing, after, page_size + 1)
+        if rows is not None:
+            has_less = True
+            start = after.position + 1
+        else:
+            count = max(request.args.get("count", default=0, type=int), 0)
+            rows = listing.fetch(count, page_size + 1)
+            has_less = count > 0
+            start = count
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+    if not rows:
+        return [], None, None
+    return (
+        [row[0] for row in rows],
+        encode_cursor(rows[0], generation, start) if has_less else None,
+        encode_cursor(rows[-1], generation, start + len(rows) - 1)
+        if has_more
+        else None,
+    )
+
+
+class NewestListing:
+    """
+    Items of a model sorted from the newest, seeked directly in the database
+    Tuples are [id, microseconds since epoch of creation] so cursors keep exact creation dates
+    """
+
+    def __init__(self, model, **where):
+        """
+        :param model: model with id and created_at columns
+        :param where: column values the items must have
+        """
+        self.model = model
+        self.where = where
+
+    def _query(self):
+        query = self.model.select("id", "created_at")
+        for column, value in self.where.items():
+            query = query.where(column, value)
+        return query
+
+    @staticmethod
+    def _rows(items) -> list:
+        return [[item.id, (item.created_at - EPOCH) // MICROSECOND] for item in items]
+
+    def fetch(self, offset: int = 0, limit: int = None) -> list:
+        query = self._query().order_by("created_at", "desc").order_by("id", "desc")
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return self._rows(query.get())
+
+    def seek(self, cursor: Cursor, limit: int, before: bool = False) -> list:
+        check_cursor(cursor, 1)
+        try:
+            position = [EPOCH + cursor.key[0] * MICROSECOND, cursor.last_id]
+        except OverflowError:
+            raise InvalidCursor("creation time out of range")
+        if before:
+            items = (
+                self._query()
+                .where_raw("(created_at, id) > (?, ?)", position)
+                .order_by("created_at", "asc")
+                .order_by("id", "asc")
+                .limit(limit)
+                .get()
+            )
+            return self._rows(reversed(list(items)))
+        items = (
+            self._query()
+            .where_raw("(created_at, id) < (?, ?)", position)
+            .order_by("created_at", "desc")
+            .order_by("id", "desc")
+            .limit(limit)
+            .get()
+        )
+        return self._rows(items)
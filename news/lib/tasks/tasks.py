@@ -1,24 +1,43 @@
-from rq.decorators import job
-
-from news.clients.db.query import LinkQuery
-from news.lib.task_queue import redis_conn
+from news.lib.global_listings import global_listings
 from news.scripts.import_fqs import import_fqs
+from news.scripts.rescore_trending import rescore_trending
+from news.scripts.size_link_queries import size_link_queries
+from news.scripts.sweep_time_windows import sweep_time_windows
+from news.scripts.update_rankings import mark_dirty, update_rankings
+from news.scripts.warm_cache import warm_cache
 
 
-@job("medium", connection=redis_conn)
 def JOB_update_link(updated_link):
     """
-    Update link score
-    :param updated_link: link to update
-    :return: nothing
+    Rank link enqueued before links were ranked from dirty sets, remove in the next release
+    :param updated_link: link to rank
     """
-    for sort in [
-        "trending",
-        "best",
-    ]:  # no need to update 'new' because it doesn't depend on score
-        LinkQuery(feed_id=updated_link.feed_id, sort=sort).insert([updated_link])
-    return None
+    mark_dirty("link", [updated_link.id])
 
 
 def JOB_import_feed_fqs():
     import_fqs()
+
+
+def JOB_warm_cache():
+    warm_cache()
+
+
+def JOB_build_global_listings():
+    global_listings.build()
+
+
+def JOB_sweep_time_windows():
+    sweep_time_windows()
+
+
+def JOB_rescore_trending():
+    rescore_trending()
+
+
+def JOB_size_link_queries():
+    size_link_queries()
+
+
+def JOB_update_rankings():
+    update_rankings(0, 1)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from orator import Schema
 from wtforms import SelectField, HiddenField, TextAreaField
 from wtforms.validators import DataRequired
@@ -110,8 +112,14 @@ class Ban(Base):
     def write_to_cache(self):
         """
         Write self to cache
-        """
-        cache.set(self.id, "y")
+        Ban is cached until it expires, expired bans are not written at all
+        """
+        ttl = 0
+        if self.until is not None:
+            ttl = int((self.until - datetime.utcnow()).total_seconds())
+            if ttl <= 0:
+                return
+        cache.set(self.id, "y", ttl=ttl)
 
     @classmethod
     def by_user_and_feed(cls, user, feed):
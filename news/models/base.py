@@ -7,7 +7,7 @@ from orator import Model
 from redis_lock import Lock
 
 from news.lib.cache import cache
-from news.lib.metrics import CACHE_HITS, CACHE_MISSES
+from news.lib.identity_map import identity_map, MISSING
 
 CACHE_EXPIRE_TIME = 12 * 60 * 60
 
@@ -66,6 +66,27 @@ class Base(Model):
         prefix = cls._cache_prefix()
         return "{prefix}{id}".format(prefix=prefix, id=id)
 
+    def _tombstone_keys(self) -> [str]:
+        """
+        Keys under which misses of this model may be remembered and under which it's kept in identity map
+        Models which are looked up by other attributes than id should extend this
+        :return: cache keys
+        """
+        return [self._cache_key]
+
+    def save(self, options=None) -> bool:
+        """
+        Save the model, forget remembered misses when the model gets created
+        :param options: orator save options
+        :return: whether model was saved
+        """
+        created = not self.exists
+        saved = super().save(options)
+        if saved and created:
+            cache.delete(*self._tombstone_keys())
+            identity_map.discard(*self._tombstone_keys())
+        return saved
+
     def get_read_modify_write_lock(self) -> Lock:
         """
         Gets read/modify/write lock for given things
@@ -95,6 +116,8 @@ class Base(Model):
         """
         # save token to redis for limited time
         cache.set(self._cache_key, self.serialize())
+        # copies loaded earlier in this request are stale now
+        identity_map.discard(*self._tombstone_keys())
 
     @classmethod
     def load_from_cache(cls, id: str) -> object:
@@ -106,11 +129,30 @@ class Base(Model):
         data = cache.get(cls._cache_key_from_id(id))
         if data is None:
             return None
+        return cls._from_cache_data(data)
+
+    @classmethod
+    def _from_cache_data(cls, data: dict) -> object:
+        """
+        Create model from data stored in cache
+        :param data: serialized model
+        :return: model
+        """
         obj = cls()
         obj.set_raw_attributes(data)
         obj.set_exists(True)
         return obj
 
+    @classmethod
+    def _cache_data_from_db(cls, id: str) -> dict:
+        """
+        Load serialized model from DB, used to rebuild cache
+        :param id: id
+        :return: serialized model or None if not found
+        """
+        item = cls.where("id", int(id)).first()
+        return item.serialize() if item is not None else None
+
     def incr(self, attr: str, amp: int = 1):
         """
         Increment given attribute
@@ -124,6 +166,8 @@ class Base(Model):
             self.set_attribute(attr, new_val)
             self.__class__.where("id", self.id).increment(attr, amp)
             self.write_to_cache()
+            # the write must land before the lock is released, writes queued in batch are sent along with it
+            cache.flush()
 
     def decr(self, attr: str, amp: int = 1):
         """
@@ -138,6 +182,7 @@ class Base(Model):
             self.set_attribute(attr, new_val)
             self.__class__.where("id", self.id).decrement(attr, amp)
             self.write_to_cache()
+            cache.flush()
 
     def set(self, attr: str, val: object):
         """
@@ -150,6 +195,7 @@ class Base(Model):
             self.set_raw_attribute(attr, val)
             self.save()
             self.write_to_cache()
+            cache.flush()
 
     def time_ago(self) -> str:
         return timeago.format(self.created_at, datetime.utcnow())
@@ -166,22 +212,22 @@ class Base(Model):
     def by_id(cls, id: str) -> object:
         """
         Tries to load the item from cache and if it fails from DB
+        Misses are rebuilt by single process and hot items get refreshed before they expire,
+        ids which don't exist are remembered for a short time
         items that are permanently stored in cache should overwrite this method
         :param id:
         :return:
         """
-        # try to load from cache
-        item = cls.load_from_cache(id)
-        if item is not None:
-            CACHE_HITS.inc(1)
+        key = cls._cache_key_from_id(id)
+        item = identity_map.get(key)
+        if item is not MISSING:
             return item
 
-        CACHE_MISSES.inc(1)
-        # check db on fail
-        item = cls.where("id", int(id)).first()
-        if item is not None:
-            item.write_to_cache()
-
+        data = cache.get_or_rebuild(
+            key, lambda: cls._cache_data_from_db(id), cache_missing=True
+        )
+        item = cls._from_cache_data(data) if data is not None else None
+        identity_map.add(key, item)
         return item
 
     @classmethod
@@ -192,23 +238,34 @@ class Base(Model):
     def by_ids(cls, ids: List[str]) -> List[object]:
         """
         Get items by ids
-        Uses pipe which is faster then loading the items one by one
+        Uses pipe which is faster then loading the items one by one,
+        items missing in cache are loaded from DB by single query and cached in single pipeline
         :param ids: list of ids of items to get
-        :return: items
+        :return: items in order of ids, items that don't exist are left out
         """
-        items = cache.mget([cls._cache_key_from_id(id) for id in ids])
+        keys = [cls._cache_key_from_id(id) for id in ids]
+        items = [identity_map.get(key) for key in keys]
+        missing = [key for key, item in zip(keys, items) if item is MISSING]
+        id_by_key = dict(zip(keys, ids))
+
+        def rebuild(missing_keys):
+            missing_ids = [int(id_by_key[key]) for key in missing_keys]
+            found = {
+                item.id: item.serialize()
+                for item in cls.where_in("id", missing_ids).get()
+            }
+            return [found.get(id) for id in missing_ids]
 
-        # fetch missing items
-        for idx, id in enumerate(ids):
-            if items[idx] is None:
-                items[idx] = cls.by_id(id)
-            else:
-                obj = cls()
-                obj.set_raw_attributes(items[idx])
-                obj.set_exists(True)
-                items[idx] = obj
+        loaded = {}
+        data = cache.mget_or_rebuild(missing, rebuild, cache_missing=True)
+        for key, item in zip(missing, data):
+            loaded[key] = cls._from_cache_data(item) if item is not None else None
+            identity_map.add(key, loaded[key])
 
-        return items
+        items = [
+            loaded[key] if item is MISSING else item for key, item in zip(keys, items)
+        ]
+        return [item for item in items if item is not None]
 
     def update(self, _attributes=None, **attributes):
         """
@@ -224,4 +281,5 @@ class Base(Model):
         Delete self from cache and db
         """
         cache.delete(self._cache_key)
+        identity_map.discard(*self._tombstone_keys())
         super().delete()
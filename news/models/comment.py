@@ -7,6 +7,7 @@ from wtforms import HiddenField, TextAreaField
 from wtforms.validators import DataRequired, Optional, Length
 
 from news.lib.cache import cache
+from news.lib.cache_codecs import ModelCodec, TuplesCodec
 from news.lib.comments import add_new_comment
 from news.clients.db.db import db
 from news.lib.task_queue import q
@@ -161,6 +162,9 @@ class Comment(Base):
         self.update_with_cache()
 
 
+cache.register_codec(Comment._cache_prefix(), ModelCodec.for_model(Comment))
+
+
 class TreeNotBuildException(Exception):
     pass
 
@@ -358,7 +362,11 @@ class SortedComments:
         def build_subtree(parent):
             return [
                 comments[parent],
-                [build_subtree(children_id) for children_id, _ in builder[parent]]
+                [
+                    build_subtree(children_id)
+                    for children_id, _ in builder[parent]
+                    if children_id in comments
+                ]
                 if parent in builder
                 else [],
             ]
@@ -374,6 +382,9 @@ class SortedComments:
         return tree
 
 
+cache.register_codec("scm:", TuplesCodec())
+
+
 class CommentForm(BaseForm):
     text = TextAreaField("comment", [DataRequired(), Length(max=8192)])
     parent_id = HiddenField(
@@ -9,6 +9,8 @@ from wtforms import StringField, TextAreaField, FileField
 from wtforms.validators import DataRequired, Length
 
 from news.lib.cache import cache
+from news.lib.cache_codecs import ModelCodec
+from news.lib.identity_map import identity_map, MISSING
 from news.clients.db.db import db
 from news.lib.task_queue import redis_conn, q
 from news.lib.utils.slugify import make_slug
@@ -72,13 +74,21 @@ class Feed(Base):
         """
         cache_key = "fslug:{}".format(slug)
 
+        feed = identity_map.get(cache_key)
+        if feed is not MISSING:
+            return feed
+
         # check feed slug cache
         in_cache = cache.get(cache_key, raw=True)
+        if cache.is_tombstone(cache_key, in_cache):
+            return None
         uid = int(in_cache) if in_cache else None
 
         # return user on success
         if uid is not None:
-            return Feed.by_id(uid)
+            feed = Feed.by_id(uid)
+            identity_map.add(cache_key, feed)
+            return feed
 
         # try to load user from DB on failure
         feed = Feed.where("slug", slug).first()
@@ -87,30 +97,16 @@ class Feed(Base):
         if feed is not None:
             cache.set(cache_key, feed.id, raw=True)
             feed.write_to_cache()
+            identity_map.add(cache_key, feed)
+            identity_map.add(feed._cache_key, feed)
+        else:
+            cache.set_tombstone(cache_key)
+            identity_map.add(cache_key, None)
 
         return feed
 
-    @classmethod
-    def by_id(cls, id: str) -> "Feed":
-        """
-        Find feed by id
-        :param id: id
-        :return: feed or None
-        """
-        f = cls.load_from_cache(id)
-
-        # return cached result if possible
-        if f is not None:
-            return f
-
-        # try to find feed in DB
-        f = Feed.where("id", id).first()
-
-        # cache the result
-        if f is not None:
-            f.write_to_cache()
-
-        return f
+    def _tombstone_keys(self) -> [str]:
+        return super()._tombstone_keys() + ["fslug:{}".format(self.slug)]
 
     @property
     def url(self) -> str:
@@ -161,6 +157,9 @@ class Feed(Base):
         q.enqueue(handle_new_feed, self, result_ttl=0)
 
 
+cache.register_codec(Feed._cache_prefix(), ModelCodec.for_model(Feed))
+
+
 class FeedForm(BaseForm):
     name = StringField("Name", [DataRequired(), Length(max=128, min=3)])
     description = TextAreaField(
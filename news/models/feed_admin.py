@@ -1,6 +1,7 @@
 from orator import accessor, Schema
 
 from news.clients.db.db import db
+from news.lib.identity_map import identity_map, MISSING
 from news.models.base import Base
 
 
@@ -73,4 +74,12 @@ class FeedAdmin(Base):
         :param feed_id: feed id
         :return: feed administration
         """
-        return cls.where("user_id", user_id).where("feed_id", feed_id).first()
+        key = "fa:{}.{}".format(user_id, feed_id)
+        feed_admin = identity_map.get(key)
+        if feed_admin is MISSING:
+            feed_admin = cls.where("user_id", user_id).where("feed_id", feed_id).first()
+            identity_map.add(key, feed_admin)
+        return feed_admin
+
+    def _tombstone_keys(self) -> [str]:
+        return ["fa:{}.{}".format(self.user_id, self.feed_id)]
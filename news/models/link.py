@@ -9,9 +9,15 @@ from wtforms.fields.html5 import URLField
 from wtforms.validators import DataRequired, Length
 
 from news.lib.cache import cache
+from news.lib.cache_codecs import ModelCodec
 from news.clients.db.db import db
-from news.clients.db.query import JOB_add_to_queries, LinkQuery
-from news.clients.db.sorts import sorts
+from news.clients.db.query import (
+    JOB_add_to_queries,
+    JOB_add_links_to_queries,
+    LinkQuery,
+    LinkScores,
+    feed_queries,
+)
 from news.lib.sorts import hot
 from news.lib.task_queue import q
 from news.lib.utils.slugify import make_slug
@@ -111,16 +117,16 @@ class Link(Base):
         :param slug: slug
         :return: maybe link
         """
-        cache_key = "lslug:{}".format(slug)
-        id = cache.get(cache_key)
-        if id is None:
-            link = Link.where("slug", slug).first()
-            if link is not None:
-                id = link.id
-                cache.set(cache_key, id)
-
+        id = cache.get_or_rebuild(
+            "lslug:{}".format(slug),
+            lambda: Link.where("slug", slug).pluck("id"),
+            cache_missing=True,
+        )
         return Link.by_id(id) if id else None
 
+    def _tombstone_keys(self) -> [str]:
+        return super()._tombstone_keys() + ["lslug:{}".format(self.slug)]
+
     @property
     def user(self) -> "User":
         """
@@ -193,23 +199,12 @@ class Link(Base):
     def get_by_feed_id(cls, feed_id: int, sort: str) -> ["Link"]:
         """
         Get links by feed id and sort
+        Links are read from the feed's link query, their objects are cached only once
         :param feed_id:
         :param sort:
         :return:
         """
-        cache_key = "fs:{}.{}".format(feed_id, sort)
-
-        r = cache.get(cache_key)
-        if r is not None:
-            return r
-
-        q = Link.where("feed_id", feed_id).order_by_raw(sorts[sort])
-
-        # cache needs array of objects, not a orator collection
-        res = [f for f in q.limit(1000).get()]
-        # TODO this is stupid, cache only ids?
-        cache.set(cache_key, res)
-        return res
+        return Link.by_ids(LinkQuery(feed_id=feed_id, sort=sort).fetch_ids())
 
     @property
     def score(self) -> int:
@@ -223,6 +218,15 @@ class Link(Base):
         self.save()
         q.enqueue(JOB_add_to_queries, self, result_ttl=0)
 
+    @classmethod
+    def add_to_queries(cls, links: ["Link"]):
+        """
+        Add many saved links to queries by single job
+        :param links: links
+        """
+        if links:
+            q.enqueue(JOB_add_links_to_queries, links, result_ttl=0)
+
     @property
     def full_route(self) -> str:
         """
@@ -246,29 +250,17 @@ class Link(Base):
         Same thing happens with the votes on comments of this link - votes get deleted and only final score is kept
         """
 
-        # delete link votes from DB
-        LinkVote.where("link_id", self.id).delete()
-        # delete cached link votes
-        link_upvotes_key, link_downvotes_key = LinkVote.set_keys(self.id)
-        cache.delete(link_upvotes_key)
-        cache.delete(link_downvotes_key)
-
-        # delete comment votes
-        for comment in Comment.where("link_id", self.id):
-            # delete cached comment votes
-            comment_upvotes_key, comment_downvotes_key = CommentVote.set_keys(
-                comment.id
-            )
-            cache.delete(comment_upvotes_key)
-            cache.delete(comment_downvotes_key)
-            # delete comment votes from DB
-            CommentVote.where("comment_id", comment.id).delete()
-
-        # update self
+        # mark the link archived first so no more votes are written for it
         with self.get_read_modify_write_lock():
             self.archived = True
             self.update_with_cache()
 
+        # delete votes on the link and its comments from DB and from vote sets of voters
+        LinkVote.archive_things([self.id])
+        CommentVote.archive_things(Comment.where("link_id", self.id).lists("id"))
+        # archived link isn't voted on anymore, its score is loaded from DB if needed
+        LinkScores.remove([self])
+
     @property
     def is_autoposted(self) -> bool:
         """
@@ -278,17 +270,16 @@ class Link(Base):
         return self.user_id == 12345
 
     def delete(self):
-        for sort in [
-            "trending",
-            "best",
-            "new",
-        ]:  # no need to update 'new' because it doesn't depend on score
-            q = LinkQuery(feed_id=self.feed_id, sort=sort)
+        for q in feed_queries(self.feed_id):
             q.delete([self])
+        LinkScores.remove([self])
         super().delete()
         cache.delete(self._cache_key)
 
 
+cache.register_codec(Link._cache_prefix(), ModelCodec.for_model(Link))
+
+
 class LinkForm(FlaskForm):
     title = StringField(
         "Title",
@@ -21,6 +21,8 @@ from wtforms.fields.html5 import EmailField, URLField
 from wtforms.validators import DataRequired, URL, Length, NumberRange
 
 from news.lib.cache import cache
+from news.lib.cache_codecs import ModelCodec
+from news.lib.identity_map import identity_map, MISSING
 from news.clients.db.db import db
 from news.lib.login import login_manager
 from news.clients.mail import reset_email, JOB_send_mail
@@ -31,7 +33,7 @@ from news.models.ban import Ban
 from news.models.base import Base
 from news.models.disposable_token import DisposableToken
 from news.models.feed_admin import FeedAdmin
-from news.models.vote import LinkVote, UPVOTE, DOWNVOTE, CommentVote
+from news.models.vote import LinkVote, UNVOTE, CommentVote
 
 MAX_SUBSCRIPTIONS_FREE = 50
 
@@ -162,11 +164,6 @@ class User(Base):
         session_key = "us:{}".format(self.session_token)
         cache.set(session_key, self.id, ttl=0 if remember_me else 60 * 60 * 2, raw=True)
         login_user(self, remember=remember_me)
-
-        LinkVote.by_user_and_vote_type(self.id, UPVOTE)
-        LinkVote.by_user_and_vote_type(self.id, DOWNVOTE)
-        CommentVote.by_user_and_vote_type(self.id, UPVOTE)
-        CommentVote.by_user_and_vote_type(self.id, DOWNVOTE)
         # Ip.from_request()
 
     def logout(self):
@@ -230,21 +227,6 @@ class User(Base):
             u._accessor_cache["session_token"] = session_id
         return u
 
-    @classmethod
-    def by_id(cls, id: int) -> Optional["User"]:
-        """
-        Get user by id
-        :param id:
-        :return:
-        """
-        u = cls.load_from_cache(id)
-        if u is not None:
-            return u
-        u = User.where("id", id).first()
-        if u is not None:
-            u.write_to_cache()
-        return u
-
     @classmethod
     def _cache_prefix(cls) -> str:
         return "u:"
@@ -335,30 +317,49 @@ class User(Base):
         key = "subs:{}".format(self.id)
         ids = cache.get(key) or []
         ids.append(feed.id)
-        cache.set(key, ids)
-
-        self.incr("feed_subs", 1)
-        self.update_with_cache()
 
         # TODO DO IN QUEUE
-        feed.incr("subscribers_count", 1)
+        self._count_subscription(feed, 1)
+        with cache.batch():
+            cache.set(key, ids)
+            self._drop_cached_counters(feed)
         return True
 
     def unsubscribe(self, feed: "Feed"):
         db.table("feeds_users").where("user_id", "=", self.id).where(
             "feed_id", "=", feed.id
         ).delete()
-        self.decr("feed_subs", 1)
-
-        # TODO DO IN QUEUE
-        feed.decr("subscribers_count", 1)
         key = "subs:{}".format(self.id)
         ids = cache.get(key)
-        if ids is not None:
-            ids = [id for id in ids if id != feed.id]
-            cache.set(key, ids)
+
+        # TODO DO IN QUEUE
+        self._count_subscription(feed, -1)
+        with cache.batch():
+            if ids is not None:
+                cache.set(key, [id for id in ids if id != feed.id])
+            self._drop_cached_counters(feed)
         return True
 
+    def _count_subscription(self, feed: "Feed", amp: int):
+        """
+        Change subscription counters of the user and the feed in DB
+        Counters are incremented by DB so no lock is needed, cached copies have to be dropped afterwards
+        :param feed: feed
+        :param amp: 1 for new subscription, -1 for cancelled one
+        """
+        User.where("id", self.id).increment("feed_subs", amp)
+        feed.__class__.where("id", feed.id).increment("subscribers_count", amp)
+        self.set_attribute("feed_subs", self.feed_subs + amp)
+        feed.set_attribute("subscribers_count", feed.subscribers_count + amp)
+
+    def _drop_cached_counters(self, feed: "Feed"):
+        """
+        Drop cached user and feed whose counters changed, they're loaded from DB next time
+        Deleting needs no read-modify-write lock so it's queued into current batch
+        :param feed: feed
+        """
+        cache.delete(self._cache_key, feed._cache_key)
+
     @classmethod
     def by_username(cls, username: str) -> Optional["User"]:
         """
@@ -368,13 +369,21 @@ class User(Base):
         """
         cache_key = "uname:{}".format(username)
 
+        u = identity_map.get(cache_key)
+        if u is not MISSING:
+            return u
+
         # check username cache
         in_cache = cache.get(cache_key, raw=True)
+        if cache.is_tombstone(cache_key, in_cache):
+            return None
         uid = int(in_cache) if in_cache else None
 
         # return user on success
         if uid is not None:
-            return User.by_id(uid)
+            u = User.by_id(uid)
+            identity_map.add(cache_key, u)
+            return u
 
         # try to load user from DB on failure
         u = User.where("username", username).first()
@@ -383,9 +392,17 @@ class User(Base):
         if u is not None:
             cache.set(cache_key, u.id, raw=True)
             u.write_to_cache()
+            identity_map.add(cache_key, u)
+            identity_map.add(u._cache_key, u)
+        else:
+            cache.set_tombstone(cache_key)
+            identity_map.add(cache_key, None)
 
         return u
 
+    def _tombstone_keys(self) -> [str]:
+        return super()._tombstone_keys() + ["uname:{}".format(self.username)]
+
     def is_god(self) -> bool:
         return self.is_authenticated and self.username in current_app.config["GODS"]
 
@@ -407,37 +424,35 @@ class User(Base):
     def route(self) -> str:
         return "/u/{}".format(self.username)
 
-    @property
-    def link_upvotes(self):
-        from news.models.vote import LinkVote
-
-        if "lu" not in self._relations:
-            self._relations["lu"] = LinkVote.upvotes_by_user(self)
-        return self._relations["lu"]
-
-    @property
-    def link_downvotes(self):
-        from news.models.vote import LinkVote
-
-        if "ld" not in self._relations:
-            self._relations["ld"] = LinkVote.downvotes_by_user(self)
-        return self._relations["ld"]
+    def _votes(self, vote_model, things: list) -> dict:
+        """
+        Get votes of the user on things by one round trip
+        :param vote_model: LinkVote or CommentVote
+        :param things: things
+        :return: {thing id: vote type}
+        """
+        ids = list({thing.id for thing in things})
+        found = vote_model.votes_by_user(self.id, ids) if ids else {}
+        return {thing_id: found.get(thing_id, UNVOTE) for thing_id in ids}
 
-    @property
-    def comment_upvotes(self):
-        from news.models.vote import LinkVote
+    def link_votes(self, links: list) -> dict:
+        """
+        Get votes of the user on links of a page at once
+        :param links: links
+        :return: {link id: vote type}
+        """
+        return self._votes(LinkVote, links)
 
-        if "cu" not in self._relations:
-            self._relations["cu"] = LinkVote.upvotes_by_user(self)
-        return self._relations["cu"]
+    def comment_votes(self, comments: list) -> dict:
+        """
+        Get votes of the user on comments of a page at once
+        :param comments: comments
+        :return: {comment id: vote type}
+        """
+        return self._votes(CommentVote, comments)
 
-    @property
-    def comment_downvotes(self):
-        from news.models.vote import LinkVote
 
-        if "cd" not in self._relations:
-            self._relations["cd"] = LinkVote.downvotes_by_user(self)
-        return self._relations["cd"]
+cache.register_codec(User._cache_prefix(), ModelCodec.for_model(User))
 
 
 class SignUpForm(FlaskForm):
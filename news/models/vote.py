@@ -1,17 +1,37 @@
+import time
+from typing import Optional
+
 from orator import Model, accessor, Schema
 from orator.orm import belongs_to
 
 from news.lib.cache import cache, DEFAULT_CACHE_TTL
-from news.lib.comments import update_comment
 from news.clients.db.db import db
-from news.lib.task_queue import q
-from news.lib.tasks.tasks import JOB_update_link
-from news.models.comment import Comment
+from news.clients.db.query import LinkQuery, LinkScores
+from news.models.comment import Comment, SortedComments
 
 UPVOTE = 1
 UNVOTE = 0
 DOWNVOTE = -1
 
+# member of every loaded vote set so sets of users without votes exist too,
+# it's an integer like thing ids so the sets stay compact intsets
+VOTE_SET_PLACEHOLDER = 0
+# stream of applied votes waiting to be written to DB
+VOTE_STREAM_KEY = "votes"
+# sorted set of things voted on since their ranking was updated, scored by time of the first such vote
+DIRTY_KEY = "dirty:{}"
+# prefixes of keys holding votes which aren't in DB yet, they must survive clearing of cache
+VOTE_STATE_PREFIXES = (
+    VOTE_STREAM_KEY,
+    "dirty:",
+    "lvc:",
+    "cvc:",
+    "luv:",
+    "ldv:",
+    "cuv:",
+    "cdv:",
+)
+
 
 def vote_type_from_string(str):
     str = str.upper()
@@ -27,6 +47,13 @@ class Vote(Model):
     __incrementing__ = False
     __hidden__ = ["lazy_props"]
 
+    # column with id of the thing in votes table
+    _thing_column = None
+    # kind of the vote in VOTE_STREAM_KEY
+    _kind = None
+    # condition that thing with id {id} exists and isn't archived, only such votes are kept
+    _live_thing = None
+
     @classmethod
     def create_table(cls):
         """
@@ -64,19 +91,129 @@ class Vote(Model):
         """
         raise NotImplementedError
 
-    def write_to_cache(self):
+    @classmethod
+    def _counters_key(cls, thing_id) -> str:
         """
-        Write the vote in to the cache
+        Key of cached ups and downs of the thing
+        :param thing_id: thing id
+        :return: cache key
         """
-        set_key = self._set_key(self.user_id, self.vote_type)
-        cache.sadd(set_key, self.thing.id)
+        raise NotImplementedError
 
-    def del_from_cache(self):
+    @classmethod
+    def _thing_model(cls):
         """
-        Delete the vote in to the cache
+        Return model of the things that are voted on
         """
-        set_key = self._set_key(self.user_id, self.vote_type)
-        cache.srem(set_key, self.thing.id)
+        raise NotImplementedError
+
+    def apply(self) -> Optional[int]:
+        """
+        Apply the vote in cache by single script, it's persisted to DB by news.scripts.flush_votes
+        and ranked by news.scripts.update_rankings
+        The script looks up previous vote of the user in vote sets, moves the thing between them,
+        changes ups and downs of the thing, appends the vote to VOTE_STREAM_KEY and marks the thing dirty
+        in one atomic step
+        :return: previous vote type or None if the vote didn't change anything
+        """
+        thing = self.thing
+        keys = [
+            self._set_key(self.user_id, UPVOTE),
+            self._set_key(self.user_id, DOWNVOTE),
+            self._counters_key(self._thing_id),
+            VOTE_STREAM_KEY,
+            DIRTY_KEY.format(self._kind),
+        ]
+        args = [
+            self._thing_id,
+            self.vote_type,
+            thing.ups,
+            thing.downs,
+            DEFAULT_CACHE_TTL,
+            self._kind,
+            self.user_id,
+            time.time(),
+        ]
+        result = _vote_script()(keys=keys, args=args)
+        if result is None:
+            # vote sets of the user expired
+            self._load_votes(self.user_id)
+            result = _vote_script()(keys=keys, args=args)
+            if result is None:
+                raise RuntimeError("vote sets of user {} expired".format(self.user_id))
+
+        previous = int(result[0])
+        return None if previous == self.vote_type else previous
+
+    @classmethod
+    def persist_batch(cls, votes: dict, counters: dict):
+        """
+        Write votes and ups and downs of their things to DB by one statement each
+        Both are final values rather than increments so writing the same batch again changes nothing,
+        votes and counters of things which were deleted or archived meanwhile are skipped.
+        Batches must be written in the order in which their votes were applied,
+        news.scripts.flush_votes runs as a single flusher for that
+        :param votes: {(user id, thing id): vote type}
+        :param counters: {thing id: (ups, downs)}
+        """
+        things = cls._thing_model().__table__
+        if votes:
+            db.statement(
+                "INSERT INTO {table} (user_id, {column}, vote_type) "
+                "SELECT v.user_id, v.thing_id, v.vote_type "
+                "FROM (VALUES {values}) AS v (user_id, thing_id, vote_type) "
+                "WHERE {live} "
+                "ON CONFLICT (user_id, {column}) DO UPDATE SET vote_type = EXCLUDED.vote_type".format(
+                    table=cls.__table__,
+                    column=cls._thing_column,
+                    values=", ".join(["(?, ?, ?)"] * len(votes)),
+                    live=cls._live_thing.format(id="v.thing_id"),
+                ),
+                [
+                    value
+                    for (user_id, thing_id), vote_type in votes.items()
+                    for value in (user_id, thing_id, vote_type)
+                ],
+            )
+        if counters:
+            db.statement(
+                "UPDATE {things} SET ups = v.ups, downs = v.downs "
+                "FROM (VALUES {values}) AS v (id, ups, downs) "
+                "WHERE {things}.id = v.id AND {live}".format(
+                    things=things,
+                    values=", ".join(["(?, ?, ?)"] * len(counters)),
+                    live=cls._live_thing.format(id="v.id"),
+                ),
+                [
+                    value
+                    for thing_id, (ups, downs) in counters.items()
+                    for value in (thing_id, ups, downs)
+                ],
+            )
+
+    @classmethod
+    def things_with_counters(cls, ids: list) -> list:
+        """
+        Load things with ups and downs from cached counters, which are ahead of DB until the votes are flushed
+        :param ids: thing ids
+        :return: things, things which don't exist are left out
+        """
+        things = cls._thing_model().by_ids(ids)
+        pipe = cache.pipeline(transaction=False)
+        for thing in things:
+            pipe.hmget(cls._counters_key(thing.id), "ups", "downs")
+        for thing, (ups, downs) in zip(things, pipe.execute()):
+            if ups is not None:
+                thing.ups, thing.downs = int(ups), int(downs)
+        return things
+
+    @classmethod
+    def update_ranking(cls, things: list):
+        """
+        Update listings sorted by score of the things, all at once
+        :param things: things with current counters
+        """
+        raise NotImplementedError
 
     @property
     def is_downvote(self):
@@ -95,36 +232,97 @@ class Vote(Model):
         return None
 
     @classmethod
-    def by_user_and_vote_type(cls, user_id, vote_type):
-        set_key = cls._set_key(user_id, vote_type)
-        vote_ids = cache.smembers(set_key)
-        if not vote_ids:
-            # need timestamps to add .where('created_at', '<', 'NOW() - INTERVAL \'30 days\'')
-            votes = (
-                cls.where("user_id", "=", user_id)
-                .where("vote_type", "=", vote_type)
-                .get()
-            )
-            vote_ids = [str(vote._thing_id).encode() for vote in votes]
-            if vote_ids:
-                pipe = cache.pipeline()
-                pipe.sadd(set_key, *vote_ids)
-                pipe.expire(set_key, DEFAULT_CACHE_TTL)
-                pipe.execute()
-        return set(vote_ids)
+    def _load_votes(cls, user_id) -> dict:
+        """
+        Load both vote sets of the user from DB to cache
+        Only votes on things which aren't archived are loaded, so the sets stay bounded by votes
+        of the last 30 days no matter how long the user votes
+        :param user_id: user id
+        :return: {vote type: ids of voted things}
+        """
+        votes = (
+            cls.select(cls._thing_column, "vote_type")
+            .where("user_id", "=", user_id)
+            .where("vote_type", "!=", UNVOTE)
+            .where_raw(cls._live_thing.format(id=cls._thing_column))
+            .get()
+        )
+        vote_ids = {UPVOTE: set(), DOWNVOTE: set()}
+        for vote in votes:
+            vote_ids[vote.vote_type].add(str(vote._thing_id).encode())
+
+        pipe = cache.pipeline()
+        for vote_type, ids in vote_ids.items():
+            set_key = cls._set_key(user_id, vote_type)
+            pipe.sadd(set_key, VOTE_SET_PLACEHOLDER, *ids)
+            pipe.expire(set_key, DEFAULT_CACHE_TTL)
+        pipe.execute()
+        return vote_ids
 
     @classmethod
-    def upvotes_by_user(cls, user):
-        return cls.by_user_and_vote_type(user.id, UPVOTE)
+    def archive_things(cls, thing_ids: list):
+        """
+        Delete votes on archived things from DB and from vote sets of their voters,
+        cached ups and downs of the things are dropped too, their final values are kept in DB
+        :param thing_ids: ids of archived things
+        """
+        if not thing_ids:
+            return
+        votes = (
+            cls.select("user_id", cls._thing_column)
+            .where_in(cls._thing_column, thing_ids)
+            .where("vote_type", "!=", UNVOTE)
+            .get()
+        )
+        pipe = cache.pipeline(transaction=False)
+        for vote in votes:
+            pipe.srem(cls._set_key(vote.user_id, UPVOTE), vote._thing_id)
+            pipe.srem(cls._set_key(vote.user_id, DOWNVOTE), vote._thing_id)
+        pipe.delete(*[cls._counters_key(thing_id) for thing_id in thing_ids])
+        pipe.execute()
+        cls.where_in(cls._thing_column, thing_ids).delete()
 
     @classmethod
-    def downvotes_by_user(cls, user):
-        return cls.by_user_and_vote_type(user.id, DOWNVOTE)
+    def votes_by_user(cls, user_id, thing_ids: list) -> dict:
+        """
+        Get votes of the user on given things by one round trip
+        Only the things are looked up so the cost doesn't grow with the number of user's votes
+        :param user_id: user id
+        :param thing_ids: thing ids
+        :return: {thing id: vote type} of things the user voted on
+        """
+        up_key = cls._set_key(user_id, UPVOTE)
+        down_key = cls._set_key(user_id, DOWNVOTE)
+        pipe = cache.pipeline(transaction=False)
+        pipe.exists(up_key)
+        for thing_id in thing_ids:
+            pipe.sismember(up_key, thing_id)
+            pipe.sismember(down_key, thing_id)
+        loaded, *members = pipe.execute()
+
+        if not loaded:
+            vote_ids = cls._load_votes(user_id)
+            members = [
+                str(thing_id).encode() in vote_ids[vote_type]
+                for thing_id in thing_ids
+                for vote_type in (UPVOTE, DOWNVOTE)
+            ]
+        votes = {}
+        for idx, thing_id in enumerate(thing_ids):
+            upvoted, downvoted = members[2 * idx : 2 * idx + 2]
+            if upvoted or downvoted:
+                votes[thing_id] = UPVOTE if upvoted else DOWNVOTE
+        return votes
 
 
 class LinkVote(Vote):
     __table__ = "link_votes"
     __fillable__ = ["user_id", "link_id", "vote_type"]
+    _thing_column = "link_id"
+    _kind = "link"
+    _live_thing = (
+        "EXISTS (SELECT 1 FROM links WHERE links.id = {id} AND NOT links.archived)"
+    )
 
     @property
     def _thing_id(self):
@@ -186,38 +384,32 @@ class LinkVote(Vote):
         self.apply()
         # change users params (more karma/trust factor or something)
 
-    def apply(self):
-        previous_vote = (
-            LinkVote.where("user_id", self.user_id)
-            .where("link_id", self.link_id)
-            .first()
-        )
-
-        if previous_vote and previous_vote.vote_type == self.vote_type:
-            return
-
-        if previous_vote and previous_vote.affected_attribute:
-            previous_vote.del_from_cache()
-            self.link.decr(previous_vote.affected_attribute, 1)
+    @classmethod
+    def _counters_key(cls, thing_id):
+        return "lvc:{}".format(thing_id)
 
-        if self.affected_attribute:
-            self.link.incr(self.affected_attribute, 1)
-            self.write_to_cache()
+    @classmethod
+    def _thing_model(cls):
+        from news.models.link import Link
 
-        if previous_vote is None:
-            self.save()
-        else:
-            LinkVote.where("user_id", self.user_id).where(
-                "link_id", self.link_id
-            ).update({"vote_type": self.vote_type})
+        return Link
 
-        if self.link.num_votes < 20 or self.link.num_votes % 8 == 0:
-            q.enqueue(JOB_update_link, self.link, result_ttl=0)
+    @classmethod
+    def update_ranking(cls, things):
+        LinkScores.store(things)
+        # no need to update 'new' because it doesn't depend on score
+        LinkQuery.bulk_insert(things, sorts=("trending", "best"))
 
 
 class CommentVote(Vote):
     __table__ = "comment_votes"
     __fillable__ = ["user_id", "comment_id", "vote_type"]
+    _thing_column = "comment_id"
+    _kind = "comment"
+    _live_thing = (
+        "EXISTS (SELECT 1 FROM comments JOIN links ON links.id = comments.link_id "
+        "WHERE comments.id = {id} AND NOT links.archived)"
+    )
 
     @property
     def _thing_id(self):
@@ -227,18 +419,6 @@ class CommentVote(Vote):
     def thing(self) -> "Comment":
         return self.comment
 
-    @property
-    def comment(self) -> "Comment":
-        """
-        Return the link that was voted on
-        :return: link
-        """
-        from news.models.comment import Comment
-
-        if "comment" not in self._relations:
-            self._relations["comment"] = Comment.by_id(self.link_id)
-        return self._relations["comment"]
-
     def __repr__(self):
         return "<CommentVote {}:{} {}>".format(
             self.user_id, self.comment_id, self.vote_type
@@ -264,11 +444,6 @@ class CommentVote(Vote):
 
         return User.by_id(self.user_id)
 
-    @classmethod
-    def set_keys(cls, comment_id):
-        cache_key = cls._set_key(comment_id)
-        return cache_key + "+", cache_key + "-"
-
     @accessor
     def comment(self):
         return Comment.by_id(self.comment_id)
@@ -285,36 +460,76 @@ class CommentVote(Vote):
         self.apply()
         # change users params (more karma/trust factor or something)
 
-    def apply(self):
-        # find previous vote
-        previous_vote = (
-            CommentVote.where("user_id", self.user_id)
-            .where("comment_id", self.comment_id)
-            .first()
-        )
+    @classmethod
+    def _counters_key(cls, thing_id):
+        return "cvc:{}".format(thing_id)
 
-        # nothing to change, shouldn't happen
-        if previous_vote and previous_vote.vote_type == self.vote_type:
-            return
+    @classmethod
+    def _thing_model(cls):
+        return Comment
 
-        # undo previous vote
-        if previous_vote and previous_vote.affected_attribute:
-            previous_vote.del_from_cache()
-            self.comment.decr(previous_vote.affected_attribute, 1)
-
-        # apply new vote
-        if self.affected_attribute:
-            self.write_to_cache()
-            self.comment.incr(self.affected_attribute, 1)
-
-        # safe new vote
-        if previous_vote is None:
-            self.save()
-        else:
-            CommentVote.where("user_id", self.user_id).where(
-                "comment_id", self.comment_id
-            ).update({"vote_type": self.vote_type})
-
-        # update comment if needed
-        if self.comment.num_votes < 20 or self.comment.num_votes % 8 == 0:
-            q.enqueue(update_comment, self.comment, result_ttl=0)
+    @classmethod
+    def update_ranking(cls, things):
+        by_link = {}
+        for comment in things:
+            by_link.setdefault(comment.link_id, []).append(comment)
+        for link_id, comments in by_link.items():
+            SortedComments(link_id).update(comments)
+
+
+# vote transition, KEYS[1] upvote set, KEYS[2] downvote set, KEYS[3] hash of ups and downs of the thing,
+# KEYS[4] stream of votes to persist, KEYS[5] sorted set of dirty things
+# ARGV: thing id, vote type, ups and downs used when the hash is missing, ttl, kind of the vote, user id,
+# current time
+# returns false when the vote sets aren't loaded, otherwise {previous vote type, ups, downs}
+VOTE = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('EXISTS', KEYS[2]) == 0 then
+    return false
+end
+local previous = 0
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    previous = 1
+elseif redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    previous = -1
+end
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    redis.call('HMSET', KEYS[3], 'ups', ARGV[3], 'downs', ARGV[4])
+end
+local vote = tonumber(ARGV[2])
+if vote ~= previous then
+    if previous == 1 then
+        redis.call('SREM', KEYS[1], ARGV[1])
+        redis.call('HINCRBY', KEYS[3], 'ups', -1)
+    elseif previous == -1 then
+        redis.call('SREM', KEYS[2], ARGV[1])
+        redis.call('HINCRBY', KEYS[3], 'downs', -1)
+    end
+    if vote == 1 then
+        redis.call('SADD', KEYS[1], ARGV[1])
+        redis.call('HINCRBY', KEYS[3], 'ups', 1)
+    elseif vote == -1 then
+        redis.call('SADD', KEYS[2], ARGV[1])
+        redis.call('HINCRBY', KEYS[3], 'downs', 1)
+    end
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[5])
+end
+local counters = redis.call('HMGET', KEYS[3], 'ups', 'downs')
+if vote ~= previous then
+    redis.call(
+        'XADD', KEYS[4], '*', 'kind', ARGV[6], 'user', ARGV[7], 'thing', ARGV[1],
+        'vote', vote, 'ups', counters[1], 'downs', counters[2]
+    )
+    redis.call('ZADD', KEYS[5], 'NX', ARGV[8], ARGV[1])
+end
+return {previous, tonumber(counters[1]), tonumber(counters[2])}
+"""
+
+_scripts = {}
+
+
+def _vote_script():
+    if "vote" not in _scripts:
+        _scripts["vote"] = cache.register_script(VOTE)
+    return _scripts["vote"]
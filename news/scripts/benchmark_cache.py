@@ -0,0 +1,227 @@
+"""
+Benchmark of cache serialization
+
+Compares bytes stored and encode/decode time of pickle and compact codecs on payloads
+shaped like the ones stored by Link, User, Feed and LinkQuery and bytes saved and CPU
+spent by compression of large values (LinkQuery, comment trees, sorted comments, feed listings)
+
+usage: python -m news.scripts.benchmark_cache
+"""
+import random
+import timeit
+import zlib
+from datetime import datetime, timedelta
+
+from news.lib.cache_codecs import (
+    PICKLE,
+    ModelCodec,
+    TuplesCodec,
+    ZLIB_LEVEL,
+    lz4_block,
+)
+from news.lib.utils.time_utils import epoch_seconds
+
+ROUNDS = 2000
+
+
+def _created_at():
+    return (
+        datetime.utcnow() - timedelta(seconds=random.randint(0, 86400 * 30))
+    ).isoformat()
+
+
+def link_payload():
+    return {
+        "id": random.randint(1, 10 ** 6),
+        "title": "Scientists discover a new species of deep sea octopus",
+        "slug": "scientists-discover-a-new-species-of-deep-sea-octopus",
+        "text": "Researchers exploring the ocean floor found " * 5,
+        "user_id": random.randint(1, 10 ** 5),
+        "url": "https://www.example.com/science/2020/03/deep-sea-octopus",
+        "feed_id": random.randint(1, 100),
+        "image": None,
+        "reported": 0,
+        "spam": False,
+        "archived": False,
+        "ups": random.randint(0, 500),
+        "downs": random.randint(0, 50),
+        "comments_count": random.randint(0, 200),
+        "created_at": _created_at(),
+        "updated_at": _created_at(),
+    }
+
+
+def user_payload():
+    return {
+        "id": random.randint(1, 10 ** 5),
+        "username": "matoous",
+        "full_name": "Matous Dzivjak",
+        "email": "matoous@example.com",
+        "email_verified": True,
+        "subscribed": False,
+        "preferred_sort": "trending",
+        "bio": "I like reading news",
+        "url": "https://example.com",
+        "email_public": False,
+        "feed_subs": 12,
+        "reported": 0,
+        "spammer": False,
+        "p_infinite_scrolling": False,
+        "p_show_summaries": True,
+        "p_min_link_score": -3,
+        "created_at": _created_at(),
+        "updated_at": _created_at(),
+    }
+
+
+def feed_payload():
+    return {
+        "id": random.randint(1, 100),
+        "name": "Good long reads",
+        "img": None,
+        "slug": "good-long-reads",
+        "description": "Good long articles for you to waste time and learn something new.",
+        "default_sort": "trending",
+        "rules": "Be nice to each other",
+        "lang": "en",
+        "over_18": False,
+        "logo": "feeds/good-long-reads.png",
+        "reported": False,
+        "subscribers_count": 1234,
+        "created_at": _created_at(),
+        "updated_at": _created_at(),
+    }
+
+
+def trending_payload():
+    return [
+        [random.randint(1, 10 ** 6), round(random.uniform(3000, 4000), 7)]
+        for _ in range(1000)
+    ]
+
+
+def best_payload():
+    now = epoch_seconds(datetime.utcnow())
+    return [
+        [
+            random.randint(1, 10 ** 6),
+            random.randint(-10, 1000),
+            now - random.randint(0, 86400 * 365),
+        ]
+        for _ in range(1000)
+    ]
+
+
+def comment_tree_payload():
+    tree = {None: []}
+    for comment_id in range(1, 500):
+        parent = random.choice(list(tree))
+        tree[parent].append(comment_id)
+        tree.setdefault(comment_id, [])
+    return {parent: children for parent, children in tree.items() if children}
+
+
+def sorted_comments_payload():
+    return [[random.randint(1, 10 ** 6), random.random()] for _ in range(200)]
+
+
+def feed_listing_payload():
+    return [link_payload() for _ in range(1000)]
+
+
+def bench(name, payload, codec):
+    """
+    Measure size and speed of pickle and given codec on payload
+    """
+    pickled = PICKLE.encode(payload)
+    packed = codec.encode(payload)
+    assert codec.decode(packed) == payload
+
+    rows = []
+    for codec_name, c, data in [
+        ("pickle", PICKLE, pickled),
+        ("compact", codec, packed),
+    ]:
+        encode = timeit.timeit(lambda: c.encode(payload), number=ROUNDS) / ROUNDS
+        decode = timeit.timeit(lambda: c.decode(data), number=ROUNDS) / ROUNDS
+        rows.append((codec_name, len(data), encode * 1e6, decode * 1e6))
+
+    for codec_name, size, encode, decode in rows:
+        print(
+            "{:<16} {:<8} {:>8} B {:>10.1f} us {:>10.1f} us".format(
+                name, codec_name, size, encode, decode
+            )
+        )
+
+
+def bench_compression(name, data):
+    """
+    Measure compression ratio and speed of zlib and lz4 (if installed) on encoded value
+    """
+    compressors = [
+        (
+            "zlib",
+            lambda: zlib.compress(data, ZLIB_LEVEL),
+            lambda packed: zlib.decompress(packed),
+        )
+    ]
+    if lz4_block is not None:
+        compressors.append(
+            (
+                "lz4",
+                lambda: lz4_block.compress(data),
+                lambda packed: lz4_block.decompress(packed),
+            )
+        )
+
+    rounds = max(ROUNDS * 1000 // len(data), 10)
+    for compressor, comp, decomp in compressors:
+        packed = comp()
+        encode = timeit.timeit(comp, number=rounds) / rounds
+        decode = timeit.timeit(lambda: decomp(packed), number=rounds) / rounds
+        print(
+            "{:<16} {:<8} {:>8} B {:>8} B {:>7.1%} {:>10.1f} us {:>10.1f} us".format(
+                name,
+                compressor,
+                len(data),
+                len(packed),
+                1 - len(packed) / len(data),
+                encode * 1e6,
+                decode * 1e6,
+            )
+        )
+
+
+def run():
+    from news.models.feed import Feed
+    from news.models.link import Link
+    from news.models.user import User
+
+    print(
+        "{:<16} {:<8} {:>10} {:>13} {:>13}".format(
+            "payload", "codec", "bytes", "encode", "decode"
+        )
+    )
+    bench("Link", link_payload(), ModelCodec.for_model(Link))
+    bench("User", user_payload(), ModelCodec.for_model(User))
+    bench("Feed", feed_payload(), ModelCodec.for_model(Feed))
+    bench("LinkQuery trend", trending_payload(), TuplesCodec())
+    bench("LinkQuery best", best_payload(), TuplesCodec())
+
+    print()
+    print(
+        "{:<16} {:<8} {:>10} {:>10} {:>8} {:>13} {:>13}".format(
+            "payload", "method", "bytes", "stored", "saved", "compress", "decompress"
+        )
+    )
+    tuples = TuplesCodec()
+    bench_compression("cquery: trend", tuples.encode(trending_payload()))
+    bench_compression("cquery: best", tuples.encode(best_payload()))
+    bench_compression("cquery: pickle", PICKLE.encode(trending_payload()))
+    bench_compression("ct:", PICKLE.encode(comment_tree_payload()))
+    bench_compression("scm:", tuples.encode(sorted_comments_payload()))
+    bench_compression("fs:", PICKLE.encode(feed_listing_payload()))
+
+
+if __name__ == "__main__":
+    run()
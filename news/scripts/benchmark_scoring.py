@@ -0,0 +1,87 @@
+"""
+Benchmark of batch scoring
+
+Compares throughput of scalar hot/confidence and their NumPy batch versions
+on randomly generated links and checks that both return the same scores
+
+usage: python -m news.scripts.benchmark_scoring [--links N]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from news.lib import batch_sorts
+from news.lib.sorts import hot
+from news.lib.utils.confidence import confidence
+
+LINKS = 10 ** 6
+# scalar functions are slow, they are measured on a sample and extrapolated
+SCALAR_SAMPLE = 100000
+
+
+def links_payload(count: int):
+    """
+    Random ups, downs and creation dates, most links have few votes
+    """
+    ups = np.random.zipf(1.6, count).clip(max=10 ** 5) - 1
+    downs = np.random.zipf(2.0, count).clip(max=10 ** 4) - 1
+    now = datetime.utcnow()
+    created_at = [
+        now - timedelta(seconds=random.randint(0, 86400 * 30)) for _ in range(count)
+    ]
+    return ups.tolist(), downs.tolist(), created_at
+
+
+def measure(fnc) -> (object, float):
+    start = time.perf_counter()
+    result = fnc()
+    return result, time.perf_counter() - start
+
+
+def report(name: str, count: int, seconds: float):
+    print(
+        "{:<20} {:>10} {:>10.3f}s {:>14,.0f} links/s".format(
+            name, count, seconds, count / seconds
+        )
+    )
+
+
+def run(count: int = LINKS):
+    ups, downs, created_at = links_payload(count)
+    sample = min(count, SCALAR_SAMPLE)
+
+    print(
+        "{:<20} {:>10} {:>11} {:>21}".format("function", "links", "time", "throughput")
+    )
+    scalar_hot, seconds = measure(
+        lambda: [hot(u - d, c) for u, d, c in zip(ups[:sample], downs, created_at)]
+    )
+    report("hot", sample, seconds)
+    dates = np.array(created_at, dtype="datetime64[us]")
+    batch_hot, seconds = measure(lambda: batch_sorts.hot(ups, downs, dates))
+    report("batch hot", count, seconds)
+
+    scalar_confidence, seconds = measure(
+        lambda: [confidence(u, d) for u, d in zip(ups[:sample], downs)]
+    )
+    report("confidence", sample, seconds)
+    batch_confidence, seconds = measure(lambda: batch_sorts.confidence(ups, downs))
+    report("batch confidence", count, seconds)
+
+    print()
+    print(
+        "identical hot: {}, identical confidence: {}".format(
+            batch_hot[:sample].tolist() == scalar_hot,
+            batch_confidence[:sample].tolist() == scalar_confidence,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batch scoring")
+    parser.add_argument("--links", type=int, default=LINKS)
+    args = parser.parse_args()
+    run(args.links)
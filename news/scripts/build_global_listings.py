@@ -0,0 +1,20 @@
+"""
+Builder of precomputed anonymous listings
+
+Runs forever and rebuilds trending, new and best listings of default feeds
+every GLOBAL_LISTINGS_INTERVAL seconds or sooner when their links change
+
+usage: python -m news.scripts.build_global_listings [--once]
+"""
+import argparse
+
+from news.lib.global_listings import global_listings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build anonymous listings")
+    parser.add_argument("--once", action="store_true", help="build listings once")
+    args = parser.parse_args()
+    if args.once:
+        print("Built generation {}".format(global_listings.build()))
+    else:
+        global_listings.run()
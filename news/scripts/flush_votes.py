@@ -0,0 +1,146 @@
+"""
+Vote flusher
+
+Votes are applied in cache and appended to a Redis stream (news.models.vote.VOTE_STREAM_KEY),
+flusher reads them by consumer group and writes them to the database in batches:
+one multi-row upsert of votes and one UPDATE of ups and downs per kind of voted things.
+Entries are acknowledged and deleted only after the batch is committed so every vote is written
+at least once, batches store final vote types and counters so writing an entry twice is harmless.
+Batches store absolute values, so they must be applied strictly in stream order: only one flusher runs
+at a time, it holds FLUSHER_LOCK and reads as the single consumer FLUSHER. A flusher started after one
+died waits for its lock to expire and first writes entries the dead one read but didn't acknowledge,
+which are older than any new entry
+
+usage: python -m news.scripts.flush_votes [--once] [--batch SIZE] [--interval SECONDS]
+"""
+import argparse
+import time
+
+from redis import ResponseError
+from redis_lock import Lock
+
+from news.lib.cache import cache
+from news.lib.metrics import VOTE_FLUSH_BATCH_SIZE, VOTE_FLUSH_LAG
+
+GROUP = "flushers"
+# the only consumer of the group
+FLUSHER = "flusher"
+# lock held by the running flusher
+FLUSHER_LOCK = "flush_votes"
+# seconds after which lock of a dead flusher expires, it's renewed while the flusher runs
+FLUSHER_LOCK_TTL = 60
+BATCH_SIZE = 500
+# how long to wait for new votes
+INTERVAL = 1
+
+
+def create_group():
+    """
+    Create consumer group of flushers, existing group is kept
+    """
+    from news.models.vote import VOTE_STREAM_KEY
+
+    try:
+        cache.xgroup_create(VOTE_STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def read_batch(count: int, block: int = None) -> list:
+    """
+    Read entries which weren't acknowledged yet and if there are none read new entries
+    :param count: maximal number of entries
+    :param block: milliseconds to wait for new entries
+    :return: [(entry id, fields)]
+    """
+    from news.models.vote import VOTE_STREAM_KEY
+
+    try:
+        streams = cache.xreadgroup(GROUP, FLUSHER, {VOTE_STREAM_KEY: "0"}, count=count)
+    except ResponseError as e:
+        if "NOGROUP" not in str(e):
+            raise
+        # stream was deleted, e.g. by flushing the whole cache
+        create_group()
+        streams = None
+    if not streams or not streams[0][1]:
+        streams = cache.xreadgroup(
+            GROUP, FLUSHER, {VOTE_STREAM_KEY: ">"}, count=count, block=block
+        )
+    return streams[0][1] if streams else []
+
+
+def flush_votes(count: int = BATCH_SIZE, block: int = None) -> int:
+    """
+    Write one batch of votes from the stream to the database
+    Must be called only by the flusher holding FLUSHER_LOCK
+    :param count: maximal number of votes in the batch
+    :param block: milliseconds to wait for new votes
+    :return: number of flushed entries
+    """
+    from news.clients.db.db import db
+    from news.models.vote import VOTE_STREAM_KEY, CommentVote, LinkVote
+
+    vote_models = {model._kind: model for model in [LinkVote, CommentVote]}
+    entries = read_batch(count, block)
+    if not entries:
+        return 0
+
+    # {kind: ({(user id, thing id): vote type}, {thing id: (ups, downs)})}
+    batches = {}
+    now = time.time()
+    for entry_id, fields in entries:
+        # entries deleted from the stream while pending come without fields
+        if not fields:
+            continue
+        VOTE_FLUSH_LAG.observe(now - int(entry_id.split(b"-")[0]) / 1000)
+        votes, counters = batches.setdefault(fields[b"kind"].decode(), ({}, {}))
+        thing_id = int(fields[b"thing"])
+        # entries are in the order in which votes were applied, later ones win
+        votes[(int(fields[b"user"]), thing_id)] = int(fields[b"vote"])
+        counters[thing_id] = (int(fields[b"ups"]), int(fields[b"downs"]))
+
+    with db.transaction():
+        for kind, (votes, counters) in batches.items():
+            vote_models[kind].persist_batch(votes, counters)
+
+    ids = [entry_id for entry_id, _ in entries]
+    pipe = cache.pipeline(transaction=False)
+    pipe.xack(VOTE_STREAM_KEY, GROUP, *ids)
+    pipe.xdel(VOTE_STREAM_KEY, *ids)
+    pipe.execute()
+    VOTE_FLUSH_BATCH_SIZE.observe(len(entries))
+
+    # cached things are rebuilt from DB with the flushed counters
+    keys = [
+        vote_models[kind]._thing_model()._cache_key_from_id(thing_id)
+        for kind, (_, counters) in batches.items()
+        for thing_id in counters
+    ]
+    if keys:
+        cache.delete(*keys)
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write votes to database")
+    parser.add_argument("--once", action="store_true", help="flush one batch")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--interval", type=float, default=INTERVAL, help="seconds to wait for votes"
+    )
+    args = parser.parse_args()
+    create_group()
+    with Lock(cache.conn, FLUSHER_LOCK, expire=FLUSHER_LOCK_TTL, auto_renewal=True):
+        while True:
+            started = time.monotonic()
+            flushed = flush_votes(args.batch, int(args.interval * 1000))
+            if flushed:
+                print(
+                    "Flushed {} votes in {:.2f}s".format(
+                        flushed, time.monotonic() - started
+                    )
+                )
+            if args.once:
+                break
@@ -22,7 +22,8 @@ def import_fqs():
             print("Finished")
             break
 
-        # Check FQS
+        # Check FQS, links of the whole batch are added to queries at once
+        links = []
         for source in sources:
             print("Source {}".format(source.url))
             try:
@@ -42,6 +43,8 @@ def import_fqs():
                     feed_id=source.feed_id,
                     user_id=AUTOPOSTER_ID,
                 )
-                link.commit()
+                link.save()
+                links.append(link)
             source.next_update = now + timedelta(seconds=source.update_interval)
             source.save()
+        Link.add_to_queries(links)
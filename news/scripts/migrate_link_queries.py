@@ -0,0 +1,86 @@
+"""
+Link query migration
+
+Converts link queries stored as pickled lists ('cquery:' keys) to sorted sets ('zq:' keys)
+so LINK_QUERY_BACKEND can be switched to 'zset' without rebuilding every query from the database.
+Queries which already exist as sorted sets are left as they are
+
+usage: python -m news.scripts.migrate_link_queries [--delete] [--batch-size N]
+"""
+import argparse
+
+from news.lib.cache import cache
+
+BATCH_SIZE = 500
+SORTS = {"trending", "new", "best"}
+
+
+def _parse_key(key: str) -> (int, str, str):
+    """
+    Parse feed id, sort and time from 'cquery:{feed_id}.{sort}.{time}' key
+    :return: feed id, sort and time or None if key isn't valid query key
+    """
+    from news.clients.db.query import TIME_WINDOWS
+
+    feed_id, _, rest = key[len("cquery:") :].partition(".")
+    sort, _, time = rest.partition(".")
+    if not feed_id.isdigit() or sort not in SORTS:
+        return None
+    if time != "all" and (time not in TIME_WINDOWS or sort == "trending"):
+        return None
+    return int(feed_id), sort, time
+
+
+def migrate_link_queries(delete: bool = False, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Migrate all pickled link queries to sorted sets
+    :param delete: delete pickled queries after they are migrated
+    :param batch_size: how many keys are scanned and written at once
+    :return: summary of migrated, skipped and invalid queries
+    """
+    from news.clients.db.query import ZSetLinkQuery
+
+    summary = {"migrated": 0, "skipped": 0, "invalid": 0}
+    for raw_key in cache.scan_iter(match="cquery:*", count=batch_size):
+        key = raw_key.decode()
+        parsed = _parse_key(key)
+        data = cache.get(key) if parsed else None
+        if parsed is None or not isinstance(data, list):
+            # keys of queries with lambda time filters were never read twice
+            print("Invalid query {}".format(key))
+            summary["invalid"] += 1
+            if delete:
+                cache.delete(key)
+            continue
+
+        query = ZSetLinkQuery(*parsed)
+        pipe = cache.pipeline(transaction=True)
+        pipe.watch(query._cache_key)
+        if pipe.exists(query._cache_key):
+            pipe.reset()
+            summary["skipped"] += 1
+        else:
+            pipe.multi()
+            query._store(data, pipe=pipe)
+            pipe.execute()
+            summary["migrated"] += 1
+
+        if delete:
+            cache.delete(key)
+
+        done = sum(summary.values())
+        if done % batch_size == 0:
+            print("Processed {} queries".format(done))
+
+    print("Migration finished: {}".format(summary))
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate pickled link queries to sorted sets"
+    )
+    parser.add_argument("--delete", action="store_true", help="delete migrated queries")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    migrate_link_queries(delete=args.delete, batch_size=args.batch_size)
@@ -0,0 +1,79 @@
+"""
+Trending rescoring
+
+Recomputes hot scores of all live links of every feed in batch and rewrites trending queries,
+so scores missed by incremental updates get fixed and trending always uses the same formula
+
+usage: python -m news.scripts.rescore_trending [--once] [--interval SECONDS]
+"""
+import argparse
+import time
+
+import numpy as np
+
+INTERVAL = 10 * 60
+
+
+def rescore_feed(feed_id) -> int:
+    """
+    Rescore live links of the feed and rewrite its trending query
+    Archived links can't be voted on so their stored scores are kept
+    :param feed_id: feed id
+    :return: number of rescored links
+    """
+    from news.clients.db.db import db
+    from news.clients.db.query import LinkQuery
+    from news.lib import batch_sorts
+    from news.lib.sorts import sort_tuples
+
+    rows = (
+        db.table("links")
+        .select("id", "ups", "downs", "created_at")
+        .where("feed_id", feed_id)
+        .where("archived", False)
+        .get()
+    )
+    query = LinkQuery(feed_id=feed_id, sort="trending")
+    depth = query.depth
+    live_ids = {row["id"] for row in rows}
+    archived = [row for row in query.fetch() if row[0] not in live_ids]
+    if not rows:
+        query.replace(archived)
+        return 0
+
+    scores = batch_sorts.hot(
+        [row["ups"] for row in rows],
+        [row["downs"] for row in rows],
+        [row["created_at"] for row in rows],
+    )
+    # only links which can make it to the query are sorted
+    top = np.argsort(-scores, kind="stable")[:depth]
+    rescored = [[rows[idx]["id"], float(scores[idx])] for idx in top]
+    query.replace(sort_tuples(rescored + archived)[:depth])
+    return len(rows)
+
+
+def rescore_trending() -> int:
+    """
+    Rescore trending queries of all feeds
+    :return: number of rescored links
+    """
+    from news.models.feed import Feed
+
+    return sum(rescore_feed(feed_id) for feed_id in Feed.lists("id"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore trending link queries")
+    parser.add_argument("--once", action="store_true", help="rescore queries once")
+    parser.add_argument("--interval", type=int, default=INTERVAL)
+    args = parser.parse_args()
+    while True:
+        started = time.monotonic()
+        rescored = rescore_trending()
+        print(
+            "Rescored {} links in {:.2f}s".format(rescored, time.monotonic() - started)
+        )
+        if args.once:
+            break
+        time.sleep(args.interval)
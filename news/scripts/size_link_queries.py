@@ -0,0 +1,203 @@
+"""
+Link query sizing
+
+Sizes every link query by how deep it was read and how many links its feed got in the last day,
+depths are scaled down when all queries wouldn't fit into LINK_QUERY_MEMORY_BUDGET.
+Queries read beyond their depth are rebuilt deeper right away, sizing keeps them deep
+while they're read that deep and shrinks them again when they aren't
+
+usage: python -m news.scripts.size_link_queries [--once] [--report] [--interval SECONDS]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from news.lib.cache import cache
+
+INTERVAL = 60 * 60
+# queries are sized this much deeper than they were read
+READ_HEADROOM = 1.5
+# queries keep at least all links posted within this period
+POST_RATE_PERIOD = timedelta(days=1)
+# size of single link in a query when there's no stored query to measure
+BYTES_PER_LINK = 64
+# reads of the previous period, queries shrink only after two periods without deep reads
+READS_PREV_KEY = "qreads:prev"
+
+
+def _int_hash(key: str) -> dict:
+    return {field.decode(): int(value) for field, value in cache.hgetall(key).items()}
+
+
+def query_memory(feed_ids: list) -> dict:
+    """
+    Measure memory used by link queries of feeds
+    :param feed_ids: feed ids
+    :return: {feed id: {"bytes": used memory, "links": stored links, "queries": {depth field: (bytes, links)}}}
+    """
+    from news.clients.db.query import feed_queries, link_query_backend
+
+    queries = [query for feed_id in feed_ids for query in feed_queries(feed_id)]
+    zset = link_query_backend.name == "zset"
+    pipe = cache.pipeline(transaction=False)
+    for query in queries:
+        pipe.memory_usage(query._cache_key)
+        if zset:
+            pipe.zcard(query._cache_key)
+    results = pipe.execute()
+
+    usage = {}
+    for idx, query in enumerate(queries):
+        if zset:
+            used, size = results[2 * idx : 2 * idx + 2]
+            # without the placeholder
+            links = max(size - 1, 0)
+        else:
+            used = results[idx]
+            links = len(cache.get(query._cache_key) or []) if used else 0
+
+        feed = usage.setdefault(query.feed_id, {"bytes": 0, "links": 0, "queries": {}})
+        feed["bytes"] += used or 0
+        feed["links"] += links
+        feed["queries"][query._depth_field] = (used or 0, links)
+    return usage
+
+
+def post_counts(since: datetime) -> dict:
+    """
+    Count links posted to every feed
+    :param since: count links posted since
+    :return: {feed id: number of links}
+    """
+    from news.clients.db.db import db
+
+    rows = (
+        db.table("links")
+        .select("feed_id", db.raw("COUNT(*) AS posts"))
+        .where("created_at", ">=", since)
+        .group_by("feed_id")
+        .get()
+    )
+    return {row["feed_id"]: row["posts"] for row in rows}
+
+
+def size_link_queries(budget: int = None) -> dict:
+    """
+    Size all link queries
+    :param budget: memory budget, LINK_QUERY_MEMORY_BUDGET by default
+    :return: summary of the sizing
+    """
+    from news.clients.db.query import (
+        DEPTHS_KEY,
+        MAX_QUERY_DEPTH,
+        MIN_QUERY_DEPTH,
+        READS_KEY,
+        feed_queries,
+        link_query_backend,
+        parse_depth,
+    )
+    from news.models.feed import Feed
+
+    budget = link_query_backend.memory_budget if budget is None else budget
+    feed_ids = Feed.lists("id")
+    usage = query_memory(feed_ids)
+    used = sum(feed["bytes"] for feed in usage.values())
+    links = sum(feed["links"] for feed in usage.values())
+    bytes_per_link = used / links if links else BYTES_PER_LINK
+
+    reads, prev_reads = _int_hash(READS_KEY), _int_hash(READS_PREV_KEY)
+    posts = post_counts(datetime.utcnow() - POST_RATE_PERIOD)
+    queries, wanted = {}, {}
+    for feed_id in feed_ids:
+        for query in feed_queries(feed_id):
+            field = query._depth_field
+            read = max(reads.get(field, 0), prev_reads.get(field, 0))
+            depth = max(
+                int(read * READ_HEADROOM), posts.get(feed_id, 0), MIN_QUERY_DEPTH
+            )
+            queries[field] = query
+            wanted[field] = min(depth, MAX_QUERY_DEPTH)
+
+    needed = sum(wanted.values()) * bytes_per_link
+    scale = min(1.0, budget / needed) if needed else 1.0
+    depths = {
+        field: max(int(depth * scale), MIN_QUERY_DEPTH)
+        for field, depth in wanted.items()
+    }
+
+    old_depths = {
+        field.decode(): parse_depth(value)
+        for field, value in cache.hgetall(DEPTHS_KEY).items()
+    }
+    pipe = cache.pipeline(transaction=True)
+    pipe.delete(DEPTHS_KEY)
+    if depths:
+        pipe.hmset(DEPTHS_KEY, depths)
+    pipe.delete(READS_PREV_KEY)
+    if reads:
+        pipe.rename(READS_KEY, READS_PREV_KEY)
+    for field, depth in depths.items():
+        # query truncated at lower depth would look complete, it's rebuilt on next read
+        if depth > old_depths.get(field, parse_depth(None)):
+            pipe.delete(queries[field]._cache_key)
+    pipe.execute()
+
+    return {
+        "queries": len(depths),
+        "used": used,
+        "budget": budget,
+        "scale": round(scale, 3),
+        "links": sum(depths.values()),
+    }
+
+
+def print_report(limit: int = None):
+    """
+    Print memory used by link queries of every feed, the largest first
+    :param limit: number of feeds to print
+    """
+    from news.clients.db.query import DEPTHS_KEY, PRECOMPUTE_LIMIT, link_query_backend
+    from news.models.feed import Feed
+
+    usage = query_memory(Feed.lists("id"))
+    depths = _int_hash(DEPTHS_KEY)
+    total = sum(feed["bytes"] for feed in usage.values())
+    budget = link_query_backend.memory_budget
+    print("{:>10} {:>12} {:>8} {:>8}".format("feed", "bytes", "links", "depth"))
+    feeds = sorted(usage.items(), key=lambda item: item[1]["bytes"], reverse=True)
+    for feed_id, feed in feeds[:limit]:
+        depth = max(depths.get(field, PRECOMPUTE_LIMIT) for field in feed["queries"])
+        print(
+            "{:>10} {:>12} {:>8} {:>8}".format(
+                feed_id, feed["bytes"], feed["links"], depth
+            )
+        )
+    print(
+        "Link queries use {} of {} bytes ({:.1f}%)".format(
+            total, budget, 100 * total / budget
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Size link queries to memory budget")
+    parser.add_argument("--once", action="store_true", help="size queries once")
+    parser.add_argument(
+        "--report", action="store_true", help="print memory used by feeds and exit"
+    )
+    parser.add_argument("--interval", type=int, default=INTERVAL)
+    args = parser.parse_args()
+    if args.report:
+        print_report()
+    else:
+        while True:
+            started = time.monotonic()
+            summary = size_link_queries()
+            print(
+                "Sized link queries in {:.2f}s: {}".format(
+                    time.monotonic() - started, summary
+                )
+            )
+            if args.once:
+                break
+            time.sleep(args.interval)
@@ -0,0 +1,41 @@
+"""
+Sweeper of time windowed link queries
+
+Removes links which are older than the time window from best of the day/week/month/year queries
+so the queries have room for links which are still within the window
+
+usage: python -m news.scripts.sweep_time_windows [--once] [--interval SECONDS]
+"""
+import argparse
+import time
+
+INTERVAL = 5 * 60
+
+
+def sweep_time_windows() -> int:
+    """
+    Sweep time windowed queries of all feeds
+    :return: number of removed links
+    """
+    from news.clients.db.query import LinkQuery, TIME_WINDOWS
+    from news.models.feed import Feed
+
+    removed = 0
+    for feed_id in Feed.lists("id"):
+        for window in TIME_WINDOWS:
+            removed += LinkQuery(feed_id=feed_id, sort="best", time=window).sweep()
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep time windowed link queries")
+    parser.add_argument("--once", action="store_true", help="sweep queries once")
+    parser.add_argument("--interval", type=int, default=INTERVAL)
+    args = parser.parse_args()
+    while True:
+        started = time.monotonic()
+        removed = sweep_time_windows()
+        print("Removed {} links in {:.2f}s".format(removed, time.monotonic() - started))
+        if args.once:
+            break
+        time.sleep(args.interval)
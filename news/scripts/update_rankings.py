@@ -0,0 +1,158 @@
+"""
+Ranking updater
+
+Votes mark voted things dirty in 'dirty:<kind>' sorted sets scored by the time of the first vote since
+their last ranking. Updater drains a set once its oldest thing waited MAX_DELAY seconds or MAX_DIRTY things
+are waiting, loads all drained things with current counters at once and updates link queries or sorted
+comments of all of them together, so a popular link is ranked once per flush no matter how many votes it got
+
+usage: python -m news.scripts.update_rankings [--once] [--interval SECONDS] [--max-delay SECONDS] [--max-dirty COUNT]
+"""
+import argparse
+import logging
+import time
+
+from news.lib.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 0.5
+# failed runs are retried after this many seconds, the pause doubles with every failure up to MAX_BACKOFF
+RETRY_DELAY = 1
+MAX_BACKOFF = 60
+# things wait at most this many seconds to be ranked
+MAX_DELAY = 5
+# set is drained right away when this many things wait
+MAX_DIRTY = 200
+
+
+def _vote_models() -> dict:
+    from news.models.vote import CommentVote, LinkVote
+
+    return {model._kind: model for model in [LinkVote, CommentVote]}
+
+
+def due_kinds(max_delay: float, max_dirty: int, now: float = None) -> list:
+    """
+    Kinds of things whose dirty sets should be drained
+    :param max_delay: drain sets whose oldest thing waits this many seconds
+    :param max_dirty: drain sets with this many things
+    :param now: current time
+    :return: kinds
+    """
+    from news.models.vote import DIRTY_KEY
+
+    now = time.time() if now is None else now
+    kinds = list(_vote_models())
+    pipe = cache.pipeline(transaction=False)
+    for kind in kinds:
+        pipe.zcard(DIRTY_KEY.format(kind))
+        pipe.zrange(DIRTY_KEY.format(kind), 0, 0, withscores=True)
+    results = pipe.execute()
+
+    due = []
+    for idx, kind in enumerate(kinds):
+        size, oldest = results[2 * idx : 2 * idx + 2]
+        if size >= max_dirty or (oldest and now - oldest[0][1] >= max_delay):
+            due.append(kind)
+    return due
+
+
+def drain(kind: str, count: int = MAX_DIRTY) -> dict:
+    """
+    Remove all things from dirty set
+    Things voted on meanwhile are added back and ranked by next flush
+    :param kind: kind of things
+    :param count: things removed at once
+    :return: {thing id: time since which it waits}
+    """
+    from news.models.vote import DIRTY_KEY
+
+    dirty = {}
+    while True:
+        popped = cache.zpopmin(DIRTY_KEY.format(kind), count)
+        dirty.update((int(member), score) for member, score in popped)
+        if len(popped) < count:
+            return dirty
+
+
+def restore(kind: str, dirty: dict):
+    """
+    Put drained things back to dirty set when their ranking failed
+    Things voted on meanwhile are already back and keep their time
+    :param kind: kind of things
+    :param dirty: {thing id: time since which it waits}
+    """
+    from news.models.vote import DIRTY_KEY
+
+    if dirty:
+        cache.zadd(DIRTY_KEY.format(kind), dirty, nx=True)
+
+
+def mark_dirty(kind: str, ids: list):
+    """
+    Mark things dirty so they're ranked by next drain, things which already wait keep their time
+    :param kind: kind of things
+    :param ids: thing ids
+    """
+    now = time.time()
+    restore(kind, {thing_id: now for thing_id in ids})
+
+
+def update_rankings(max_delay: float = MAX_DELAY, max_dirty: int = MAX_DIRTY) -> dict:
+    """
+    Update rankings of dirty things which are due
+    :param max_delay: rank things which wait this many seconds
+    :param max_dirty: rank things when this many of them wait
+    :return: {kind: number of ranked things}
+    """
+    vote_models = _vote_models()
+    ranked = {}
+    for kind in due_kinds(max_delay, max_dirty):
+        model = vote_models[kind]
+        dirty = drain(kind)
+        try:
+            things = model.things_with_counters(list(dirty))
+            if things:
+                model.update_ranking(things)
+        except Exception:
+            # ranked by next run
+            restore(kind, dirty)
+            raise
+        ranked[kind] = len(things)
+    return ranked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update rankings of voted things")
+    parser.add_argument(
+        "--once", action="store_true", help="rank all dirty things once"
+    )
+    parser.add_argument("--interval", type=float, default=INTERVAL)
+    parser.add_argument("--max-delay", type=float, default=MAX_DELAY)
+    parser.add_argument("--max-dirty", type=int, default=MAX_DIRTY)
+    args = parser.parse_args()
+    backoff = RETRY_DELAY
+    while True:
+        started = time.monotonic()
+        try:
+            # single run ranks everything that's dirty
+            ranked = (
+                update_rankings(0, 1)
+                if args.once
+                else update_rankings(args.max_delay, args.max_dirty)
+            )
+        except Exception:
+            if args.once:
+                raise
+            # drained things were put back and wait for the next run
+            logger.exception("Updating rankings failed, retrying in %.1fs", backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            continue
+        backoff = RETRY_DELAY
+        if ranked:
+            print("Ranked {} in {:.2f}s".format(ranked, time.monotonic() - started))
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,114 @@
+"""
+Vote state memory report
+
+Measures memory used by cached vote sets ('luv:', 'ldv:', 'cuv:' and 'cdv:' keys) of users grouped
+by the month they signed up in. Sets of sampled users of every cohort are measured by MEMORY USAGE,
+totals are extrapolated to the whole cohort. 'compact' is the share of sets stored as intsets
+
+usage: python -m news.scripts.vote_state_report [--sample USERS]
+"""
+import argparse
+
+from news.lib.cache import cache
+
+# users measured in every cohort
+SAMPLE = 1000
+
+
+def user_cohorts(sample: int) -> list:
+    """
+    Users grouped by month of sign up
+    :param sample: maximal number of sampled users of a cohort
+    :return: [(cohort, number of users, ids of sampled users)] from the oldest cohort
+    """
+    from news.clients.db.db import db
+
+    rows = db.select(
+        "SELECT to_char(created_at, 'YYYY-MM') AS cohort, COUNT(*) AS users, "
+        "(array_agg(id ORDER BY random()))[1:{:d}] AS sample "
+        "FROM users GROUP BY cohort ORDER BY cohort".format(sample)
+    )
+    return [(row["cohort"], row["users"], row["sample"]) for row in rows]
+
+
+def vote_state_memory(user_ids: list) -> dict:
+    """
+    Measure vote sets of users
+    :param user_ids: user ids
+    :return: {"users": users with cached sets, "bytes": used memory, "votes": cached votes,
+    "sets": cached sets, "compact": sets stored as intsets}
+    """
+    from news.models.vote import DOWNVOTE, UPVOTE, CommentVote, LinkVote
+
+    keys = [
+        model._set_key(user_id, vote_type)
+        for user_id in user_ids
+        for model in [LinkVote, CommentVote]
+        for vote_type in [UPVOTE, DOWNVOTE]
+    ]
+    pipe = cache.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key)
+        pipe.scard(key)
+        pipe.object("encoding", key)
+    results = pipe.execute()
+
+    memory = {"users": 0, "bytes": 0, "votes": 0, "sets": 0, "compact": 0}
+    cached_users = set()
+    for idx, key in enumerate(keys):
+        used, size, encoding = results[3 * idx : 3 * idx + 3]
+        if not used:
+            continue
+        cached_users.add(idx // 4)
+        memory["bytes"] += used
+        # without the placeholder
+        memory["votes"] += max(size - 1, 0)
+        memory["sets"] += 1
+        memory["compact"] += encoding == b"intset"
+    memory["users"] = len(cached_users)
+    return memory
+
+
+def print_report(sample: int = SAMPLE):
+    """
+    Print memory used by vote sets of every cohort
+    :param sample: number of users measured in every cohort
+    """
+    print(
+        "{:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>14} {:>8}".format(
+            "cohort",
+            "users",
+            "sampled",
+            "cached",
+            "votes/user",
+            "bytes/user",
+            "est. bytes",
+            "compact",
+        )
+    )
+    total = 0
+    for cohort, users, sample_ids in user_cohorts(sample):
+        memory = vote_state_memory(sample_ids)
+        cached = memory["users"]
+        bytes_per_user = memory["bytes"] / len(sample_ids)
+        total += bytes_per_user * users
+        print(
+            "{:>8} {:>8} {:>8} {:>8} {:>10.1f} {:>10.0f} {:>14.0f} {:>7.0f}%".format(
+                cohort,
+                users,
+                len(sample_ids),
+                cached,
+                memory["votes"] / cached if cached else 0,
+                bytes_per_user,
+                bytes_per_user * users,
+                100 * memory["compact"] / memory["sets"] if memory["sets"] else 100,
+            )
+        )
+    print("Vote sets of all users use about {:.0f} bytes".format(total))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory used by vote sets")
+    parser.add_argument("--sample", type=int, default=SAMPLE)
+    args = parser.parse_args()
+    print_report(args.sample)
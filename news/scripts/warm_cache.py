@@ -0,0 +1,194 @@
+"""
+Cache warm-up
+
+Restores things which are expensive to rebuild on first requests (link queries of all feeds, top links)
+or which are never rebuilt at all (bans) after the cache gets flushed or Redis fails over.
+Progress is printed and kept in 'warmup:status' hash so deploys can wait for the warm-up to finish
+
+usage: python -m news.scripts.warm_cache [--workers N] [--top-links N]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from news.lib.cache import cache
+
+WORKERS = 8
+TOP_LINKS = 100
+BATCH_SIZE = 500
+SORTS = ["trending", "new", "best"]
+
+STATUS_KEY = "warmup:status"
+STATUS_TTL = 24 * 60 * 60
+
+
+class Progress:
+    """
+    Reports progress of the warm-up to stdout and to STATUS_KEY
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stage = None
+        self.total = 0
+        self.done = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def start(self, stage: str, total: int):
+        self.stage, self.total, self.done = stage, total, 0
+        self._report()
+
+    def advance(self, amount: int = 1):
+        self.done += amount
+        self._report()
+
+    def finish(self, summary: dict):
+        print("Warm-up finished in {:.2f}s: {}".format(self.elapsed, summary))
+        self._save(state="done", **summary)
+
+    def _report(self):
+        print(
+            "[{:>8.2f}s] {} {}/{}".format(
+                self.elapsed, self.stage, self.done, self.total
+            )
+        )
+        self._save(state="running", stage=self.stage, done=self.done, total=self.total)
+
+    def _save(self, **status):
+        status["elapsed"] = round(self.elapsed, 2)
+        pipe = cache.pipeline(transaction=False)
+        pipe.hmset(STATUS_KEY, status)
+        pipe.expire(STATUS_KEY, STATUS_TTL)
+        pipe.execute()
+
+
+def _chunks(items: list, size: int):
+    for idx in range(0, len(items), size):
+        yield items[idx : idx + size]
+
+
+def warm_bans(progress: Progress) -> int:
+    """
+    Write all active bans to cache
+    :return: number of bans
+    """
+    from news.models.ban import Ban
+
+    bans = list(Ban.where_raw("until IS NULL OR until > NOW()").get())
+    progress.start("bans", len(bans))
+    for chunk in _chunks(bans, BATCH_SIZE):
+        with cache.batch():
+            for ban in chunk:
+                ban.write_to_cache()
+        progress.advance(len(chunk))
+    return len(bans)
+
+
+def warm_feeds(progress: Progress) -> list:
+    """
+    Write all feeds and their slug maps to cache
+    :return: feeds
+    """
+    from news.models.feed import Feed
+
+    feeds = list(Feed.all())
+    progress.start("feeds", len(feeds))
+    with cache.batch():
+        for feed in feeds:
+            feed.write_to_cache()
+            cache.set("fslug:{}".format(feed.slug), feed.id, raw=True)
+    progress.advance(len(feeds))
+    return feeds
+
+
+def warm_queries(progress: Progress, feeds: list, workers: int, top_links: int) -> list:
+    """
+    Build trending, new and best link queries for all feeds
+    :return: ids of top links of all queries
+    """
+    from news.clients.db.query import LinkQuery
+
+    def warm_query(feed_id, sort):
+        return LinkQuery(feed_id=feed_id, sort=sort).fetch_ids()[:top_links]
+
+    progress.start("link queries", len(feeds) * len(SORTS))
+    top_ids = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(warm_query, feed.id, sort)
+            for feed in feeds
+            for sort in SORTS
+        ]
+        for future in as_completed(futures):
+            top_ids.update(dict.fromkeys(future.result()))
+            progress.advance()
+    return list(top_ids)
+
+
+def warm_links(progress: Progress, ids: list, workers: int) -> (int, int):
+    """
+    Load top links, their slug maps and their authors to cache
+    :return: number of links and users
+    """
+    from news.models.link import Link
+    from news.models.user import User
+
+    def warm_chunk(chunk):
+        links = Link.by_ids(chunk)
+        with cache.batch():
+            for link in links:
+                cache.set("lslug:{}".format(link.slug), link.id)
+        return links
+
+    progress.start("links", len(ids))
+    loaded = 0
+    user_ids = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(warm_chunk, chunk) for chunk in _chunks(ids, BATCH_SIZE)
+        ]
+        for future in as_completed(futures):
+            links = future.result()
+            loaded += len(links)
+            user_ids.update(link.user_id for link in links)
+            progress.advance(len(links))
+
+    progress.start("users", len(user_ids))
+    users = User.by_ids(list(user_ids)) if user_ids else []
+    progress.advance(len(users))
+    return loaded, len(users)
+
+
+def warm_cache(workers: int = WORKERS, top_links: int = TOP_LINKS) -> dict:
+    """
+    Warm up the cache
+    :param workers: how many queries and link batches are loaded in parallel
+    :param top_links: how many top links from every query should be loaded
+    :return: summary of what was loaded
+    """
+    progress = Progress()
+    bans = warm_bans(progress)
+    feeds = warm_feeds(progress)
+    ids = warm_queries(progress, feeds, workers, top_links)
+    links, users = warm_links(progress, ids, workers)
+
+    summary = {
+        "bans": bans,
+        "feeds": len(feeds),
+        "queries": len(feeds) * len(SORTS),
+        "links": links,
+        "users": users,
+    }
+    progress.finish(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm up the cache")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--top-links", type=int, default=TOP_LINKS)
+    args = parser.parse_args()
+    warm_cache(workers=args.workers, top_links=args.top_links)
@@ -0,0 +1,68 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from news.lib import batch_sorts
+from news.lib.sorts import hot
+from news.lib.utils.confidence import confidence
+from news.lib.utils.time_utils import epoch_seconds
+
+
+class BatchSortsTests(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(7)
+        count = 50000
+        self.ups = [
+            rnd.choice([0, 1, 2, rnd.randint(0, 10 ** 5)]) for _ in range(count)
+        ]
+        self.downs = [rnd.choice([0, 1, rnd.randint(0, 10 ** 4)]) for _ in range(count)]
+        start = datetime(2005, 1, 1)
+        self.created_at = [
+            start + timedelta(microseconds=rnd.randint(0, 15 * 365 * 86400 * 10 ** 6))
+            for _ in range(count)
+        ]
+
+    def test_hot_identical(self):
+        expected = [
+            hot(u - d, c) for u, d, c in zip(self.ups, self.downs, self.created_at)
+        ]
+        self.assertEqual(
+            batch_sorts.hot(self.ups, self.downs, self.created_at).tolist(), expected
+        )
+
+    def test_hot_datetime64(self):
+        dates = np.array(self.created_at, dtype="datetime64[us]")
+        self.assertEqual(
+            batch_sorts.hot(self.ups, self.downs, dates).tolist(),
+            batch_sorts.hot(self.ups, self.downs, self.created_at).tolist(),
+        )
+
+    def test_hot_epoch_seconds(self):
+        seconds = [epoch_seconds(c) for c in self.created_at]
+        self.assertEqual(
+            batch_sorts.hot(self.ups, self.downs, seconds).tolist(),
+            batch_sorts.hot(self.ups, self.downs, self.created_at).tolist(),
+        )
+
+    def test_hot_edges(self):
+        date = datetime(2020, 3, 1, 12, 30)
+        ups, downs = [0, 1, 0, 10, 5], [0, 0, 1, 0, 5]
+        self.assertEqual(
+            batch_sorts.hot(ups, downs, [date] * 5).tolist(),
+            [hot(u - d, date) for u, d in zip(ups, downs)],
+        )
+
+    def test_confidence_identical(self):
+        expected = [confidence(u, d) for u, d in zip(self.ups, self.downs)]
+        self.assertEqual(
+            batch_sorts.confidence(self.ups, self.downs).tolist(), expected
+        )
+
+    def test_confidence_no_votes(self):
+        self.assertEqual(batch_sorts.confidence([0], [0]).tolist(), [0.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
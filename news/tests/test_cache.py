@@ -0,0 +1,264 @@
+import unittest
+from unittest import mock
+
+from orator import Model
+from prometheus_client import REGISTRY
+from redis_lock import Lock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from news.lib import cache as cache_module
+from news.lib.cache import TOMBSTONE, Cache, Deferred, cache
+from news.models.base import Base
+from news.models.feed import Feed
+
+
+def prevented(prefix):
+    """
+    Number of DB queries prevented by tombstones of the prefix so far
+    """
+    return (
+        REGISTRY.get_sample_value("cache_tombstone_hits_total", {"prefix": prefix}) or 0
+    )
+
+
+class MgetOrRebuildTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.conn = mock.MagicMock()
+        self.pipe = self.cache.conn.pipeline.return_value
+        self.rebuilt = []
+
+    def rebuild(self, keys):
+        self.rebuilt.append(keys)
+        return [{"id": key} if key != "f:3" else None for key in keys]
+
+    def test_backfill(self):
+        self.cache.conn.mget.return_value = [
+            self.cache._encode("f:1", {"id": "f:1"}),
+            None,
+            None,
+        ]
+        values = self.cache.mget_or_rebuild(["f:1", "f:2", "f:2"], self.rebuild, ttl=60)
+        self.assertEqual(values, [{"id": "f:1"}, {"id": "f:2"}, {"id": "f:2"}])
+        # every missing key is rebuilt once and written back
+        self.assertEqual(self.rebuilt, [["f:2"]])
+        self.pipe.setex.assert_called_once_with(
+            "f:2", 60, self.cache._encode("f:2", {"id": "f:2"})
+        )
+
+    def test_tombstone(self):
+        self.cache.conn.mget.return_value = [None, TOMBSTONE]
+        values = self.cache.mget_or_rebuild(
+            ["f:3", "f:4"], self.rebuild, cache_missing=True
+        )
+        # missing thing is remembered, remembered one isn't rebuilt
+        self.assertEqual(values, [None, None])
+        self.assertEqual(self.rebuilt, [["f:3"]])
+        self.pipe.setex.assert_called_once_with(
+            "f:3", self.cache.tombstone_ttl, TOMBSTONE
+        )
+
+    def test_without_tombstones(self):
+        self.cache.conn.mget.return_value = [None]
+        self.assertEqual(self.cache.mget_or_rebuild(["f:3"], self.rebuild), [None])
+        self.pipe.setex.assert_not_called()
+
+
+@unittest.skipIf(fakeredis is None, "rebuild leases need fakeredis with Lua support")
+class GetOrRebuildTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.conn = fakeredis.FakeRedis()
+        self.rebuilt = 0
+
+    def rebuild(self):
+        self.rebuilt += 1
+        return {"rebuilt": self.rebuilt}
+
+    def lease(self, key):
+        lease = Lock(self.cache.conn, "rebuild:" + key, expire=10)
+        lease.acquire()
+        return lease
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get_or_rebuild("l:1", self.rebuild), {"rebuilt": 1})
+        self.assertEqual(self.cache.get_or_rebuild("l:1", self.rebuild), {"rebuilt": 1})
+        self.assertEqual(self.rebuilt, 1)
+        self.assertFalse(self.cache.conn.exists("rebuild:l:1"))
+
+    def test_waits_for_lease_holder(self):
+        self.lease("l:1")
+
+        def rebuilt_meanwhile(seconds):
+            self.cache.set("l:1", {"rebuilt": "elsewhere"})
+
+        with mock.patch("time.sleep", side_effect=rebuilt_meanwhile):
+            value = self.cache.get_or_rebuild("l:1", self.rebuild)
+        self.assertEqual(value, {"rebuilt": "elsewhere"})
+        self.assertEqual(self.rebuilt, 0)
+
+    def test_lease_holder_too_slow(self):
+        self.lease("l:1")
+        with mock.patch.object(cache_module, "REBUILD_WAIT", 0):
+            self.assertEqual(
+                self.cache.get_or_rebuild("l:1", self.rebuild), {"rebuilt": 1}
+            )
+
+    def test_early_refresh(self):
+        self.cache.set("l:1", {"rebuilt": 0}, ttl=1)
+        # refresh is certain this close to expiration
+        with mock.patch.object(cache_module, "random", return_value=0.999999):
+            value = self.cache.get_or_rebuild("l:1", self.rebuild, ttl=3600)
+        self.assertEqual(value, {"rebuilt": 1})
+        self.assertGreater(self.cache.conn.ttl("l:1"), 60)
+
+    def test_no_early_refresh(self):
+        self.cache.set("l:1", {"rebuilt": 0}, ttl=3600)
+        with mock.patch.object(cache_module, "random", return_value=0.999999):
+            self.assertEqual(
+                self.cache.get_or_rebuild("l:1", self.rebuild), {"rebuilt": 0}
+            )
+        self.cache.set("l:1", {"rebuilt": 0}, ttl=1)
+        with mock.patch.object(cache_module, "random", return_value=0.999999):
+            value = self.cache.get_or_rebuild("l:1", self.rebuild, beta=0)
+        self.assertEqual(value, {"rebuilt": 0})
+
+    def test_early_refresh_by_other_process(self):
+        self.cache.set("l:1", {"rebuilt": 0}, ttl=1)
+        self.lease("l:1")
+        # current value is served while the lease holder refreshes it
+        with mock.patch.object(cache_module, "random", return_value=0.999999):
+            value = self.cache.get_or_rebuild("l:1", self.rebuild)
+        self.assertEqual(value, {"rebuilt": 0})
+        self.assertEqual(self.rebuilt, 0)
+
+
+@unittest.skipIf(fakeredis is None, "tombstones need fakeredis")
+class TombstoneTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.conn = fakeredis.FakeRedis()
+        self.rebuilt = 0
+
+    def rebuild(self):
+        self.rebuilt += 1
+        return None
+
+    def test_remembered_miss(self):
+        before = prevented("l:")
+        for _ in range(3):
+            self.assertIsNone(
+                self.cache.get_or_rebuild("l:1", self.rebuild, cache_missing=True)
+            )
+        self.assertEqual(self.rebuilt, 1)
+        self.assertEqual(self.cache.conn.get("l:1"), TOMBSTONE)
+        self.assertLessEqual(self.cache.conn.ttl("l:1"), self.cache.tombstone_ttl)
+        self.assertEqual(prevented("l:") - before, 2)
+
+    def test_misses_not_remembered(self):
+        self.cache.get_or_rebuild("l:1", self.rebuild)
+        self.cache.get_or_rebuild("l:1", self.rebuild)
+        self.assertEqual(self.rebuilt, 2)
+        self.assertFalse(self.cache.conn.exists("l:1"))
+
+    def test_tombstone_isnt_value(self):
+        self.cache.set_tombstone("l:1")
+        self.assertIsNone(self.cache.get("l:1"))
+
+
+@unittest.skipIf(fakeredis is None, "tombstones need fakeredis")
+class SlugTombstoneTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeRedis()
+        self.query = mock.MagicMock()
+        self.query.where.return_value = self.query
+        # no feed has the slug
+        self.query.first.return_value = None
+        for patcher in [
+            mock.patch.object(cache, "conn", self.conn),
+            mock.patch.object(Base, "query", return_value=self.query),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_remembered_miss(self):
+        before = prevented("fslug:")
+        self.assertIsNone(Feed.by_slug("missing"))
+        self.assertIsNone(Feed.by_slug("missing"))
+        self.assertEqual(self.query.first.call_count, 1)
+        self.assertEqual(prevented("fslug:") - before, 1)
+
+    def test_forgotten_when_created(self):
+        Feed.by_slug("missing")
+        feed = Feed(name="Missing", slug="missing")
+        feed.id = 3
+        with mock.patch.object(Model, "save", return_value=True):
+            feed.save()
+        self.assertFalse(self.conn.exists("fslug:missing"))
+
+
+@unittest.skipIf(fakeredis is None, "batch tests need fakeredis")
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.conn = fakeredis.FakeRedis()
+        self.pipelines = []
+        pipeline = self.cache.conn.pipeline
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            self.pipelines.append(pipe)
+            return pipe
+
+        self.cache.conn.pipeline = counted_pipeline
+
+    def test_queued_until_end(self):
+        with self.cache.batch():
+            added = self.cache.sadd("s", 1, 2)
+            self.cache.set("k", {"a": 1})
+            deleted = self.cache.delete("s")
+            self.assertIsInstance(added, Deferred)
+            # reads run immediately and don't see queued writes
+            self.assertIsNone(self.cache.get("k"))
+            with self.assertRaises(RuntimeError):
+                added.value
+        self.assertEqual(added.value, 2)
+        self.assertEqual(deleted.value, 1)
+        self.assertEqual(self.cache.get("k"), {"a": 1})
+        self.assertEqual(len(self.pipelines), 1)
+
+    def test_nested(self):
+        with self.cache.batch() as outer:
+            with self.cache.batch() as inner:
+                added = self.cache.sadd("s", 1)
+            self.assertIs(inner, outer)
+            self.assertFalse(self.cache.conn.exists("s"))
+        self.assertEqual(added.value, 1)
+        self.assertEqual(len(self.pipelines), 1)
+
+    def test_flush(self):
+        with self.cache.batch():
+            self.cache.hset("h", "ups", 1)
+            self.cache.flush()
+            self.assertEqual(self.cache.conn.hget("h", "ups"), b"1")
+            incremented = self.cache.hincrby("h", "ups", 1)
+        self.assertEqual(incremented.value, 2)
+
+    def test_outside_batch(self):
+        self.assertEqual(self.cache.sadd("s", 1), 1)
+        self.assertEqual(self.pipelines, [])
+
+    def test_queue_sent_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.cache.batch():
+                self.cache.sadd("s", 1)
+                raise ValueError
+        self.assertTrue(self.cache.conn.sismember("s", 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime
+
+from news.lib.cache_codecs import (
+    ModelCodec,
+    TuplesCodec,
+    CodecError,
+    PICKLE,
+    compress,
+    decompress,
+    is_compressed,
+)
+
+
+class ModelCodecTests(unittest.TestCase):
+    def test_round_trip(self):
+        codec = ModelCodec(["id", "title", "ups", "created_at"])
+        value = {
+            "id": 12,
+            "title": "Hello world",
+            "ups": -3,
+            "created_at": datetime(2018, 9, 10, 21, 19, 45, 123),
+            "session_token": "abc",
+            "archived": False,
+            "image": None,
+        }
+        self.assertEqual(codec.decode(codec.encode(value)), value)
+
+    def test_schema_change(self):
+        old = ModelCodec(["id", "title"])
+        new = ModelCodec(["id", "title", "ups"])
+        with self.assertRaises(CodecError):
+            new.decode(old.encode({"id": 1, "title": "x"}))
+
+
+class TuplesCodecTests(unittest.TestCase):
+    def test_round_trip(self):
+        codec = TuplesCodec()
+        for value in [[], [[1, 3412.1234567]], [[1, 5, 1536614385.0], [2, -1, 0.5]]]:
+            self.assertEqual(codec.decode(codec.encode(value)), value)
+
+    def test_smaller_than_pickle(self):
+        codec = TuplesCodec()
+        value = [[i, i * 1.5] for i in range(1000)]
+        self.assertLess(len(codec.encode(value)), len(PICKLE.encode(value)))
+
+    def test_unsupported(self):
+        codec = TuplesCodec()
+        for value in [{}, [1, 2], [[1], [1, 2]], [["a", 1]]]:
+            with self.assertRaises(CodecError):
+                codec.encode(value)
+
+
+class CompressionTests(unittest.TestCase):
+    def test_round_trip(self):
+        data = PICKLE.encode([{"title": "Hello world", "id": i} for i in range(100)])
+        compressed = compress(data)
+        self.assertTrue(is_compressed(compressed))
+        self.assertFalse(is_compressed(data))
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(decompress(compressed), data)
+
+    def test_corrupted(self):
+        with self.assertRaises(CodecError):
+            decompress(compress(b"x" * 100)[:10])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from news.lib.cache_metrics import key_prefix
+
+
+class KeyPrefixTests(unittest.TestCase):
+    def test_prefix(self):
+        self.assertEqual(key_prefix("l:12"), "l:")
+        self.assertEqual(key_prefix(b"cquery:1.trending.all"), "cquery:")
+        self.assertEqual(key_prefix("FeedAdmin_12"), "FeedAdmin_")
+
+    def test_no_prefix(self):
+        self.assertEqual(key_prefix("12:34"), "")
+        self.assertEqual(key_prefix("somekey"), "")
+        self.assertEqual(key_prefix(12), "")
+
+    def test_bounded(self):
+        self.assertEqual(key_prefix("a" * 100 + ":1"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
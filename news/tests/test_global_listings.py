@@ -0,0 +1,84 @@
+import time
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from news.clients.db.query import MergedLinkQuery
+from news.lib.cache import cache
+from news.lib.global_listings import LISTINGS, MERGED_SORTS, GlobalListings
+
+
+def sample(name, listing):
+    return REGISTRY.get_sample_value(name, {"listing": listing}) or 0
+
+
+@unittest.skipIf(fakeredis is None, "global listings need fakeredis")
+class GlobalListingsTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeRedis()
+        patcher = mock.patch.object(cache, "conn", self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.listings = GlobalListings()
+        self.listings.feed_ids = [1, 2]
+        self.merged = 0
+        self.listings._compute = self.compute
+
+    def compute(self, name):
+        self.merged += 1
+        return [[self.merged, float(self.merged)]]
+
+    def test_build(self):
+        self.assertEqual(self.listings.build(), 1)
+        self.assertEqual(self.merged, len(LISTINGS))
+        for name in LISTINGS:
+            self.assertEqual(self.listings.listing(name).generation, 1)
+        self.assertEqual(self.listings.build(), 2)
+        listing = self.listings.listing("new")
+        # served without merging
+        self.assertEqual(self.merged, 2 * len(LISTINGS))
+        self.assertEqual(listing.generation, 2)
+        self.assertEqual(self.listings.links("new"), [row[0] for row in listing.rows])
+
+    def test_missing(self):
+        fallbacks = sample("global_listing_fallbacks_total", "trending")
+        listing = self.listings.listing("trending")
+        self.assertEqual((listing.generation, listing.rows), (0, [[1, 1.0]]))
+        self.assertEqual(
+            sample("global_listing_fallbacks_total", "trending") - fallbacks, 1
+        )
+
+    def test_stale(self):
+        self.listings.build()
+        observed = sample("global_listing_staleness_seconds_count", "best.week")
+        fallbacks = sample("global_listing_fallbacks_total", "best.week")
+        with mock.patch("time.time", return_value=time.time() + 10):
+            self.assertEqual(self.listings.listing("best.week").generation, 1)
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertEqual(self.listings.listing("best.week").generation, 0)
+        self.assertEqual(
+            sample("global_listing_staleness_seconds_count", "best.week") - observed, 2
+        )
+        self.assertEqual(
+            sample("global_listing_fallbacks_total", "best.week") - fallbacks, 1
+        )
+
+    def test_is_dirty(self):
+        self.assertTrue(self.listings.is_dirty())
+        for sort in MERGED_SORTS:
+            self.conn.set(MergedLinkQuery([2, 1], sort)._cache_key, b"")
+        self.assertFalse(self.listings.is_dirty())
+        # any default feed changed
+        self.conn.delete(MergedLinkQuery([1, 2], "new")._cache_key)
+        self.assertTrue(self.listings.is_dirty())
+
+
+if __name__ == "__main__":
+    unittest.main()
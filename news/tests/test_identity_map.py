@@ -0,0 +1,45 @@
+import unittest
+
+from flask import Flask
+
+from news.lib.identity_map import MISSING, IdentityMap
+
+
+class IdentityMapTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.identity_map = IdentityMap(self.app)
+
+    def test_add_get(self):
+        feed = object()
+        with self.app.test_request_context():
+            self.assertIs(self.identity_map.get("f:1"), MISSING)
+            self.identity_map.add("f:1", feed)
+            self.assertIs(self.identity_map.get("f:1"), feed)
+
+    def test_remembered_miss(self):
+        with self.app.test_request_context():
+            self.identity_map.add("fslug:missing", None)
+            self.assertIsNone(self.identity_map.get("fslug:missing"))
+
+    def test_discard(self):
+        with self.app.test_request_context():
+            self.identity_map.add("f:1", object())
+            self.identity_map.add("fslug:missing", None)
+            self.identity_map.discard("f:1", "fslug:missing", "f:2")
+            self.assertIs(self.identity_map.get("f:1"), MISSING)
+            self.assertIs(self.identity_map.get("fslug:missing"), MISSING)
+
+    def test_request_scoped(self):
+        with self.app.test_request_context():
+            self.identity_map.add("f:1", object())
+        with self.app.test_request_context():
+            self.assertIs(self.identity_map.get("f:1"), MISSING)
+
+    def test_disabled_outside_request(self):
+        self.identity_map.add("f:1", object())
+        self.assertIs(self.identity_map.get("f:1"), MISSING)
+
+
+if __name__ == "__main__":
+    unittest.main()
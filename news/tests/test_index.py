@@ -0,0 +1,49 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from flask import Flask
+
+from news.clients.db.query import LinkScores
+from news.controllers import web
+from news.lib.global_listings import GlobalListing
+
+# merged listing of subscribed feeds, every third link is scored above the user's minimum
+ROWS = [[id, 100 - id] for id in range(1, 91)]
+SCORES = {id: 1 if id % 3 == 0 else -1 for id, _ in ROWS}
+
+
+class IndexTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        user = SimpleNamespace(
+            is_authenticated=True, subscribed_feed_ids=[1, 2], p_min_link_score=0
+        )
+        self.render = mock.MagicMock()
+        self.merged = mock.MagicMock(return_value=GlobalListing(ROWS, 0))
+        for patcher in [
+            mock.patch.object(web, "current_user", user),
+            mock.patch.object(web, "render_template", self.render),
+            mock.patch.object(web, "MergedLinkQuery", self.merged),
+            mock.patch.object(web.Link, "by_ids", side_effect=lambda ids: ids),
+            mock.patch.object(
+                LinkScores, "get", side_effect=lambda ids: {i: SCORES[i] for i in ids}
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def index(self, sort):
+        with self.app.test_request_context(query_string={"sort": sort}):
+            web.index()
+        return self.render.call_args[1]["links"]
+
+    def test_min_score(self):
+        expected = [id for id, _ in ROWS if SCORES[id] > 0][:20]
+        for sort in ["trending", "best", "new"]:
+            self.assertEqual(self.index(sort), expected, sort)
+            self.merged.assert_called_with([1, 2], sort)
+
+
+if __name__ == "__main__":
+    unittest.main()
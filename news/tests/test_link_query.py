@@ -0,0 +1,289 @@
+import random
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from news.clients.db import query as query_module
+from news.clients.db.query import (
+    JOB_add_links_to_queries,
+    LinkQuery,
+    LinkScores,
+    MergedLinkQuery,
+    MinScoreListing,
+    ZSetLinkQuery,
+    lazy_merge,
+    link_query_backend,
+)
+from news.lib.cache import cache
+from news.lib.pagination import Cursor
+from news.scripts.migrate_link_queries import _parse_key
+
+
+class ZSetScoreTests(unittest.TestCase):
+    def test_best_roundtrip(self):
+        query = ZSetLinkQuery(1, "best")
+        for row in [[1, 0, 1577836800.0], [2, 42, 1577836801.0], [3, -5, 1600000000.0]]:
+            self.assertEqual(query._row(b"%d" % row[0], query._score(row)), row)
+
+    def test_best_order(self):
+        query = ZSetLinkQuery(1, "best")
+        rows = [[1, 3, 100.0], [2, 3, 200.0], [3, 4, 50.0], [4, -1, 300.0]]
+        ordered = sorted(rows, key=query._score, reverse=True)
+        self.assertEqual(ordered, sorted(rows, key=lambda x: x[1:], reverse=True))
+
+    def test_new_roundtrip(self):
+        query = ZSetLinkQuery(1, "new")
+        self.assertEqual(query._row(b"7", 1577836800.5), [7, 1577836800.5])
+
+
+class ListQuery(LinkQuery):
+    """
+    Query stored in a list which counts range reads and records observed read depths
+    """
+
+    def __init__(self, data):
+        super().__init__(0, "new")
+        self.data = sorted(data, key=lambda x: x[1:], reverse=True)
+        self.read = 0
+        self.ranges = 0
+        self.depths = []
+
+    def _fetch_range(self, offset, limit):
+        rows = self.data[offset : None if limit is None else offset + limit]
+        self.read += len(rows)
+        self.ranges += 1
+        return rows
+
+    def _stored_depth(self):
+        # whole query is stored
+        return len(self.data), len(self.data) + 1
+
+    def _observe_read(self, depth):
+        self.depths.append(depth)
+
+
+class WholeListQuery(ListQuery):
+    """
+    Query which is read whole by every range read, like pickled queries
+    """
+
+    _reads_whole_query = True
+
+
+class LazyMergeTests(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        self.queries = [
+            ListQuery([[i * 10 + q, rnd.random()] for i in range(200)])
+            for q in range(10)
+        ]
+        self.expected = sorted(
+            (row for query in self.queries for row in query.data),
+            key=lambda x: x[1:],
+            reverse=True,
+        )
+
+    def test_merge(self):
+        self.assertEqual(lazy_merge(self.queries, 21, 5), self.expected[:21])
+        self.assertEqual(lazy_merge(self.queries, 2000, 25), self.expected)
+
+    def test_reads_only_needed_depth(self):
+        lazy_merge(self.queries, 21, 5)
+        self.assertLessEqual(sum(q.read for q in self.queries), 21 + 10 * 5)
+
+    def test_whole_queries_read_once(self):
+        queries = [WholeListQuery(query.data) for query in self.queries]
+        self.assertEqual(lazy_merge(queries, 21, 5), self.expected[:21])
+        self.assertEqual([query.ranges for query in queries], [1] * len(queries))
+
+    def test_empty(self):
+        self.assertEqual(lazy_merge([], 20), [])
+        self.assertEqual(lazy_merge([ListQuery([])], 20), [])
+
+
+class MinScoreListingTests(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(7)
+        self.query = ListQuery([[i, rnd.random()] for i in range(300)])
+        self.scores = {i: rnd.randint(-10, 10) for i in range(300)}
+        self.expected = [row for row in self.query.data if self.scores[row[0]] > 5]
+        patcher = mock.patch.object(
+            LinkScores, "get", side_effect=lambda ids: {i: self.scores[i] for i in ids}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_full_pages(self):
+        listing = MinScoreListing(self.query, 5)
+        self.assertEqual(listing.fetch(0, 20), self.expected[:20])
+        self.assertEqual(listing.fetch(20, 20), self.expected[20:40])
+
+    def test_seek(self):
+        listing = MinScoreListing(self.query, 5)
+        row = self.expected[30]
+        cursor = Cursor(row[1:], row[0], 0)
+        self.assertEqual(listing.seek(cursor, 20), self.expected[31:51])
+        self.assertEqual(listing.seek(cursor, 20, before=True), self.expected[10:30])
+
+    def test_end(self):
+        listing = MinScoreListing(self.query, 5)
+        self.assertEqual(listing.fetch(0, 1000), self.expected)
+
+    def test_observed_depth(self):
+        # only every 8th link qualifies so the listing is read by several seeks
+        self.scores = {
+            row[0]: 10 if idx % 8 == 0 else 0 for idx, row in enumerate(self.query.data)
+        }
+        listing = MinScoreListing(self.query, 5)
+        last = listing.fetch(0, 20)[-1]
+        # links skipped by the filter count to the depth too
+        self.assertGreaterEqual(max(self.query.depths), self.query.data.index(last))
+
+
+def link(id, feed_id, created_at):
+    return SimpleNamespace(
+        id=id,
+        feed_id=feed_id,
+        created_at=datetime.utcfromtimestamp(created_at),
+        hot=created_at,
+        score=1,
+    )
+
+
+@unittest.skipIf(
+    fakeredis is None, "sorted set queries need fakeredis with Lua support"
+)
+class ZSetQueryTestCase(unittest.TestCase):
+    """
+    Sorted set queries of new links, feed N has links N * 100 + i created at 1000 + i * 10 + N
+    """
+
+    feeds = 3
+
+    def setUp(self):
+        self.conn = fakeredis.FakeRedis()
+        self.links = {
+            feed_id: [[feed_id * 100 + i, 1000.0 + i * 10 + feed_id] for i in range(20)]
+            for feed_id in range(1, self.feeds + 1)
+        }
+        self.rebuilt = []
+
+        def rebuild(query, limit=None):
+            self.rebuilt.append(query.feed_id)
+            if query.sort != "new":
+                return []
+            return sorted(self.links[query.feed_id], key=lambda x: x[1:], reverse=True)
+
+        for patcher in [
+            mock.patch.object(cache, "conn", self.conn),
+            mock.patch.object(link_query_backend, "name", "zset"),
+            mock.patch.dict(query_module._scripts, clear=True),
+            mock.patch.object(ZSetLinkQuery, "_rebuild", rebuild),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def expected(self, *feed_ids):
+        rows = [row for feed_id in feed_ids for row in self.links[feed_id]]
+        return sorted(rows, key=lambda x: x[1:], reverse=True)
+
+
+class MergedLinkQueryTests(ZSetQueryTestCase):
+    def test_merge(self):
+        merged = MergedLinkQuery([1, 2], "new")
+        self.assertEqual(merged.fetch(0, 10), self.expected(1, 2)[:10])
+        self.assertEqual(
+            merged.fetch_ids(10, 5), [r[0] for r in self.expected(1, 2)[10:15]]
+        )
+
+    def test_shared_by_feed_set(self):
+        MergedLinkQuery([1, 2], "new").fetch(0, 10)
+        other = MergedLinkQuery([2, 1, 2], "new")
+        self.assertEqual(other._cache_key, MergedLinkQuery([1, 2], "new")._cache_key)
+        self.assertNotEqual(other._cache_key, MergedLinkQuery([1, 3], "new")._cache_key)
+        with mock.patch.object(MergedLinkQuery, "_build") as build:
+            self.assertEqual(other.fetch(0, 10), self.expected(1, 2)[:10])
+        build.assert_not_called()
+
+    def test_union(self):
+        merged = MergedLinkQuery([1, 2, 3], "new")
+        with mock.patch.object(query_module, "lazy_merge") as merge:
+            self.assertEqual(merged.fetch(), self.expected(1, 2, 3))
+        merge.assert_not_called()
+
+    def test_invalidated_on_insert(self):
+        merged = MergedLinkQuery([1, 2], "new")
+        merged.fetch(0, 10)
+        other = MergedLinkQuery([3], "new")
+        other.fetch(0, 10)
+
+        LinkQuery(1, "new").insert([link(199, 1, 5000)])
+        self.assertFalse(self.conn.exists(merged._cache_key))
+        # listings without the feed are kept
+        self.assertTrue(self.conn.exists(other._cache_key))
+        self.assertEqual(merged.fetch_ids(0, 1), [199])
+
+    def test_no_feeds(self):
+        self.assertEqual(MergedLinkQuery([], "new").fetch(0, 10), [])
+
+
+class BulkInsertTests(ZSetQueryTestCase):
+    def test_grouped_per_feed(self):
+        for feed_id in [1, 2]:
+            LinkQuery(feed_id, "new").fetch(0, 10)
+        merged = MergedLinkQuery([1, 2], "new")
+        merged.fetch(0, 10)
+        self.rebuilt.clear()
+
+        links = [link(150, 1, 5000), link(250, 2, 5001), link(151, 1, 5002)]
+        with mock.patch.object(ZSetLinkQuery, "insert") as insert:
+            LinkQuery.bulk_insert(links, sorts=("new",))
+        # all queries are updated by single pipeline, not link by link
+        insert.assert_not_called()
+        self.assertEqual(self.rebuilt, [])
+        self.assertEqual(LinkQuery(1, "new").fetch_ids(0, 3), [151, 150, 119])
+        self.assertEqual(LinkQuery(2, "new").fetch_ids(0, 2), [250, 219])
+        self.assertFalse(self.conn.exists(merged._cache_key))
+
+    def test_missing_query_rebuilt(self):
+        LinkQuery.bulk_insert([link(150, 1, 5000)], sorts=("new",))
+        self.assertEqual(self.rebuilt, [1])
+        self.assertTrue(self.conn.exists(LinkQuery(1, "new")._cache_key))
+
+    def test_job(self):
+        for sort in ["trending", "new", "best"]:
+            LinkQuery(1, sort).fetch(0, 10)
+        links = [link(150, 1, 5000), link(151, 1, 5001)]
+        with mock.patch.object(LinkScores, "store") as store, mock.patch.object(
+            query_module, "CommentTree"
+        ) as tree:
+            JOB_add_links_to_queries(links)
+        store.assert_called_once_with(links)
+        self.assertEqual([c[0] for c in tree.call_args_list], [(150,), (151,)])
+        self.assertEqual(tree.return_value.create.call_count, 2)
+        for sort in ["trending", "new", "best"]:
+            self.assertEqual(LinkQuery(1, sort).fetch_ids(0, 2), [151, 150], sort)
+
+
+class MigrationKeyTests(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(_parse_key("cquery:12.best.all"), (12, "best", "all"))
+
+    def test_invalid(self):
+        self.assertIsNone(_parse_key("cquery:12.best"))
+        self.assertIsNone(_parse_key("cquery:abc.new.all"))
+        self.assertIsNone(_parse_key("cquery:1.hot.all"))
+        self.assertIsNone(_parse_key("cquery:1.best.<function <lambda> at 0x7f0>"))
+
+    def test_parse_window(self):
+        self.assertEqual(_parse_key("cquery:3.best.week"), (3, "best", "week"))
+
+
+if __name__ == "__main__":
+    unittest.main()
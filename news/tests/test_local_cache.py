@@ -0,0 +1,38 @@
+import unittest
+
+from news.lib.local_cache import LocalCache
+
+
+class LocalCacheTests(unittest.TestCase):
+    def test_get_set(self):
+        local = LocalCache(max_bytes=1024, ttl=60)
+        local.set("f:1", b"feed")
+        self.assertEqual(local.get("f:1"), b"feed")
+        self.assertIsNone(local.get("f:2"))
+
+    def test_evicts_least_recently_used(self):
+        local = LocalCache(max_bytes=20, ttl=60)
+        local.set("f:1", b"aaaaaa")
+        local.set("f:2", b"bbbbbb")
+        local.get("f:1")
+        local.set("f:3", b"cccccc")
+        self.assertIsNone(local.get("f:2"))
+        self.assertEqual(local.get("f:1"), b"aaaaaa")
+        self.assertLessEqual(local.size, 20)
+
+    def test_expire(self):
+        local = LocalCache(max_bytes=1024, ttl=-1)
+        local.set("f:1", b"feed")
+        self.assertIsNone(local.get("f:1"))
+        self.assertEqual(local.size, 0)
+
+    def test_delete(self):
+        local = LocalCache(max_bytes=1024, ttl=60)
+        local.set("f:1", b"feed")
+        local.delete("f:1")
+        self.assertIsNone(local.get("f:1"))
+        self.assertEqual(local.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
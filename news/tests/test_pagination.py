@@ -0,0 +1,110 @@
+import unittest
+from base64 import urlsafe_b64encode
+from unittest import mock
+
+from flask import Flask
+
+from news.clients.db.query import MergedLinkQuery
+from news.lib.global_listings import GlobalListing
+from news.lib.pagination import (
+    Cursor,
+    InvalidCursor,
+    NewestListing,
+    cursor_for_listing,
+    decode_cursor,
+    encode_cursor,
+    paginate_listing,
+    seek_rows,
+)
+
+ROWS = [[1, 9, 5], [2, 8, 7], [3, 8, 7], [4, 8, 6], [5, 2, 1]]
+
+
+def crafted(payload: str) -> str:
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+class CursorTests(unittest.TestCase):
+    def test_roundtrip(self):
+        cursor = decode_cursor(encode_cursor([42, 1.5, 1577836800], 7, 120))
+        self.assertEqual(cursor, Cursor([1.5, 1577836800], 42, 7, 120))
+
+    def test_without_position(self):
+        self.assertEqual(decode_cursor("W1sxXSwyLDNd"), Cursor([1], 2, 3, 0))
+
+    def test_invalid(self):
+        for value in [None, "", "x", "bm90IGpzb24", encode_cursor(["a", "b"])]:
+            self.assertIsNone(decode_cursor(value))
+
+    def test_malformed_key(self):
+        for payload in [
+            "[[],1,0,0]",
+            "[[1e400],1,0,0]",
+            "[[-1e400,1],1,0,0]",
+            "[[NaN],1,0,0]",
+            "[[true],1,0,0]",
+            "[[1%s],1,0,0]" % ("0" * 400),
+        ]:
+            self.assertIsNone(decode_cursor(crafted(payload)), payload)
+
+    def test_same_generation(self):
+        cursor = Cursor([8, 7], 2, 7, 120)
+        self.assertEqual(cursor_for_listing(cursor, 7), cursor)
+        self.assertIsNone(cursor_for_listing(None, 7))
+
+    def test_other_generation(self):
+        # stale cursor is seeked by its key, its position belongs to the old listing
+        cursor = cursor_for_listing(Cursor([8, 7], 2, 6, 120), 7)
+        self.assertEqual(cursor, Cursor([8, 7], 2, 6, 0))
+
+
+class SeekRowsTests(unittest.TestCase):
+    def test_after(self):
+        self.assertEqual(seek_rows(ROWS, Cursor([8, 7], 2, 0), 2), ROWS[2:4])
+
+    def test_before(self):
+        self.assertEqual(
+            seek_rows(ROWS, Cursor([8, 6], 4, 0), 2, before=True), ROWS[1:3]
+        )
+
+    def test_after_moved(self):
+        # link 3 was voted up since the cursor was created, page continues after its old position
+        self.assertEqual(seek_rows(ROWS, Cursor([7, 7], 3, 0), 2), ROWS[4:])
+
+    def test_before_moved(self):
+        self.assertEqual(
+            seek_rows(ROWS, Cursor([3, 1], 9, 0), 2, before=True), ROWS[2:4]
+        )
+
+    def test_end(self):
+        self.assertEqual(seek_rows(ROWS, Cursor([2, 1], 5, 0), 2), [])
+        self.assertEqual(seek_rows(ROWS, Cursor([9, 5], 1, 0), 2, before=True), [])
+
+
+class InvalidCursorTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_key_length(self):
+        trending = Cursor([1.5], 2, 0)
+        with self.assertRaises(InvalidCursor):
+            MergedLinkQuery([1, 2], "best").seek(trending, 5)
+        with self.assertRaises(InvalidCursor):
+            GlobalListing(ROWS, 0).seek(trending, 5)
+        with self.assertRaises(InvalidCursor):
+            NewestListing(mock.MagicMock()).seek(Cursor([1, 2], 2, 0), 5)
+
+    def test_creation_time_out_of_range(self):
+        with self.assertRaises(InvalidCursor):
+            NewestListing(mock.MagicMock()).seek(Cursor([1e300], 2, 0), 5)
+
+    def test_first_page(self):
+        listing = GlobalListing(ROWS, 0)
+        for cursor in [Cursor([8], 2, 0), Cursor([8, 7, 1], 2, 0)]:
+            for arg in ["after", "before"]:
+                query = {arg: encode_cursor([cursor.last_id] + cursor.key)}
+                with self.app.test_request_context(query_string=query):
+                    ids, less, more = paginate_listing(listing, 2)
+                self.assertEqual(ids, [1, 2])
+                self.assertIsNone(less)
+                self.assertIsNotNone(more)
@@ -0,0 +1,258 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from news.lib.cache import cache
+from news.lib.comments import update_comment
+from news.lib.tasks.tasks import JOB_update_link
+from news.models import vote as vote_module
+from news.models.link import Link
+from news.models.vote import (
+    DIRTY_KEY,
+    DOWNVOTE,
+    UNVOTE,
+    UPVOTE,
+    VOTE_STREAM_KEY,
+    LinkVote,
+)
+from news.scripts import flush_votes, update_rankings
+
+
+def query_returning(rows):
+    """
+    Query builder mock whose every chain ends with given rows
+    """
+    query = mock.MagicMock()
+    for method in ["select", "where", "where_in", "where_raw"]:
+        getattr(query, method).return_value = query
+    query.get.return_value = rows
+    return query
+
+
+@unittest.skipIf(fakeredis is None, "vote scripts need fakeredis with Lua support")
+class VoteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeRedis()
+        # users voted on nothing yet
+        self.query = query_returning([])
+        for patcher in [
+            mock.patch.object(cache, "conn", self.conn),
+            mock.patch.dict(vote_module._scripts, clear=True),
+            mock.patch.object(LinkVote, "query", return_value=self.query),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def vote(self, user_id, link_id, vote_type, ups=0, downs=0):
+        vote = LinkVote(user_id=user_id, link_id=link_id, vote_type=vote_type)
+        vote._relations["link"] = SimpleNamespace(id=link_id, ups=ups, downs=downs)
+        return vote.apply()
+
+    def counters(self, link_id):
+        counters = self.conn.hgetall(LinkVote._counters_key(link_id))
+        return int(counters[b"ups"]), int(counters[b"downs"])
+
+    def voted(self, user_id, link_id):
+        return [
+            self.conn.sismember(LinkVote._set_key(user_id, vote_type), link_id)
+            for vote_type in [UPVOTE, DOWNVOTE]
+        ]
+
+
+class VoteStateTests(VoteTestCase):
+    def test_first_vote(self):
+        self.assertEqual(self.vote(1, 5, UPVOTE, ups=3), UNVOTE)
+        self.assertEqual(self.counters(5), (4, 0))
+        self.assertEqual(self.voted(1, 5), [True, False])
+        self.assertEqual(self.conn.xlen(VOTE_STREAM_KEY), 1)
+        self.assertIsNotNone(self.conn.zscore(DIRTY_KEY.format("link"), 5))
+
+    def test_same_vote(self):
+        self.vote(1, 5, UPVOTE)
+        self.assertIsNone(self.vote(1, 5, UPVOTE))
+        self.assertEqual(self.counters(5), (1, 0))
+        # nothing changed so nothing is written
+        self.assertEqual(self.conn.xlen(VOTE_STREAM_KEY), 1)
+
+    def test_changed_vote(self):
+        self.vote(1, 5, UPVOTE)
+        self.assertEqual(self.vote(1, 5, DOWNVOTE), UPVOTE)
+        self.assertEqual(self.counters(5), (0, 1))
+        self.assertEqual(self.voted(1, 5), [False, True])
+
+    def test_unvote(self):
+        self.vote(1, 5, DOWNVOTE)
+        self.assertEqual(self.vote(1, 5, UNVOTE), DOWNVOTE)
+        self.assertEqual(self.counters(5), (0, 0))
+        self.assertEqual(self.voted(1, 5), [False, False])
+
+    def test_votes_of_more_users(self):
+        self.vote(1, 5, UPVOTE)
+        self.vote(2, 5, UPVOTE)
+        self.vote(3, 5, DOWNVOTE)
+        self.assertEqual(self.counters(5), (2, 1))
+
+    def test_dirty_since_first_vote(self):
+        with mock.patch("time.time", return_value=100):
+            self.vote(1, 5, UPVOTE)
+        with mock.patch("time.time", return_value=200):
+            self.vote(2, 5, UPVOTE)
+        self.assertEqual(self.conn.zscore(DIRTY_KEY.format("link"), 5), 100)
+
+    def test_loads_votes_once(self):
+        self.query.get.return_value = [
+            LinkVote(user_id=1, link_id=7, vote_type=DOWNVOTE)
+        ]
+        self.vote(1, 5, UPVOTE)
+        self.vote(1, 6, UPVOTE)
+        self.assertEqual(self.query.get.call_count, 1)
+        self.assertEqual(self.voted(1, 7), [False, True])
+
+
+class VotesByUserTests(VoteTestCase):
+    def test_page_votes(self):
+        self.vote(1, 5, UPVOTE)
+        self.vote(1, 6, DOWNVOTE)
+        self.vote(2, 7, UPVOTE)
+        self.assertEqual(LinkVote.votes_by_user(1, [5, 6, 7]), {5: UPVOTE, 6: DOWNVOTE})
+
+    def test_loads_missing_sets(self):
+        self.query.get.return_value = [LinkVote(user_id=1, link_id=7, vote_type=UPVOTE)]
+        self.assertEqual(LinkVote.votes_by_user(1, [5, 7]), {7: UPVOTE})
+        self.assertEqual(self.voted(1, 7), [True, False])
+
+
+class ArchiveTests(VoteTestCase):
+    def test_archive_things(self):
+        self.vote(1, 5, UPVOTE)
+        self.vote(2, 5, DOWNVOTE)
+        self.vote(1, 6, UPVOTE)
+        self.query.get.return_value = [
+            LinkVote(user_id=1, link_id=5, vote_type=UPVOTE),
+            LinkVote(user_id=2, link_id=5, vote_type=DOWNVOTE),
+        ]
+        LinkVote.archive_things([5])
+        self.query.delete.assert_called_once_with()
+        self.assertEqual(self.voted(1, 5), [False, False])
+        self.assertEqual(self.voted(2, 5), [False, False])
+        self.assertEqual(self.voted(1, 6), [True, False])
+        self.assertFalse(self.conn.exists(LinkVote._counters_key(5)))
+
+
+class FlushTests(VoteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = mock.MagicMock()
+        for patcher in [
+            mock.patch.object(vote_module, "db", self.db),
+            mock.patch("news.clients.db.db.db", self.db),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        flush_votes.create_group()
+
+    def statements(self):
+        return [call[0] for call in self.db.statement.call_args_list]
+
+    def test_round_trip(self):
+        self.vote(1, 5, UPVOTE)
+        self.vote(2, 5, UPVOTE)
+        self.vote(1, 5, DOWNVOTE)
+        self.conn.set(Link._cache_key_from_id(5), b"cached")
+
+        self.assertEqual(flush_votes.flush_votes(), 3)
+        (insert, votes), (update, counters) = self.statements()
+        self.assertTrue(insert.startswith("INSERT INTO link_votes"))
+        # only the last vote of every user is written
+        self.assertEqual(votes, [1, 5, DOWNVOTE, 2, 5, UPVOTE])
+        self.assertTrue(update.startswith("UPDATE links"))
+        self.assertEqual(counters, [5, 1, 1])
+
+        self.assertEqual(self.conn.xlen(VOTE_STREAM_KEY), 0)
+        self.assertEqual(
+            self.conn.xpending(VOTE_STREAM_KEY, flush_votes.GROUP)["pending"], 0
+        )
+        self.assertFalse(self.conn.exists(Link._cache_key_from_id(5)))
+        self.assertEqual(flush_votes.flush_votes(), 0)
+
+    def test_failed_batch_stays_in_stream(self):
+        self.vote(1, 5, UPVOTE)
+        self.db.statement.side_effect = RuntimeError("db down")
+        with self.assertRaises(RuntimeError):
+            flush_votes.flush_votes()
+        self.assertEqual(self.conn.xlen(VOTE_STREAM_KEY), 1)
+
+    def test_lost_group(self):
+        self.vote(1, 5, UPVOTE)
+        self.conn.xgroup_destroy(VOTE_STREAM_KEY, flush_votes.GROUP)
+        self.assertEqual(flush_votes.flush_votes(), 1)
+
+
+class RankingTests(VoteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ranked = []
+        for patcher in [
+            mock.patch.object(
+                LinkVote,
+                "things_with_counters",
+                side_effect=lambda ids: [SimpleNamespace(id=id) for id in ids],
+            ),
+            mock.patch.object(
+                LinkVote,
+                "update_ranking",
+                side_effect=lambda things: self.ranked.append(
+                    sorted(thing.id for thing in things)
+                ),
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_due_kinds(self):
+        with mock.patch("time.time", return_value=100):
+            self.vote(1, 5, UPVOTE)
+            self.vote(1, 6, UPVOTE)
+        self.assertEqual(update_rankings.due_kinds(5, 10, now=102), [])
+        self.assertEqual(update_rankings.due_kinds(5, 10, now=105), ["link"])
+        self.assertEqual(update_rankings.due_kinds(5, 2, now=102), ["link"])
+
+    def test_ranked_together(self):
+        for link_id in [5, 6, 7]:
+            self.vote(1, link_id, UPVOTE)
+            self.vote(2, link_id, UPVOTE)
+        self.assertEqual(update_rankings.update_rankings(0, 1), {"link": 3})
+        self.assertEqual(self.ranked, [[5, 6, 7]])
+        self.assertEqual(self.conn.zcard(DIRTY_KEY.format("link")), 0)
+
+    def test_failed_ranking(self):
+        with mock.patch("time.time", return_value=100):
+            self.vote(1, 5, UPVOTE)
+        LinkVote.update_ranking.side_effect = RuntimeError("db down")
+        with self.assertRaises(RuntimeError):
+            update_rankings.update_rankings(0, 1)
+        # things wait for next run since their first vote
+        self.assertEqual(self.conn.zscore(DIRTY_KEY.format("link"), 5), 100)
+
+    def test_queued_jobs(self):
+        # jobs enqueued by the previous release only mark things dirty
+        with mock.patch("time.time", return_value=100):
+            self.vote(1, 5, UPVOTE)
+        with mock.patch("time.time", return_value=200):
+            JOB_update_link(SimpleNamespace(id=5))
+            JOB_update_link(SimpleNamespace(id=6))
+            update_comment(SimpleNamespace(id=7, link_id=5))
+        self.assertEqual(
+            self.conn.zrange(DIRTY_KEY.format("link"), 0, -1, withscores=True),
+            [(b"5", 100), (b"6", 200)],
+        )
+        self.assertEqual(self.conn.zscore(DIRTY_KEY.format("comment"), 7), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
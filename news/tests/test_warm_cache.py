@@ -0,0 +1,98 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from news.clients.db.query import LinkQuery
+from news.lib.cache import cache
+from news.models.ban import Ban
+from news.models.base import Base
+from news.models.feed import Feed
+from news.models.link import Link
+from news.models.user import User
+from news.scripts import warm_cache
+
+# top link ids of every feed, link 3 is on top of both feeds
+TOP_IDS = {1: [1, 2, 3], 2: [3, 4]}
+
+
+def thing(**attrs):
+    return SimpleNamespace(write_to_cache=mock.MagicMock(), **attrs)
+
+
+@unittest.skipIf(fakeredis is None, "warm-up tests need fakeredis")
+class WarmCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeRedis()
+        self.bans = [thing(id=1)]
+        self.feeds = [thing(id=1, slug="python"), thing(id=2, slug="rust")]
+        self.queries = []
+
+        def fetch_ids(query):
+            self.queries.append((query.feed_id, query.sort))
+            return TOP_IDS[query.feed_id]
+
+        def links_by_ids(ids):
+            return [
+                SimpleNamespace(id=id, slug="l{}".format(id), user_id=id % 2)
+                for id in ids
+            ]
+
+        self.users_by_ids = mock.MagicMock(
+            side_effect=lambda ids: [SimpleNamespace(id=id) for id in ids]
+        )
+        for patcher in [
+            mock.patch.object(cache, "conn", self.conn),
+            mock.patch.object(Base, "query", return_value=mock.MagicMock()),
+            mock.patch.object(
+                Ban, "where_raw", return_value=mock.MagicMock(get=lambda: self.bans)
+            ),
+            mock.patch.object(Feed, "all", return_value=self.feeds),
+            mock.patch.object(LinkQuery, "fetch_ids", fetch_ids),
+            mock.patch.object(Link, "by_ids", side_effect=links_by_ids),
+            mock.patch.object(User, "by_ids", self.users_by_ids),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def warm(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return warm_cache.warm_cache(**kwargs)
+
+    def test_warm_cache(self):
+        summary = self.warm(workers=2)
+        self.assertEqual(
+            summary, {"bans": 1, "feeds": 2, "queries": 6, "links": 4, "users": 2}
+        )
+        self.bans[0].write_to_cache.assert_called_once_with()
+        for feed in self.feeds:
+            feed.write_to_cache.assert_called_once_with()
+        self.assertEqual(self.conn.get("fslug:rust"), b"2")
+        self.assertEqual(
+            sorted(self.queries),
+            sorted((feed_id, sort) for feed_id in [1, 2] for sort in warm_cache.SORTS),
+        )
+        # links on top of more queries are loaded once
+        self.assertEqual(self.conn.get("lslug:l3"), cache._encode("lslug:l3", 3))
+        self.assertEqual(sorted(self.users_by_ids.call_args[0][0]), [0, 1])
+
+    def test_top_links(self):
+        self.assertEqual(self.warm(top_links=1)["links"], 2)
+
+    def test_status(self):
+        self.warm()
+        status = self.conn.hgetall(warm_cache.STATUS_KEY)
+        self.assertEqual(status[b"state"], b"done")
+        self.assertEqual(status[b"links"], b"4")
+        self.assertIn(b"elapsed", status)
+        self.assertGreater(self.conn.ttl(warm_cache.STATUS_KEY), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()